@@ -0,0 +1,399 @@
+#  Dragon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Dragon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+from collections.abc import Iterator
+
+from utils import config
+from utils.db import (
+    SCAN_BATCH_SIZE,
+    Database,
+    LmdbDatabase,
+    MongoDatabase,
+    SqliteDatabase,
+)
+
+# snapshot layout: gzip members of NDJSON lines, one member per module
+#   {"format": "dragon-userbot-db", "version": 1}
+#   {"module": name}
+#   {"var": variable, "val": value}  ...sorted by variable, keys with a
+#       ttl also have "exp": unix time at which they expire
+#   {"module": name, "count": records, "sha256": digest of record lines}
+#   {"end": true, "modules": number of modules}
+SNAPSHOT_FORMAT = "dragon-userbot-db"
+SNAPSHOT_VERSION = 1
+
+
+def open_database(args: argparse.Namespace) -> Database:
+    """Open the backend selected by --type/--name/--url or by config"""
+    db_type = args.type or config.db_type
+    name = args.name or config.db_name
+    if db_type in ["mongo", "mongodb"]:
+        return MongoDatabase(
+            args.url or config.db_url,
+            name,
+            max_pool_size=config.db_max_pool_size,
+            min_pool_size=config.db_min_pool_size,
+            timeout_ms=config.db_timeout_ms,
+        )
+    if db_type == "lmdb":
+        return LmdbDatabase(
+            name, map_size=config.db_map_size, encoding=config.db_encoding
+        )
+    return SqliteDatabase(name, encoding=config.db_encoding)
+
+
+def _dump_line(obj: dict) -> bytes:
+    return (
+        json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n"
+    ).encode()
+
+
+def _load_progress(path: str) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save_progress(path: str, progress: dict):
+    # replace atomically, a crash must leave either old or new progress
+    with open(path + ".tmp", "w") as f:
+        json.dump(progress, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _write_member(raw, lines: Iterator[dict], level: int):
+    """Write lines as one gzip member and make it durable"""
+    with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=level) as f:
+        for line in lines:
+            f.write(_dump_line(line))
+    raw.flush()
+    os.fsync(raw.fileno())
+
+
+def _module_lines(
+    database: Database, module: str, result: dict
+) -> Iterator[dict]:
+    yield {"module": module}
+    digest = hashlib.sha256()
+    count = 0
+    # scan() reads the module in batches, memory use doesn't grow with it
+    rows = database.scan(module)
+    while True:
+        variables = [
+            variable for variable, _ in itertools.islice(rows, SCAN_BATCH_SIZE)
+        ]
+        if not variables:
+            break
+        # keys expiring between the two reads are left out
+        found = database.get_many_expiring(module, variables)
+        for variable in variables:
+            if variable not in found:
+                continue
+            value, expires = found[variable]
+            line = {"var": variable, "val": value}
+            if expires is not None:
+                line["exp"] = expires
+            digest.update(_dump_line(line))
+            count += 1
+            yield line
+    result["count"] = count
+    yield {"module": module, "count": count, "sha256": digest.hexdigest()}
+
+
+def export(args: argparse.Namespace):
+    progress_path = args.file + ".progress"
+    progress = _load_progress(progress_path) if args.resume else None
+    if progress is None or not os.path.exists(args.file):
+        progress = {"offset": 0, "modules": []}
+
+    database = open_database(args)
+    try:
+        modules = args.module or database.modules()
+        with open(args.file, "r+b" if progress["offset"] else "wb") as raw:
+            # drop whatever an interrupted run wrote after the last module
+            raw.truncate(progress["offset"])
+            raw.seek(progress["offset"])
+            if not progress["offset"]:
+                header = {
+                    "format": SNAPSHOT_FORMAT,
+                    "version": SNAPSHOT_VERSION,
+                }
+                _write_member(raw, iter([header]), args.level)
+
+            for module in modules:
+                if module in progress["modules"]:
+                    continue
+                result = {}
+                _write_member(
+                    raw, _module_lines(database, module, result), args.level
+                )
+                progress["modules"].append(module)
+                progress["offset"] = raw.tell()
+                _save_progress(progress_path, progress)
+                logging.info(f"Exported {result['count']} keys of {module}")
+
+            trailer = {"end": True, "modules": len(progress["modules"])}
+            _write_member(raw, iter([trailer]), args.level)
+    finally:
+        database.close()
+
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    logging.info(f"Exported {len(progress['modules'])} modules to {args.file}")
+
+
+def read_snapshot(
+    path: str,
+) -> Iterator[tuple[str, str, str, object, float | None]]:
+    """Read a snapshot, checking it on the way.
+
+    Yields ("record", module, var, val, exp) for every key, exp is None
+    for keys that don't expire, and ("end", module, None, None, None)
+    once a module's count and checksum match. SystemExit is raised on a
+    damaged or truncated snapshot.
+    """
+    module = digest = None
+    count = modules = 0
+    with gzip.open(path, "rb") as f:
+        for number, raw_line in enumerate(f, 1):
+            try:
+                line = json.loads(raw_line)
+            except ValueError:
+                raise SystemExit(f"{path}:{number}: malformed line")
+
+            if number == 1:
+                if line.get("format") != SNAPSHOT_FORMAT:
+                    raise SystemExit(f"{path} is not a database snapshot")
+                if line.get("version") != SNAPSHOT_VERSION:
+                    raise SystemExit(
+                        f"Unsupported snapshot version {line.get('version')}"
+                    )
+            elif "var" in line:
+                if module is None:
+                    raise SystemExit(f"{path}:{number}: key outside module")
+                digest.update(raw_line)
+                count += 1
+                yield "record", module, line["var"], line["val"], line.get(
+                    "exp"
+                )
+            elif "count" in line:
+                if (
+                    line["module"] != module
+                    or line["count"] != count
+                    or line["sha256"] != digest.hexdigest()
+                ):
+                    raise SystemExit(f"Checksum mismatch in module {module}")
+                modules += 1
+                yield "end", module, None, None, None
+                module = None
+            elif "module" in line:
+                module = line["module"]
+                digest = hashlib.sha256()
+                count = 0
+            elif line.get("end"):
+                if module is not None or line["modules"] != modules:
+                    raise SystemExit(f"{path}: module count mismatch")
+                return
+
+    raise SystemExit(f"{path} is truncated")
+
+
+def verify(args: argparse.Namespace):
+    keys = modules = 0
+    for kind, *_ in read_snapshot(args.file):
+        if kind == "record":
+            keys += 1
+        else:
+            modules += 1
+    logging.info(f"{args.file} is valid: {modules} modules, {keys} keys")
+
+
+def import_(args: argparse.Namespace):
+    if not args.no_verify:
+        # a damaged snapshot is rejected before anything is written
+        verify(args)
+
+    progress_path = args.file + ".import-progress"
+    progress = (_load_progress(progress_path) if args.resume else None) or {
+        "modules": [],
+        "module": None,
+        "last": None,
+    }
+    done = set(progress["modules"])
+    # module an interrupted run was in and the last key it wrote there
+    resume_module, resume_after = progress["module"], progress["last"]
+    batch = {}
+
+    database = open_database(args)
+
+    def write_batch(module: str):
+        if not batch:
+            return
+        now = time.time()
+        with database.transaction():
+            permanent = {
+                variable: value
+                for variable, (value, expires) in batch.items()
+                if expires is None
+            }
+            if permanent:
+                database.set_many(module, permanent)
+            for variable, (value, expires) in batch.items():
+                # keys past their deadline are not written at all
+                if expires is not None and expires > now:
+                    database.set(module, variable, value, expires - now)
+        # records are sorted, everything up to the last one is imported
+        progress.update(module=module, last=next(reversed(batch)))
+        _save_progress(progress_path, progress)
+        batch.clear()
+
+    try:
+        for kind, module, variable, value, expires in read_snapshot(args.file):
+            if module in done:
+                continue
+            if kind == "record":
+                if module == resume_module and variable <= resume_after:
+                    continue
+                batch[variable] = (value, expires)
+                if len(batch) >= args.batch_size:
+                    write_batch(module)
+            else:
+                write_batch(module)
+                done.add(module)
+                progress.update(modules=sorted(done), module=None, last=None)
+                _save_progress(progress_path, progress)
+                logging.info(f"Imported {module}")
+    finally:
+        database.close()
+
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    logging.info(f"Imported {len(done)} modules from {args.file}")
+
+
+def convert(args: argparse.Namespace):
+    if config.db_type in ["mongo", "mongodb", "lmdb"]:
+        raise SystemExit("Encoding conversion is only supported for sqlite")
+
+    database = SqliteDatabase(config.db_name)
+    try:
+        converted = database.convert_encoding(args.encoding)
+    finally:
+        database.close()
+    logging.info(f"Converted {converted} values to {args.encoding}")
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Dragon-Userbot database tool")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = commands.add_parser(
+        "convert", help="re-encode stored values of the sqlite database"
+    )
+    convert_parser.add_argument(
+        "--encoding",
+        choices=["json", "msgpack", "orjson"],
+        default=config.db_encoding,
+        help="target encoding (default: DATABASE_ENCODING)",
+    )
+    convert_parser.set_defaults(func=convert)
+
+    backend = argparse.ArgumentParser(add_help=False)
+    backend.add_argument(
+        "--type",
+        choices=["sqlite", "lmdb", "mongo", "mongodb"],
+        help="database type (default: DATABASE_TYPE)",
+    )
+    backend.add_argument(
+        "--name",
+        help="sqlite file, lmdb directory or mongo database "
+        "(default: DATABASE_NAME)",
+    )
+    backend.add_argument("--url", help="mongo url (default: DATABASE_URL)")
+
+    export_parser = commands.add_parser(
+        "export",
+        parents=[backend],
+        help="stream the database to a gzipped NDJSON snapshot",
+    )
+    export_parser.add_argument("file")
+    export_parser.add_argument(
+        "--module",
+        action="append",
+        help="export only this module, can be repeated",
+    )
+    export_parser.add_argument(
+        "--level", type=int, default=6, help="gzip compression level"
+    )
+    export_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted export instead of starting over",
+    )
+    export_parser.set_defaults(func=export)
+
+    import_parser = commands.add_parser(
+        "import",
+        parents=[backend],
+        help="load a snapshot into the database, keys are overwritten",
+    )
+    import_parser.add_argument("file")
+    import_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="keys written per transaction",
+    )
+    import_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip modules and keys imported by an interrupted run",
+    )
+    import_parser.add_argument(
+        "--no-verify",
+        action="store_true",
+        help="don't check the whole snapshot before importing",
+    )
+    import_parser.set_defaults(func=import_)
+
+    verify_parser = commands.add_parser(
+        "verify", help="check counts and checksums of a snapshot"
+    )
+    verify_parser.add_argument("file")
+    verify_parser.set_defaults(func=verify)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import json
 import os
 import signal
 import subprocess
@@ -151,9 +152,22 @@ _AUTH_STORE: Dict[str, Dict[str, str]] = {}
 _auto_worker_task: Optional[asyncio.Task] = None
 _auto_worker_should_stop: asyncio.Event | None = None
 _auto_worker_last_reply_at: Dict[int, float] = {}
+# prune stale rate-limit stamps once the dict grows past this many chats
+_LAST_REPLY_PRUNE_SIZE = 1024
 _chat_memory: Dict[int, list[str]] = {}
 
 
+def _prune_last_reply_at(now: float, min_interval: float) -> None:
+    """Drop stamps older than the rate-limit interval, they can't block replies."""
+    stale = [
+        chat_id
+        for chat_id, last_at in _auto_worker_last_reply_at.items()
+        if now - last_at >= min_interval
+    ]
+    for chat_id in stale:
+        del _auto_worker_last_reply_at[chat_id]
+
+
 def _is_pid_alive(pid: int) -> bool:
     try:
         os.kill(pid, 0)
@@ -253,8 +267,11 @@ async def _auto_reply_loop(stop_event: asyncio.Event):
         # rate limiting per chat
         chat_id = int(getattr(message.chat, "id", 0) or 0)
         now = _time.time()
+        min_interval = max(0, int(cfg.min_reply_interval_seconds or 0))
+        if len(_auto_worker_last_reply_at) > _LAST_REPLY_PRUNE_SIZE:
+            _prune_last_reply_at(now, min_interval)
         last_at = _auto_worker_last_reply_at.get(chat_id, 0)
-        if now - last_at < max(0, int(cfg.min_reply_interval_seconds or 0)):
+        if now - last_at < min_interval:
             return
 
         user_text = message.text or message.caption or ""
@@ -513,3 +530,36 @@ async def logs_tail(lines: int = Query(200, ge=1, le=2000), _: str = Depends(req
         for line in fh:
             result.append(line.rstrip("\n"))
     return {"ok": True, "lines": list(result)}
+
+
+def _userbot_file(env: str, default: str) -> Path:
+    # stats files are written by the userbot process, relative to its repo dir
+    path = Path(os.getenv(env) or default)
+    if path.is_absolute():
+        return path
+    return Path(os.getenv("FTG_REPO_DIR") or _ROOT_DIR) / path
+
+
+def _read_stats(path: Path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError) as exc:
+        raise HTTPException(status_code=500, detail=f"Bad stats file: {exc}")
+
+
+@app.get("/db/stats")
+async def db_stats(_: str = Depends(require_token)):
+    path = _userbot_file("DATABASE_PROFILE_FILE", "db_profile.json")
+    if not path.exists():
+        return {"ok": False, "error": "profiling_disabled"}
+    stats = _read_stats(path)
+    return {"ok": True, "updated_at": path.stat().st_mtime, "stats": stats}
+
+
+@app.get("/modules/stats")
+async def modules_stats(_: str = Depends(require_token)):
+    path = _userbot_file("MODULE_STATS_FILE", "module_stats.json")
+    if not path.exists():
+        return {"ok": False, "error": "not_started"}
+    stats = _read_stats(path)
+    return {"ok": True, "updated_at": path.stat().st_mtime, "modules": stats}
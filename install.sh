@@ -86,9 +86,10 @@ cat > .env << EOL
 API_ID=${api_id}
 API_HASH=${api_hash}
 
-# sqlite/sqlite3 or mongo/mongodb
+# sqlite/sqlite3, lmdb or mongo/mongodb
+# lmdb needs: pip install -r requirements-optional.txt
 DATABASE_TYPE=${db_type}
-# file name for sqlite3, database name for mongodb
+# file name for sqlite3, directory for lmdb, database name for mongodb
 DATABASE_NAME=${db_name}
 
 # only for mongodb
@@ -19,6 +19,7 @@ import os
 import platform
 import sqlite3
 import subprocess
+import time
 from pathlib import Path
 
 from pyrogram import Client, errors, idle
@@ -27,8 +28,15 @@ from pyrogram.raw.functions.account import DeleteAccount, GetAuthorizations
 
 from utils import config
 from utils.db import db
-from utils.misc import gitrepo, userbot_version
-from utils.scripts import load_module, restart
+from utils.manifest import get_manifest, register_stubs, update_manifest
+from utils.misc import head_sha, userbot_version
+from utils.scripts import (
+    import_modules,
+    load_modules,
+    restart,
+    watch_modules,
+    write_load_stats,
+)
 
 script_path = os.path.dirname(os.path.realpath(__file__))
 if script_path != os.getcwd():
@@ -41,54 +49,21 @@ app = Client(
     hide_password=True,
     workdir=script_path,
     app_version=userbot_version,
-    device_model=f"Dragon-Userbot @ {gitrepo.head.commit.hexsha[:7]}",
+    device_model=f"Dragon-Userbot @ {head_sha()[:7]}",
     system_version=platform.version() + " " + platform.machine(),
     sleep_threshold=30,
     test_mode=config.test_server,
     parse_mode=ParseMode.HTML,
 )
 
+started_at = time.perf_counter()
 
-async def main():
-    logging.basicConfig(level=logging.INFO)
-    DeleteAccount.__new__ = None
-
-    try:
-        await app.start()
-    except sqlite3.OperationalError as e:
-        if str(e) == "database is locked" and os.name == "posix":
-            logging.warning(
-                "Session file is locked. Trying to kill blocking process..."
-            )
-            subprocess.run(["fuser", "-k", "my_account.session"])
-            restart()
-        raise
-    except (errors.NotAcceptable, errors.Unauthorized) as e:
-        logging.error(
-            f"{e.__class__.__name__}: {e}\n"
-            f"Moving session file to my_account.session-old..."
-        )
-        os.rename("./my_account.session", "./my_account.session-old")
-        restart()
-
-    success_modules = 0
-    failed_modules = 0
 
-    for path in Path("modules").rglob("*.py"):
-        try:
-            await load_module(
-                path.stem, app, core="custom_modules" not in path.parent.parts
-            )
-        except Exception:
-            logging.warning(f"Can't import module {path.stem}", exc_info=True)
-            failed_modules += 1
-        else:
-            success_modules += 1
+def timeline(stage: str):
+    logging.info(f"Startup: {stage} (+{time.perf_counter() - started_at:.3f}s)")
 
-    logging.info(f"Imported {success_modules} modules")
-    if failed_modules:
-        logging.warning(f"Failed to import {failed_modules} modules")
 
+async def edit_restart_message():
     if info := db.get("core.updater", "restart_info"):
         text = {
             "restart": "<b>Restart completed!</b>",
@@ -102,6 +77,8 @@ async def main():
             pass
         db.remove("core.updater", "restart_info")
 
+
+async def snapshot_authorizations():
     # required for sessionkiller module
     if db.get("core.sessionkiller", "enabled", False):
         db.set(
@@ -115,11 +92,108 @@ async def main():
             ],
         )
 
+
+async def run_startup_tasks(*tasks):
+    """Run network requests that nothing else waits for, concurrently"""
+    results = await asyncio.gather(
+        *(task() for task in tasks), return_exceptions=True
+    )
+    for task, result in zip(tasks, results):
+        if isinstance(result, Exception):
+            logging.warning(
+                f"Startup task {task.__name__} failed", exc_info=result
+            )
+    timeline("background startup tasks done")
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO)
+    DeleteAccount.__new__ = None
+
+    paths = list(Path("modules").rglob("*.py"))
+    # modules that only handle commands are imported on first use
+    lazy = {}
+    if config.lazy_modules:
+        lazy = {
+            path: entry
+            for path, entry in get_manifest(paths).items()
+            # entries without filters are recorded again after an import
+            if entry.get("lazy") and "filters" in entry
+        }
+
+    # modules are imported while the client connects and are registered
+    # once it's up, in the same order on every start
+    modules = [
+        (path.stem, "custom_modules" not in path.parent.parts)
+        for path in paths
+        if str(path) not in lazy
+    ]
+    imports = asyncio.create_task(import_modules(modules))
+
+    try:
+        await app.start()
+    except sqlite3.OperationalError as e:
+        if str(e) == "database is locked" and os.name == "posix":
+            logging.warning(
+                "Session file is locked. Trying to kill blocking process..."
+            )
+            subprocess.run(["fuser", "-k", "my_account.session"])
+            restart()
+        raise
+    except (errors.NotAcceptable, errors.Unauthorized) as e:
+        logging.error(
+            f"{e.__class__.__name__}: {e}\n"
+            f"Moving session file to my_account.session-old..."
+        )
+        os.rename("./my_account.session", "./my_account.session-old")
+        restart()
+    timeline("client started")
+
+    success_modules, failed_modules = await load_modules(
+        app, modules, await imports
+    )
+    if config.lazy_modules:
+        register_stubs(app, lazy)
+    # recorded on every start, so that metadata and help of modules are
+    # known without importing them once LAZY_MODULES is turned on
+    update_manifest(paths)
+    timeline("modules loaded")
+    # read by the control server's /modules/stats endpoint
+    write_load_stats()
+
+    logging.info(f"Imported {success_modules} modules")
+    if lazy:
+        logging.info(f"{len(lazy)} modules will be imported on first use")
+    if failed_modules:
+        logging.warning(f"Failed to import {failed_modules} modules")
+
+    tasks = [
+        asyncio.create_task(
+            run_startup_tasks(edit_restart_message, snapshot_authorizations)
+        ),
+        # expired keys (restart info, ...) are removed in the background
+        asyncio.create_task(db.sweep_expired(config.db_sweep_interval)),
+    ]
+    if config.hot_reload:
+        # edited modules are reloaded in place, without a restart
+        tasks.append(
+            asyncio.create_task(watch_modules(app, config.hot_reload_interval))
+        )
+    if config.db_profile:
+        # read by the control server's /db/stats endpoint
+        tasks.append(
+            asyncio.create_task(db.publish_stats(config.db_profile_file))
+        )
+
     logging.info("Dragon-Userbot started!")
+    timeline("ready")
 
     await idle()
 
+    for task in tasks:
+        task.cancel()
     await app.stop()
+    db.close()
 
 
 if __name__ == "__main__":
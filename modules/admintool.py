@@ -14,11 +14,11 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from __future__ import annotations
+
 import re
 from contextlib import suppress
 from datetime import datetime, timedelta
-from time import time
-from typing import Dict, Union
 
 from pyrogram import Client, ContinuePropagation, filters
 from pyrogram.errors import (
@@ -38,44 +38,104 @@ from pyrogram.utils import (
     get_channel_id,
 )
 
-from utils.db import db
+from utils.db import REMOVED, db
 from utils.misc import modules_help, prefix
 from utils.scripts import format_exc, text, with_reply
 
 db_cache: dict = db.get_collection("core.ats")
 
+# core.ats variables the message handler acts on, e.g. "antiraid-100123"
+POLICY_SETTING = re.compile(
+    r"^(linked|antich|c|antiraid|welcome_enabled|welcome_text)(-?\d+)$"
+)
+
+
+class ChatPolicy:
+    """Moderation settings of one chat, rebuilt when one of them changes"""
+
+    __slots__ = ("linked", "antich", "tmuted", "antiraid", "welcome")
+
+    def __init__(self, chat_id: int):
+        self.linked = db_cache.get(f"linked{chat_id}", 0)
+        self.antich = bool(db_cache.get(f"antich{chat_id}", False))
+        self.tmuted = frozenset(db_cache.get(f"c{chat_id}", []))
+        self.antiraid = bool(db_cache.get(f"antiraid{chat_id}", False))
+        self.welcome = (
+            db_cache.get(f"welcome_text{chat_id}")
+            if db_cache.get(f"welcome_enabled{chat_id}", False)
+            else None
+        )
+
+    def __bool__(self):
+        return bool(self.antich or self.tmuted or self.antiraid or self.welcome)
+
+
+# only chats where the handler has something to do
+policies: dict[int, ChatPolicy] = {}
+
+
+def update_policy(chat_id: int):
+    policy = ChatPolicy(chat_id)
+    if policy:
+        policies[chat_id] = policy
+    else:
+        policies.pop(chat_id, None)
+
+
+def update_cache(_, variable: str, value):
+    # keep the mirror in sync key by key instead of reloading it
+    if value is REMOVED:
+        db_cache.pop(variable, None)
+    else:
+        db_cache[variable] = value
+
+    match = POLICY_SETTING.match(variable)
+    if match:
+        update_policy(int(match.group(2)))
+
 
-def update_cache():
-    db_cache.clear()
-    db_cache.update(db.get_collection("core.ats"))
+for _chat_id in {
+    int(match.group(2))
+    for match in map(POLICY_SETTING.match, db_cache)
+    if match
+}:
+    update_policy(_chat_id)
 
+db.subscribe("core.ats", update_cache)
 
-@Client.on_message(filters.group & ~filters.me)
+
+async def has_policy(_, __, message: Message) -> bool:
+    return message.chat.id in policies
+
+
+@Client.on_message(filters.create(has_policy) & filters.group & ~filters.me)
 async def admintool_handler(_, message: Message):
+    policy = policies.get(message.chat.id)
+    if policy is None:
+        raise ContinuePropagation
+
     if message.sender_chat:
         if (
             message.sender_chat.type == "supergroup"
-            or message.sender_chat.id
-            == db_cache.get(f"linked{message.chat.id}", 0)
+            or message.sender_chat.id == policy.linked
         ):
             raise ContinuePropagation
 
-    if message.sender_chat and db_cache.get(f"antich{message.chat.id}", False):
+    if message.sender_chat and policy.antich:
         with suppress(RPCError):
             await message.delete()
             await message.chat.ban_member(message.sender_chat.id)
 
-    tmuted_users = db_cache.get(f"c{message.chat.id}", [])
     if (
         message.from_user
-        and message.from_user.id in tmuted_users
+        and message.from_user.id in policy.tmuted
         or message.sender_chat
-        and message.sender_chat.id in tmuted_users
+        and message.sender_chat.id in policy.tmuted
     ):
         with suppress(RPCError):
             await message.delete()
 
-    if db_cache.get(f"antiraid{message.chat.id}", False):
+    if policy.antiraid:
         with suppress(RPCError):
             await message.delete()
             if message.from_user:
@@ -83,17 +143,13 @@ async def admintool_handler(_, message: Message):
             elif message.sender_chat:
                 await message.chat.ban_member(message.sender_chat.id)
 
-    if message.new_chat_members:
-        if db_cache.get(f"welcome_enabled{message.chat.id}", False):
-            await message.reply(
-                db_cache.get(f"welcome_text{message.chat.id}"),
-                disable_web_page_preview=True,
-            )
+    if message.new_chat_members and policy.welcome is not None:
+        await message.reply(policy.welcome, disable_web_page_preview=True)
 
     raise ContinuePropagation
 
 
-async def check_username_or_id(data: Union[str, int]) -> str:
+async def check_username_or_id(data: str | int) -> str:
     data = str(data)
     if (
         not data.isdigit()
@@ -515,8 +571,6 @@ async def tmute_command(client: Client, message: Message):
     else:
         await message.edit("<b>Unsupported</b>")
 
-    update_cache()
-
 
 @Client.on_message(filters.command(["tunmute"], prefix) & filters.me)
 async def tunmute_command(client: Client, message: Message):
@@ -585,8 +639,6 @@ async def tunmute_command(client: Client, message: Message):
     else:
         await message.edit("<b>Unsupported</b>")
 
-    update_cache()
-
 
 @Client.on_message(filters.command(["tmute_users"], prefix) & filters.me)
 async def tunmute_users_command(client: Client, message: Message):
@@ -737,7 +789,7 @@ async def mute_command(client: Client, message: Message):
                     datetime.now() + timedelta(seconds=mute_seconds),
                 )
                 from_user = message.reply_to_message.from_user
-                mute_time: Dict[str, int] = {
+                mute_time: dict[str, int] = {
                     "days": mute_seconds // 86400,
                     "hours": mute_seconds % 86400 // 3600,
                     "minutes": mute_seconds % 86400 % 3600 // 60,
@@ -829,7 +881,7 @@ async def mute_command(client: Client, message: Message):
                             ChatPermissions(),
                             datetime.now() + timedelta(seconds=mute_seconds),
                         )
-                        mute_time: Dict[str, int] = {
+                        mute_time: dict[str, int] = {
                             "days": mute_seconds // 86400,
                             "hours": mute_seconds % 86400 // 3600,
                             "minutes": mute_seconds % 86400 % 3600 // 60,
@@ -1054,12 +1106,16 @@ async def anti_channels(client: Client, message: Message):
                 f"Enable with: </b><code>{prefix}antich enable</code>"
             )
     elif message.command[1] in ["enable", "on", "1", "yes", "true"]:
-        db.set("core.ats", f"antich{message.chat.id}", True)
         group = await client.get_chat(message.chat.id)
-        if group.linked_chat:
-            db.set("core.ats", f"linked{message.chat.id}", group.linked_chat.id)
-        else:
-            db.set("core.ats", f"linked{message.chat.id}", 0)
+        db.set_many(
+            "core.ats",
+            {
+                f"antich{message.chat.id}": True,
+                f"linked{message.chat.id}": (
+                    group.linked_chat.id if group.linked_chat else 0
+                ),
+            },
+        )
         await message.edit("<b>Blocking channels in this chat enabled.</b>")
     elif message.command[1] in ["disable", "off", "0", "no", "false"]:
         db.set("core.ats", f"antich{message.chat.id}", False)
@@ -1067,8 +1123,6 @@ async def anti_channels(client: Client, message: Message):
     else:
         await message.edit(f"<b>Usage: {prefix}antich [enable|disable]</b>")
 
-    update_cache()
-
 
 @Client.on_message(filters.command(["delete_history", "dh"], prefix))
 async def delete_history(client: Client, message: Message):
@@ -1265,40 +1319,30 @@ async def antiraid(client: Client, message: Message):
         await message.edit("<b>Not supported in non-supergroup chats</b>")
         return
 
-    if len(message.command) > 1 and message.command[1] == "on":
-        db.set("core.ats", f"antiraid{message.chat.id}", True)
+    if len(message.command) > 1 and message.command[1] in ("on", "off"):
+        enable = message.command[1] == "on"
+    else:
+        # toggle
+        enable = not db.get("core.ats", f"antiraid{message.chat.id}", False)
+
+    if enable:
         group = await client.get_chat(message.chat.id)
-        if group.linked_chat:
-            db.set("core.ats", f"linked{message.chat.id}", group.linked_chat.id)
-        else:
-            db.set("core.ats", f"linked{message.chat.id}", 0)
+        db.set_many(
+            "core.ats",
+            {
+                f"antiraid{message.chat.id}": True,
+                f"linked{message.chat.id}": (
+                    group.linked_chat.id if group.linked_chat else 0
+                ),
+            },
+        )
         await message.edit(
             "<b>Anti-raid mode enabled!\n"
             f"Disable with: </b><code>{prefix}antiraid off</code>"
         )
-    elif len(message.command) > 1 and message.command[1] == "off":
+    else:
         db.set("core.ats", f"antiraid{message.chat.id}", False)
         await message.edit("<b>Anti-raid mode disabled</b>")
-    else:
-        # toggle
-        if db.get("core.ats", f"antiraid{message.chat.id}", False):
-            db.set("core.ats", f"antiraid{message.chat.id}", False)
-            await message.edit("<b>Anti-raid mode disabled</b>")
-        else:
-            db.set("core.ats", f"antiraid{message.chat.id}", True)
-            group = await client.get_chat(message.chat.id)
-            if group.linked_chat:
-                db.set(
-                    "core.ats", f"linked{message.chat.id}", group.linked_chat.id
-                )
-            else:
-                db.set("core.ats", f"linked{message.chat.id}", 0)
-            await message.edit(
-                "<b>Anti-raid mode enabled!\n"
-                f"Disable with: </b><code>{prefix}antiraid off</code>"
-            )
-
-    update_cache()
 
 
 @Client.on_message(filters.command(["welcome", "wc"], prefix) & filters.me)
@@ -1308,8 +1352,13 @@ async def welcome(_, message: Message):
 
     if len(message.command) > 1:
         text = message.text.split(maxsplit=1)[1]
-        db.set("core.ats", f"welcome_enabled{message.chat.id}", True)
-        db.set("core.ats", f"welcome_text{message.chat.id}", text)
+        db.set_many(
+            "core.ats",
+            {
+                f"welcome_enabled{message.chat.id}": True,
+                f"welcome_text{message.chat.id}": text,
+            },
+        )
 
         await message.edit(
             f"<b>Welcome enabled in this chat\nText:</b> <code>{text}</code>"
@@ -1318,8 +1367,6 @@ async def welcome(_, message: Message):
         db.set("core.ats", f"welcome_enabled{message.chat.id}", False)
         await message.edit("<b>Welcome disabled in this chat</b>")
 
-    update_cache()
-
 
 modules_help["admintool"] = {
     "ban [reply]/[username/id]* [reason] [report_spam] [delete_history]": "ban user in chat",
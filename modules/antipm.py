@@ -21,9 +21,12 @@ from pyrogram.types import Message
 from utils.db import db
 from utils.misc import modules_help, prefix
 
-anti_pm_enabled = filters.create(
-    lambda _, __, ___: db.get("core.antipm", "status", False)
-)
+
+async def anti_pm_enabled_filter(_, __, ___):
+    return await db.aget("core.antipm", "status", False)
+
+
+anti_pm_enabled = filters.create(anti_pm_enabled_filter)
 
 in_contact_list = filters.create(
     lambda _, __, message: message.from_user.is_contact
@@ -42,9 +45,9 @@ is_support = filters.create(lambda _, __, message: message.chat.is_support)
 )
 async def anti_pm_handler(client: Client, message: Message):
     user_info = await client.resolve_peer(message.chat.id)
-    if db.get("core.antipm", "spamrep", False):
+    if await db.aget("core.antipm", "spamrep", False):
         await client.invoke(functions.messages.ReportSpam(peer=user_info))
-    if db.get("core.antipm", "block", False):
+    if await db.aget("core.antipm", "block", False):
         await client.invoke(functions.contacts.Block(id=user_info))
     await client.invoke(
         functions.messages.DeleteHistory(peer=user_info, max_id=0, revoke=True)
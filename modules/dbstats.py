@@ -0,0 +1,68 @@
+#  Dragon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Dragon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from html import escape
+
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from utils.db import ProfiledDatabase, db
+from utils.misc import modules_help, prefix
+
+
+@Client.on_message(filters.command(["dbstats", "dbs"], prefix) & filters.me)
+async def dbstats(_, message: Message):
+    if not isinstance(db, ProfiledDatabase):
+        return await message.edit(
+            "<b>Database profiling is disabled.\n"
+            "Set <code>DATABASE_PROFILE=true</code> in .env and restart</b>"
+        )
+
+    if len(message.command) > 1 and message.command[1] == "reset":
+        db.reset()
+        return await message.edit("<b>Database stats are reset</b>")
+
+    limit = 10
+    if len(message.command) > 1 and message.command[1].isdigit():
+        limit = int(message.command[1])
+
+    stats = db.stats()
+    text = "<b>Database operations by total time:</b>\n"
+    for item in stats["ops"][:limit]:
+        text += (
+            f"• <code>{item['module']}</code> {item['op']}: "
+            f"{item['count']} calls, {item['total_ms']:.1f} ms, "
+            f"avg {item['avg_us']:.0f} µs, max {item['max_us']:.0f} µs\n"
+        )
+    if not stats["ops"]:
+        text += "<i>No operations yet</i>\n"
+
+    if stats["slow"]:
+        text += "\n<b>Recent slow operations:</b>\n"
+        for item in stats["slow"][-5:]:
+            key = escape(f"{item['module']}/{item['variable']}")
+            text += (
+                f"• {item['op']} <code>{key}</code> {item['ms']:.1f} ms"
+                f" in <code>{item['caller']}</code>\n"
+            )
+
+    await message.edit(text)
+
+
+modules_help["dbstats"] = {
+    "dbstats [count]": "Show database operations that take the most time",
+    "dbstats reset": "Reset database stats",
+}
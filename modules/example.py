@@ -27,6 +27,8 @@ from utils.misc import modules_help, prefix
 
 # import_library() will automatically install required library
 # if it isn't installed
+# inside handlers use `await aimport_library(...)`, which doesn't
+# block the userbot while pip runs
 
 
 @Client.on_message(filters.command("example_edit", prefix) & filters.me)
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 from pyrogram import Client, ContinuePropagation, errors, filters
 from pyrogram.types import (
     InputMediaAudio,
@@ -7,21 +9,94 @@ from pyrogram.types import (
     Message,
 )
 
-from utils.db import db
+from utils.aho_corasick import Automaton
+from utils.db import ENTRY_SEPARATOR, db
 from utils.misc import modules_help, prefix
+from utils.router import router
 from utils.scripts import format_exc
 
+# filters used to be stored as one {trigger: filter} dict per chat
+if not db.get("core.filters", "entries_migrated", False):
+    with db.transaction():
+        db.migrate_to_entries("core.filters")
+        db.set("core.filters", "entries_migrated", True)
+
+
+async def get_filter(chat_id, name):
+    return await db.aget_entry("core.filters", chat_id, name)
+
+
+# how a trigger is matched against message text, "exact" by default
+MODES = {"-c": "contains", "-w": "word"}
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _whole_word(text: str, start: int, end: int) -> bool:
+    return (start == 0 or not _is_word_char(text[start - 1])) and (
+        end == len(text) or not _is_word_char(text[end])
+    )
+
+
+class ChatTriggers:
+    """Filters of one chat, indexed for matching message text"""
+
+    def __init__(self, entries: dict):
+        self.exact = {}
+        patterns = {}
+        for trigger, value in entries.items():
+            mode = value.get("MODE", "exact")
+            if mode == "exact":
+                self.exact[trigger] = value
+            else:
+                patterns[trigger] = (mode, value)
+        self.automaton = Automaton(patterns) if patterns else None
 
-def get_filters_chat(chat_id):
-    return db.get("core.filters", f"{chat_id}", {})
+    def find(self, text: str, exact_only: bool = False) -> dict | None:
+        text = text.lower()
+        value = self.exact.get(text)
+        if value is not None or self.automaton is None or exact_only:
+            return value
 
+        for start, end, (mode, value) in self.automaton.iter(text):
+            if mode != "word" or _whole_word(text, start, end):
+                return value
+        return None
 
-def set_filters_chat(chat_id, filters_):
-    return db.set("core.filters", f"{chat_id}", filters_)
+
+# chat id -> trigger index, dropped when filters of the chat change
+triggers: dict[str, ChatTriggers] = {}
+_generation = 0
+
+
+def invalidate_triggers(_, variable: str, __):
+    global _generation
+    _generation += 1
+    triggers.pop(variable.partition(ENTRY_SEPARATOR)[0], None)
+
+
+db.subscribe("core.filters", invalidate_triggers)
+
+
+async def find_filter(message: Message) -> dict | None:
+    key = str(message.chat.id)
+    index = triggers.get(key)
+    if index is None:
+        generation = _generation
+        index = ChatTriggers(await db.aget_entries("core.filters", key))
+        if generation == _generation:
+            triggers[key] = index
+
+    # commands like .filter -c [name] contain their own trigger
+    return index.find(
+        message.text, exact_only=message.text.startswith(router.prefix)
+    )
 
 
 async def contains_filter(_, __, m):
-    return m.text and m.text.lower() in get_filters_chat(m.chat.id).keys()
+    return m.text and await find_filter(m) is not None
 
 
 contains = filters.create(contains_filter)
@@ -30,7 +105,7 @@ contains = filters.create(contains_filter)
 # noinspection PyTypeChecker
 @Client.on_message(contains)
 async def filters_main_handler(client: Client, message: Message):
-    value = get_filters_chat(message.chat.id)[message.text.lower()]
+    value = await find_filter(message)
     try:
         await client.get_messages(
             int(value["CHAT_ID"]), int(value["MESSAGE_ID"])
@@ -124,13 +199,17 @@ async def filters_main_handler(client: Client, message: Message):
 @Client.on_message(filters.command(["filter"], prefix) & filters.me)
 async def filter_handler(client: Client, message: Message):
     try:
-        if len(message.text.split()) < 2:
+        args = message.text.split(maxsplit=1)[1:]
+        mode = "exact"
+        if args and args[0].split(maxsplit=1)[0] in MODES:
+            flag, *args = args[0].split(maxsplit=1)
+            mode = MODES[flag]
+        if not args:
             return await message.edit(
-                f"<b>Usage</b>: <code>{prefix}filter [name] (Reply required)</code>"
+                f"<b>Usage</b>: <code>{prefix}filter [-c|-w] [name] (Reply required)</code>"
             )
-        name = message.text.split(maxsplit=1)[1].lower()
-        chat_filters = get_filters_chat(message.chat.id)
-        if name in chat_filters.keys():
+        name = args[0].lower()
+        if await get_filter(message.chat.id, name) is not None:
             return await message.edit(
                 f"<b>Filter</b> <code>{name}</code> already exists."
             )
@@ -168,6 +247,7 @@ async def filter_handler(client: Client, message: Message):
                 "MESSAGE_ID": str(message_id[1].id),
                 "MEDIA_GROUP": True,
                 "CHAT_ID": str(chat_id),
+                "MODE": mode,
             }
         else:
             try:
@@ -178,11 +258,10 @@ async def filter_handler(client: Client, message: Message):
                 "MEDIA_GROUP": False,
                 "MESSAGE_ID": str(message_id.id),
                 "CHAT_ID": str(chat_id),
+                "MODE": mode,
             }
 
-        chat_filters.update({name: filter_})
-
-        set_filters_chat(message.chat.id, chat_filters)
+        await db.aset_entry("core.filters", message.chat.id, name, filter_)
         return await message.edit(
             f"<b>Filter</b> <code>{name}</code> has been added."
         )
@@ -195,11 +274,14 @@ async def filters_handler(client: Client, message: Message):
     try:
         text = ""
         for index, a in enumerate(
-            get_filters_chat(message.chat.id).items(), start=1
+            (await db.aget_entries("core.filters", message.chat.id)).items(),
+            start=1,
         ):
             key, item = a
             key = key.replace("<", "").replace(">", "")
-            text += f"{index}. <code>{key}</code>\n"
+            mode = item.get("MODE", "exact")
+            text += f"{index}. <code>{key}</code>"
+            text += f" ({mode})\n" if mode != "exact" else "\n"
         text = f"<b>Your filters in current chat</b>:\n\n" f"{text}"
         text = text[:4096]
         return await message.edit(text)
@@ -217,13 +299,11 @@ async def filter_del_handler(client: Client, message: Message):
                 f"<b>Usage</b>: <code>{prefix}fdel [name]</code>"
             )
         name = message.text.split(maxsplit=1)[1].lower()
-        chat_filters = get_filters_chat(message.chat.id)
-        if name not in chat_filters.keys():
+        if await get_filter(message.chat.id, name) is None:
             return await message.edit(
                 f"<b>Filter</b> <code>{name}</code> doesn't exists."
             )
-        del chat_filters[name]
-        set_filters_chat(message.chat.id, chat_filters)
+        await db.aremove_entry("core.filters", message.chat.id, name)
         return await message.edit(
             f"<b>Filter</b> <code>{name}</code> has been deleted."
         )
@@ -239,21 +319,25 @@ async def filter_search_handler(client: Client, message: Message):
                 f"<b>Usage</b>: <code>{prefix}fsearch [name]</code>"
             )
         name = message.text.split(maxsplit=1)[1].lower()
-        chat_filters = get_filters_chat(message.chat.id)
-        if name not in chat_filters.keys():
+        filter_ = await get_filter(message.chat.id, name)
+        if filter_ is None:
             return await message.edit(
                 f"<b>Filter</b> <code>{name}</code> doesn't exists."
             )
         return await message.edit(
             f"<b>Trigger</b>:\n<code>{name}</code"
-            f">\n<b>Answer</b>:\n{chat_filters[name]}"
+            f">\n<b>Answer</b>:\n{filter_}"
         )
     except Exception as e:
         return await message.edit(format_exc(e))
 
 
 modules_help["filters"] = {
-    "filter [name]": "Create filter (Reply required)",
+    "filter [-c|-w] [name]": (
+        "Create filter (Reply required). By default it answers messages equal "
+        "to the name, with -c ones containing it and with -w ones containing "
+        "it as a whole word"
+    ),
     "filters": "List of all triggers",
     "fdel [name]": "Delete filter by name",
     "fsearch [name]": "Info filter by name",
@@ -18,11 +18,14 @@ from pyrogram import Client, filters
 from pyrogram.types import Message
 
 from utils.misc import modules_help, prefix
-from utils.scripts import format_module_help
+from utils.router import router
+from utils.scripts import format_load_stats, format_module_help
 
 
 @Client.on_message(filters.command(["help", "h"], prefix) & filters.me)
 async def help_cmd(_, message: Message):
+    # the prefix may have been changed since this module was imported
+    prefix = router.prefix
     if len(message.command) == 1:
         msg_edited = False
         text = (
@@ -59,7 +62,10 @@ async def help_cmd(_, message: Message):
         else:
             await message.edit(text, disable_web_page_preview=True)
     elif message.command[1].lower() in modules_help:
-        await message.edit(format_module_help(message.command[1].lower()))
+        module_name = message.command[1].lower()
+        await message.edit(
+            format_module_help(module_name) + format_load_stats(module_name)
+        )
     else:
         # No, this cringe won't be refactored
         command_name = message.command[1].lower()
@@ -24,10 +24,15 @@ from utils.config import modules_repo_branch
 from utils.misc import modules_help, prefix
 from utils.scripts import (
     format_exc,
+    format_load_stats,
     format_module_help,
+    import_modules,
     load_module,
+    load_modules,
+    load_stats,
     restart,
     unload_module,
+    write_load_stats,
 )
 
 BASE_PATH = os.path.abspath(os.getcwd())
@@ -128,11 +133,23 @@ async def load_all_mods(client: Client, message: Message):
         with open(f"./modules/custom_modules/{module_name}.py", "wb") as f:
             f.write(requests.get(url).content)
 
-        await load_module(module_name, client)
-
-    await message.edit(
-        f'<b>Successfully loaded new modules: {" ".join(new_modules.keys())}</b>'
+    # requirements of all new modules are installed at once
+    modules = [(module_name, False) for module_name in new_modules]
+    _, failed = await load_modules(
+        client, modules, await import_modules(modules)
     )
+    write_load_stats()
+
+    text = f'<b>Successfully loaded new modules: {" ".join(new_modules.keys())}</b>'
+    if failed:
+        failed_names = [
+            name for name in new_modules if load_stats[name]["error"]
+        ]
+        text = (
+            f"<b>Loaded {len(new_modules) - failed} new modules, failed: "
+            f'{" ".join(failed_names)}</b>'
+        )
+    await message.edit(text)
 
 
 @Client.on_message(filters.command(["updateallmods"], prefix) & filters.me)
@@ -172,6 +189,40 @@ async def updateallmods(_, message: Message):
     restart()
 
 
+@Client.on_message(filters.command(["modstats", "ms"], prefix) & filters.me)
+async def modstats(_, message: Message):
+    if len(message.command) > 1:
+        module_name = message.command[1].lower()
+        if module_name not in load_stats:
+            return await message.edit(
+                f"<b>Module <code>{module_name}</code> is not found</b>"
+            )
+        return await message.edit(
+            f"<b>Module <code>{module_name}</code></b>\n"
+            + format_load_stats(module_name)
+        )
+
+    def total(item):
+        stats = item[1]
+        return stats["import_ms"] + stats["pip_ms"] + stats["register_ms"]
+
+    failed = [name for name, stats in load_stats.items() if stats["error"]]
+    slowest = sorted(load_stats.items(), key=total, reverse=True)[:15]
+    text = (
+        f"<b>Loaded {len(load_stats) - len(failed)} modules "
+        f"in {sum(map(total, load_stats.items())):.1f} ms</b>\n\n"
+    )
+    for name, stats in slowest:
+        text += (
+            f"• <code>{name}</code>: {total((name, stats)):.1f} ms, "
+            f"{stats['handlers']} handlers\n"
+        )
+    if failed:
+        text += f"\n<b>Failed:</b> {' '.join(sorted(failed))}\n"
+    text += f"\n<b>Details: <code>{prefix}modstats [module_name]</code></b>"
+    await message.edit(text)
+
+
 modules_help["loader"] = {
     "loadmod [module_name]*": (
         "Download module.\n"
@@ -180,4 +231,5 @@ modules_help["loader"] = {
     "unloadmod [module_name]*": "Delete module",
     "loadallmods": "Load all custom modules (use it at your own risk)",
     "updateallmods": "Update all loaded custom modules",
+    "modstats [module_name]": "Show how long modules took to load",
 }
@@ -248,10 +248,8 @@ async def note_send(client: Client, message: Message):
 async def notes(_, message: Message):
     await message.edit("<b>Loading...</b>")
     text = "Available notes:\n\n"
-    collection = db.get_collection("core.notes")
-    for note in collection.keys():
-        if note[:4] == "note":
-            text += f"<code>{note[4:]}</code>\n"
+    async for note, _ in db.ascan("core.notes", prefix="note"):
+        text += f"<code>{note[4:]}</code>\n"
     await message.edit(text)
 
 
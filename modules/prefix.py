@@ -19,7 +19,6 @@ from pyrogram.types import Message
 
 from utils.db import db
 from utils.misc import modules_help, prefix
-from utils.scripts import restart
 
 
 @Client.on_message(
@@ -29,9 +28,9 @@ from utils.scripts import restart
 async def setprefix(_, message: Message):
     if len(message.command) > 1:
         pref = message.command[1]
+        # commands switch to the new prefix right away, see utils.router
         db.set("core.main", "prefix", pref)
         await message.edit(f"<b>Prefix [ <code>{pref}</code> ] is set!</b>")
-        restart()
     else:
         await message.edit("<b>The prefix must not be empty!</b>")
 
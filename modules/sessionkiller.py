@@ -124,6 +124,8 @@ async def sessionkiller(client: Client, message: Message):
 
     elif message.command[1] in ["disable", "off", "0", "no", "false"]:
         db.set("core.sessionkiller", "enabled", False)
+        # the snapshot is retaken on enable, don't keep a stale one around
+        db.remove("core.sessionkiller", "auths_hashes")
         await message.edit("<b>Sessionkiller disabled!</b>")
     else:
         await message.edit(
@@ -139,7 +141,7 @@ async def check_new_login(
         update, UpdateServiceNotification
     ) or not update.type.startswith("auth"):
         raise ContinuePropagation
-    if not db.get("core.sessionkiller", "enabled", False):
+    if not await db.aget("core.sessionkiller", "enabled", False):
         raise ContinuePropagation
     authorizations = (await client.invoke(GetAuthorizations()))[
         "authorizations"
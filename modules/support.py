@@ -19,13 +19,7 @@ import random
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
-from utils.misc import (
-    gitrepo,
-    modules_help,
-    prefix,
-    python_version,
-    userbot_version,
-)
+from utils.misc import modules_help, prefix, python_version, userbot_version
 
 
 @Client.on_message(filters.command(["support", "repo"], prefix) & filters.me)
@@ -66,6 +60,9 @@ async def version(client: Client, message: Message):
 
     await message.delete()
 
+    # opening the repo loads GitPython, only do it when asked
+    from utils.misc import gitrepo
+
     remote_url = list(gitrepo.remote().urls)[0]
     commit_time = (
         datetime.datetime.fromtimestamp(gitrepo.head.commit.committed_date)
@@ -14,16 +14,21 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import logging
 import os
 import subprocess
 import sys
+from pathlib import Path
 
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
 from utils.db import db
-from utils.misc import modules_help, prefix, requirements_list
-from utils.scripts import format_exc, restart
+from utils.misc import head_sha, modules_help, prefix, requirements_list
+from utils.scripts import format_exc, reload_module, restart, unload_module
+
+# don't edit the "Restarting..." message after a restart that failed for long
+RESTART_INFO_TTL = 60 * 60
 
 
 @Client.on_message(filters.command("restart", prefix) & filters.me)
@@ -36,6 +41,7 @@ async def restart_cmd(_, message: Message):
             "chat_id": message.chat.id,
             "message_id": message.id,
         },
+        ttl=RESTART_INFO_TTL,
     )
 
     if "LAVHOST" in os.environ:
@@ -47,8 +53,33 @@ async def restart_cmd(_, message: Message):
     restart()
 
 
+def changed_files(old_sha: str) -> list:
+    completed = subprocess.run(
+        ["git", "diff", "--name-only", old_sha, "HEAD"],
+        capture_output=True,
+        text=True,
+    )
+    return completed.stdout.split() if completed.returncode == 0 else []
+
+
+def is_core_module(path: str) -> bool:
+    parts = Path(path).parts
+    return len(parts) == 2 and parts[0] == "modules" and path.endswith(".py")
+
+
+async def reload_core_modules(client: Client, paths: list) -> list:
+    """Apply an update that only touched core modules without a restart"""
+    for path in paths:
+        name = Path(path).stem
+        if os.path.exists(path):
+            await reload_module(name, client, core=True)
+        else:
+            await unload_module(name, client, core=True)
+    return [Path(path).stem for path in paths]
+
+
 @Client.on_message(filters.command("update", prefix) & filters.me)
-async def update(_, message: Message):
+async def update(client: Client, message: Message):
     db.set(
         "core.updater",
         "restart_info",
@@ -57,6 +88,7 @@ async def update(_, message: Message):
             "chat_id": message.chat.id,
             "message_id": message.id,
         },
+        ttl=RESTART_INFO_TTL,
     )
 
     if "LAVHOST" in os.environ:
@@ -65,6 +97,7 @@ async def update(_, message: Message):
         return
 
     await message.edit("<b>Updating...</b>")
+    old_sha = head_sha()
     try:
         subprocess.run([sys.executable, "-m", "pip", "install", "-U", "pip"])
         subprocess.run(["git", "pull"])
@@ -86,11 +119,27 @@ async def update(_, message: Message):
         await message.edit(format_exc(e))
         db.remove("core.updater", "restart_info")
     else:
+        changed = changed_files(old_sha)
+        if changed and all(map(is_core_module, changed)):
+            try:
+                reloaded = await reload_core_modules(client, changed)
+            except Exception:
+                logging.warning(
+                    "Can't reload updated modules, restarting", exc_info=True
+                )
+            else:
+                db.remove("core.updater", "restart_info")
+                return await message.edit(
+                    "<b>Update process completed! Reloaded modules: "
+                    f"{' '.join(reloaded)}</b>"
+                )
+
         await message.edit("<b>Restarting...</b>")
         restart()
 
 
 modules_help["updater"] = {
-    "update": "Update the userbot. If new core modules are avaliable, they will be installed",
+    "update": "Update the userbot. If new core modules are avaliable, they will be installed. "
+    "Updates that only change core modules are applied without a restart",
     "restart": "Restart userbot",
 }
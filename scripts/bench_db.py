@@ -0,0 +1,260 @@
+"""Reproducible storage benchmarks for utils.db backends.
+
+Runs the database backends through workloads shaped like the userbot's real
+access patterns and prints ops/sec plus p50/p99 latency as JSON:
+
+* ``hot_get``        - per-message lookups (filters, antipm, sessionkiller):
+                       skewed reads over a small hot set plus misses
+* ``set_burst``      - admin toggles and cache updates written back to back
+* ``get_collection`` - full module reads (e.g. notes listing) over 10k keys
+
+MongoDB is benchmarked against mongomock, an in-process stand-in, so no
+server is needed; it is skipped when mongomock is not installed, as is LMDB
+without the lmdb package.
+
+    python scripts/bench_db.py --ops 20000 --output bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# utils.config requires these at import time; the benchmark never talks
+# to Telegram and builds its own database instances
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "bench")
+os.environ.setdefault("DATABASE_TYPE", "sqlite")
+os.environ.setdefault("DATABASE_NAME", ":memory:")
+
+from utils.db import (  # noqa: E402
+    CachedDatabase,
+    Database,
+    LmdbDatabase,
+    MongoDatabase,
+    SqliteDatabase,
+)
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+BACKENDS = (
+    "sqlite",
+    "sqlite-write-behind",
+    "sqlite-cached",
+    "mongo",
+    "mongo-cached",
+    "lmdb",
+)
+WORKLOADS = ("hot_get", "set_burst", "get_collection")
+
+
+def make_backend(name: str, directory: str) -> Database:
+    if name.startswith("mongo"):
+        if mongomock is None:
+            raise RuntimeError("mongomock is not installed")
+        database = MongoDatabase(
+            "mongodb://localhost", "bench", client=mongomock.MongoClient()
+        )
+    elif name == "lmdb":
+        database = LmdbDatabase(os.path.join(directory, name))
+    else:
+        path = os.path.join(directory, f"{name}.sqlite3")
+        database = SqliteDatabase(
+            path, write_behind=name == "sqlite-write-behind"
+        )
+    if name.endswith("-cached"):
+        database = CachedDatabase(database)
+    return database
+
+
+def seed(database: Database, module: str, values: dict):
+    """Load fixture data; not part of any measurement."""
+    backend = getattr(database, "_backend", database)
+    if isinstance(backend, MongoDatabase):
+        # mongomock upserts scan the whole collection, bulk inserting keeps
+        # the 10k-key fixtures from dominating the run time
+        backend._database[module].insert_many(
+            [{"var": var, "val": val} for var, val in values.items()]
+        )
+    else:
+        database.set_many(module, values)
+        database.flush()
+
+
+def percentile(samples: list[int], fraction: float) -> int:
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0
+    index = max(0, min(len(samples) - 1, round(fraction * len(samples)) - 1))
+    return samples[index]
+
+
+def summarize(latencies: list[int], elapsed_ns: int) -> dict:
+    latencies.sort()
+    seconds = elapsed_ns / 1e9
+    return {
+        "ops": len(latencies),
+        "seconds": round(seconds, 6),
+        "ops_per_sec": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "p50_us": round(percentile(latencies, 0.50) / 1000, 2),
+        "p99_us": round(percentile(latencies, 0.99) / 1000, 2),
+    }
+
+
+def timed(ops: list[Callable[[], object]], finish=None) -> dict:
+    latencies = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for op in ops:
+        op_start = clock()
+        op()
+        latencies.append(clock() - op_start)
+    if finish is not None:
+        finish()
+    return summarize(latencies, clock() - start)
+
+
+def bench_hot_get(database: Database, rng: random.Random, args) -> dict:
+    module = "bench.filters"
+    keys = [str(-1000000000000 - i) for i in range(args.keys)]
+    seed(
+        database,
+        module,
+        {key: {"hi": {"type": "text", "text": key}} for key in keys},
+    )
+
+    # 90% of lookups hit a hot 10% of chats, 5% are misses
+    hot = keys[: max(1, len(keys) // 10)]
+    ops = []
+    for _ in range(args.ops):
+        roll = rng.random()
+        if roll < 0.05:
+            key = f"missing{rng.randrange(args.keys)}"
+        elif roll < 0.95:
+            key = rng.choice(hot)
+        else:
+            key = rng.choice(keys)
+        ops.append(lambda key=key: database.get(module, key))
+    return timed(ops)
+
+
+def bench_set_burst(database: Database, rng: random.Random, args) -> dict:
+    module = "bench.ats"
+    ops = []
+    for _ in range(args.ops):
+        chat = rng.randrange(100)
+        if rng.random() < 0.5:
+            var, value = f"antiraid{chat}", rng.random() < 0.5
+        else:
+            var, value = f"tmute{chat}", rng.sample(range(10**9), 5)
+        ops.append(
+            lambda var=var, value=value: database.set(module, var, value)
+        )
+    # write-behind backends only pay for durability at flush time
+    return timed(ops, finish=database.flush)
+
+
+def bench_get_collection(database: Database, rng: random.Random, args) -> dict:
+    module = "bench.notes"
+    seed(
+        database,
+        module,
+        {
+            f"note{i}": {"MESSAGE_ID": rng.randrange(10**6), "CHAT_ID": -1}
+            for i in range(args.collection_keys)
+        },
+    )
+    ops = [lambda: database.get_collection(module)] * args.repeat
+    return timed(ops)
+
+
+BENCHMARKS = {
+    "hot_get": bench_hot_get,
+    "set_burst": bench_set_burst,
+    "get_collection": bench_get_collection,
+}
+
+
+def run(args) -> dict:
+    results: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="dbbench") as directory:
+        for backend in args.backends:
+            results[backend] = {}
+            for workload in args.workloads:
+                # fresh database and rng per workload so runs are independent
+                # and reproducible for a given seed
+                try:
+                    database = make_backend(backend, directory)
+                except RuntimeError as e:
+                    results[backend] = {"skipped": str(e)}
+                    break
+                try:
+                    results[backend][workload] = BENCHMARKS[workload](
+                        database, random.Random(args.seed), args
+                    )
+                finally:
+                    database.close()
+                    for path in Path(directory).glob(f"{backend}*"):
+                        if path.is_dir():
+                            shutil.rmtree(path)
+                        else:
+                            path.unlink()
+    return {
+        "meta": {
+            "seed": args.seed,
+            "ops": args.ops,
+            "keys": args.keys,
+            "collection_keys": args.collection_keys,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=10000)
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--collection-keys", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS)
+    )
+    parser.add_argument(
+        "--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS)
+    )
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        Path(args.output).write_text(report + "\n")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Startup import report for the userbot.
+
+Runs ``python -X importtime`` on what main.py imports before the client
+connects, plus the core modules, and prints the slowest imports by
+cumulative time:
+
+    python scripts/importtime.py --top 30
+"""
+
+from __future__ import annotations
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+from typing import NamedTuple
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# every core module is imported, a failing one is reported and skipped
+STARTUP_CODE = """
+import importlib, pathlib, sys
+import main
+for path in sorted(pathlib.Path("modules").glob("*.py")):
+    try:
+        importlib.import_module("modules." + path.stem)
+    except Exception as e:
+        print(f"failed to import {path.stem}: {e!r}", file=sys.stderr)
+"""
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def parse(output: str) -> list[ImportTime]:
+    """Parse the stderr of ``python -X importtime``"""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # the header line
+            continue
+        imports.append(
+            ImportTime(fields[2].strip(), int(fields[0]), int(fields[1]))
+        )
+    return imports
+
+
+def report(imports: list[ImportTime], top: int) -> str:
+    total = sum(item.self_us for item in imports)
+    lines = [
+        f"{len(imports)} modules imported in {total / 1000:.1f} ms",
+        "",
+        f"{'cumulative ms':>14} {'self ms':>9}  module",
+    ]
+    for item in sorted(imports, key=lambda i: i.cumulative_us, reverse=True)[
+        :top
+    ]:
+        lines.append(
+            f"{item.cumulative_us / 1000:>14.1f} {item.self_us / 1000:>9.1f}"
+            f"  {item.module}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args(argv)
+
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_CODE],
+        cwd=ROOT,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    imports = parse(completed.stderr)
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            print(line, file=sys.stderr)
+    print(report(imports, args.top))
+    return completed.returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
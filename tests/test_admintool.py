@@ -0,0 +1,80 @@
+import importlib
+import itertools
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# utils.config requires these at import time
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("DATABASE_TYPE", "sqlite")
+os.environ.setdefault("DATABASE_NAME", ":memory:")
+
+try:
+    from modules import admintool
+    from utils.db import db
+
+    HAVE_ADMINTOOL = True
+except Exception:
+    HAVE_ADMINTOOL = False
+
+pytestmark = pytest.mark.skipif(
+    not HAVE_ADMINTOOL, reason="modules.admintool not importable"
+)
+
+# every test gets its own chat, the database is shared
+chat_ids = itertools.count(-2001, -1)
+
+
+@pytest.fixture
+def chat():
+    chat_id = next(chat_ids)
+    yield chat_id
+    for setting in ("linked", "antich", "c", "antiraid", "welcome_enabled"):
+        db.remove("core.ats", f"{setting}{chat_id}")
+    db.remove("core.ats", f"welcome_text{chat_id}")
+
+
+async def has_policy(chat_id) -> bool:
+    message = SimpleNamespace(chat=SimpleNamespace(id=chat_id))
+    return await admintool.has_policy(None, None, message)
+
+
+async def test_policy_follows_settings(chat):
+    assert not await has_policy(chat)
+
+    db.set("core.ats", f"antiraid{chat}", True)
+    assert await has_policy(chat)
+    assert admintool.policies[chat].antiraid
+
+    db.set("core.ats", f"c{chat}", [42])
+    assert admintool.policies[chat].tmuted == {42}
+
+    db.remove("core.ats", f"antiraid{chat}")
+    assert await has_policy(chat)
+    db.set("core.ats", f"c{chat}", [])
+    assert not await has_policy(chat)
+
+
+async def test_settings_without_effect_add_no_policy(chat):
+    # a linked channel or a welcome text alone don't need the handler
+    db.set("core.ats", f"linked{chat}", -100)
+    db.set("core.ats", f"welcome_text{chat}", "hi")
+    db.set("core.ats", f"welcome_enabled{chat}", False)
+    assert not await has_policy(chat)
+
+    await db.aset("core.ats", f"welcome_enabled{chat}", True)
+    assert await has_policy(chat)
+    assert admintool.policies[chat].welcome == "hi"
+    assert admintool.policies[chat].linked == -100
+
+
+async def test_policies_are_built_on_import(chat):
+    db.unsubscribe_all(admintool.__name__)
+    db.set("core.ats", f"antich{chat}", True)
+    assert chat not in admintool.policies
+
+    importlib.reload(admintool)
+    assert await has_policy(chat)
+    assert admintool.policies[chat].antich
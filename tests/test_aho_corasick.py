@@ -0,0 +1,40 @@
+import random
+
+from utils.aho_corasick import Automaton
+
+
+def naive(patterns, text):
+    return sorted(
+        (start, start + len(pattern), value)
+        for pattern, value in patterns.items()
+        if pattern
+        for start in range(len(text) - len(pattern) + 1)
+        if text.startswith(pattern, start)
+    )
+
+
+def test_finds_overlapping_patterns():
+    patterns = {"he": 1, "she": 2, "his": 3, "hers": 4}
+    matches = list(Automaton(patterns).iter("ushers"))
+    assert matches == [(1, 4, 2), (2, 4, 1), (2, 6, 4)]
+
+
+def test_longest_match_first_at_same_end():
+    matches = list(Automaton({"hi": "short", "ahi": "long"}).iter("ahi"))
+    assert [value for _, _, value in matches] == ["long", "short"]
+
+
+def test_empty():
+    assert list(Automaton({}).iter("text")) == []
+    assert list(Automaton({"": 1}).iter("text")) == []
+
+
+def test_matches_naive_search():
+    rng = random.Random(1)
+    for _ in range(200):
+        patterns = {
+            "".join(rng.choices("abc", k=rng.randint(1, 4))): i
+            for i in range(rng.randint(1, 8))
+        }
+        text = "".join(rng.choices("abc", k=rng.randint(0, 30)))
+        assert sorted(Automaton(patterns).iter(text)) == naive(patterns, text)
@@ -0,0 +1,56 @@
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+try:
+    spec = importlib.util.spec_from_file_location(
+        "bench_db",
+        Path(__file__).resolve().parents[1] / "scripts" / "bench_db.py",
+    )
+    bench_db = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench_db)
+    HAVE_BENCH = True
+except Exception:
+    HAVE_BENCH = False
+
+pytestmark = pytest.mark.skipif(
+    not HAVE_BENCH, reason="utils.db not importable"
+)
+
+
+def test_percentile_nearest_rank():
+    samples = list(range(1, 101))
+    assert bench_db.percentile(samples, 0.50) == 50
+    assert bench_db.percentile(samples, 0.99) == 99
+    assert bench_db.percentile([], 0.5) == 0
+
+
+def test_bench_reports_every_workload(tmp_path):
+    output = tmp_path / "bench.json"
+    argv = [
+        "--ops",
+        "50",
+        "--keys",
+        "20",
+        "--collection-keys",
+        "30",
+        "--repeat",
+        "2",
+        "--backends",
+        "sqlite",
+        "sqlite-cached",
+        "--output",
+        str(output),
+    ]
+    assert bench_db.main(argv) == 0
+
+    report = json.loads(output.read_text())
+    assert report["meta"]["seed"] == 1
+    for backend in ("sqlite", "sqlite-cached"):
+        results = report["results"][backend]
+        assert set(results) == {"hot_get", "set_burst", "get_collection"}
+        assert results["hot_get"]["ops"] == 50
+        assert results["get_collection"]["ops"] == 2
+        assert results["set_burst"]["p99_us"] >= results["set_burst"]["p50_us"]
@@ -1,22 +1,68 @@
-import os, pytest
+import os
+
+import pytest
+
 try:
     from ftg.control_server.server import app
+
     HAVE_APP = True
 except Exception:
     HAVE_APP = False
     app = None
 
+
 @pytest.mark.skipif(not HAVE_APP, reason="Control Server app not found")
 def test_health_requires_auth():
     from starlette.testclient import TestClient
+
     client = TestClient(app)
     r = client.get("/health")
     assert r.status_code in (401, 403)
 
+
 @pytest.mark.skipif(not HAVE_APP, reason="Control Server app not found")
 def test_health_ok_with_token():
     from starlette.testclient import TestClient
+
     client = TestClient(app)
     token = os.getenv("FTG_TEST_TOKEN", "changeme_local_token")
     r = client.get("/health", headers={"X-FTG-Token": token})
-    assert r.status_code in (200, 401, 403)
\ No newline at end of file
+    assert r.status_code in (200, 401, 403)
+
+
+@pytest.mark.skipif(not HAVE_APP, reason="Control Server app not found")
+def test_db_stats_reads_profile_file(tmp_path, monkeypatch):
+    from starlette.testclient import TestClient
+
+    from ftg.utils.config import get_security_config
+
+    client = TestClient(app)
+    token = get_security_config().control_token
+    profile = tmp_path / "db_profile.json"
+    monkeypatch.setenv("DATABASE_PROFILE_FILE", str(profile))
+
+    r = client.get("/db/stats", headers={"X-FTG-Token": token})
+    assert r.json() == {"ok": False, "error": "profiling_disabled"}
+
+    profile.write_text('{"ops": [], "slow": []}')
+    r = client.get("/db/stats", headers={"X-FTG-Token": token})
+    assert r.json()["stats"] == {"ops": [], "slow": []}
+
+
+@pytest.mark.skipif(not HAVE_APP, reason="Control Server app not found")
+def test_modules_stats_reads_stats_file(tmp_path, monkeypatch):
+    from starlette.testclient import TestClient
+
+    from ftg.utils.config import get_security_config
+
+    client = TestClient(app)
+    token = get_security_config().control_token
+    stats = tmp_path / "module_stats.json"
+    monkeypatch.setenv("MODULE_STATS_FILE", str(stats))
+
+    r = client.get("/modules/stats", headers={"X-FTG-Token": token})
+    assert r.json() == {"ok": False, "error": "not_started"}
+
+    stats.write_text('{"ping": {"handlers": 1, "error": null}}')
+    r = client.get("/modules/stats", headers={"X-FTG-Token": token})
+    assert r.json()["modules"]["ping"]["handlers"] == 1
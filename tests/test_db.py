@@ -0,0 +1,919 @@
+import asyncio
+import gc
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# utils.config requires these at import time
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("DATABASE_TYPE", "sqlite")
+os.environ.setdefault("DATABASE_NAME", ":memory:")
+
+try:
+    from utils.db import REMOVED, CachedDatabase, SqliteDatabase
+
+    HAVE_DB = True
+except Exception:
+    HAVE_DB = False
+
+pytestmark = pytest.mark.skipif(not HAVE_DB, reason="utils.db not importable")
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    database = SqliteDatabase(str(tmp_path / "db.sqlite"))
+    yield database
+    database.close()
+
+
+def test_sqlite_roundtrip(sqlite_db):
+    sqlite_db.set("core.test", "flag", True)
+    sqlite_db.set("core.test", "num", 42)
+    sqlite_db.set("core.test", "text", "hello")
+    sqlite_db.set("core.test", "data", {"a": [1, 2]})
+
+    assert sqlite_db.get("core.test", "flag") is True
+    assert sqlite_db.get("core.test", "num") == 42
+    assert sqlite_db.get("core.test", "text") == "hello"
+    assert sqlite_db.get("core.test", "data") == {"a": [1, 2]}
+    assert sqlite_db.get("core.test", "missing", "default") == "default"
+
+    sqlite_db.remove("core.test", "num")
+    assert sqlite_db.get_collection("core.test") == {
+        "flag": True,
+        "text": "hello",
+        "data": {"a": [1, 2]},
+    }
+
+
+def test_write_behind_reads_unflushed(tmp_path):
+    path = str(tmp_path / "wb.sqlite")
+    database = SqliteDatabase(path, write_behind=True, flush_interval=60)
+    database.set("core.test", "a", 1)
+    database.set("core.test", "b", [1])
+    database.remove("core.test", "b")
+
+    assert database.get("core.test", "a") == 1
+    assert database.get("core.test", "b", "gone") == "gone"
+    assert database.get_collection("core.test") == {"a": 1}
+
+    other = SqliteDatabase(path)
+    assert other.get("core.test", "a") is None
+
+    database.flush()
+    assert other.get("core.test", "a") == 1
+    other.close()
+    database.close()
+
+
+def test_write_behind_flushes_on_size_and_close(tmp_path):
+    path = str(tmp_path / "wb.sqlite")
+    database = SqliteDatabase(
+        path, write_behind=True, flush_interval=60, flush_size=3
+    )
+    for i in range(3):
+        database.set("core.test", f"k{i}", i)
+
+    other = SqliteDatabase(path)
+    assert other.get_collection("core.test") == {"k0": 0, "k1": 1, "k2": 2}
+
+    database.set("core.test", "late", True)
+    database.close()
+    assert other.get("core.test", "late") is True
+    other.close()
+
+
+def test_cache_hits_and_write_through(sqlite_db):
+    cached = CachedDatabase(sqlite_db, max_size=2)
+    cached.set("core.test", "a", [1])
+
+    value = cached.get("core.test", "a")
+    value.append(2)
+    assert cached.get("core.test", "a") == [1]
+    assert cached.get("core.test", "missing", 0) == 0
+    assert cached.get("core.test", "missing", 0) == 0
+
+    cached.remove("core.test", "a")
+    assert cached.get("core.test", "a") is None
+    assert sqlite_db.get("core.test", "a") is None
+    assert cached.stats() == {"core.test": {"hits": 4, "misses": 1}}
+
+
+def test_cache_evicts_least_recently_used(sqlite_db):
+    cached = CachedDatabase(sqlite_db, max_size=2)
+    for key in "abc":
+        cached.set("core.test", key, key)
+
+    sqlite_db.set("core.test", "a", "changed")
+    sqlite_db.set("core.test", "c", "changed")
+    assert cached.get("core.test", "a") == "changed"
+    assert cached.get("core.test", "c") == "c"
+
+
+def test_sqlite_wal_and_concurrent_readers(tmp_path):
+    path = str(tmp_path / "wal.sqlite")
+    writer = SqliteDatabase(path)
+    other_process = SqliteDatabase(path)
+
+    assert writer.get("core.unknown", "var", 1) == 1
+    assert writer.get_collection("core.unknown") == {}
+    other_process.set("core.unknown", "var", 2)
+    assert writer.get("core.unknown", "var") == 2
+
+    mode = writer._conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+    results = []
+
+    def read():
+        results.append(writer.get("core.unknown", "var"))
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [2, 2, 2, 2]
+    other_process.close()
+    writer.close()
+
+
+def test_sqlite_readers_closed_with_their_thread(sqlite_db):
+    sqlite_db.set("core.test", "a", 1)
+
+    for _ in range(5):
+        with ThreadPoolExecutor(8) as executor:
+            barrier = threading.Barrier(8)
+
+            def read():
+                # every worker gets its own reader connection
+                barrier.wait()
+                return sqlite_db.get("core.test", "a")
+
+            futures = [executor.submit(read) for _ in range(8)]
+            assert [future.result() for future in futures] == [1] * 8
+    gc.collect()
+
+    assert not sqlite_db._readers
+
+
+async def test_async_api(sqlite_db):
+    cached = CachedDatabase(sqlite_db)
+    await cached.aset("core.test", "a", {"x": 1})
+    assert await sqlite_db.aget("core.test", "a") == {"x": 1}
+    assert await cached.aget("core.test", "a") == {"x": 1}
+    assert await cached.aget_collection("core.test") == {"a": {"x": 1}}
+
+    await cached.aremove("core.test", "a")
+    assert await cached.aget("core.test", "a", 0) == 0
+    assert await sqlite_db.aget("core.test", "a", 0) == 0
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_bulk_operations(tmp_path, write_behind):
+    database = SqliteDatabase(
+        str(tmp_path / "bulk.sqlite"), write_behind=write_behind
+    )
+    database.set_many("core.test", {"a": 1, "b": [2], "c": "3"})
+    assert database.get_many("core.test", ["a", "b", "x"], 0) == {
+        "a": 1,
+        "b": [2],
+        "x": 0,
+    }
+
+    database.remove_many("core.test", ["a", "c"])
+    assert database.get_collection("core.test") == {"b": [2]}
+    database.close()
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_transaction_commits_and_rolls_back(tmp_path, write_behind):
+    database = SqliteDatabase(
+        str(tmp_path / "tx.sqlite"), write_behind=write_behind
+    )
+
+    with database.transaction():
+        database.set("core.test", "a", 1)
+        database.set("core.new", "b", 2)
+        assert database.get("core.test", "a") == 1
+
+    with pytest.raises(RuntimeError):
+        with database.transaction():
+            database.set("core.test", "a", 2)
+            database.set("core.other", "c", 3)
+            raise RuntimeError
+
+    assert database.get("core.test", "a") == 1
+    assert database.get("core.new", "b") == 2
+    assert database.get_collection("core.other") == {}
+    database.set("core.other", "c", 4)
+    assert database.get("core.other", "c") == 4
+    database.close()
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "lmdb"])
+async def test_async_calls_inside_transaction(tmp_path, backend):
+    if backend == "lmdb":
+        pytest.importorskip("lmdb")
+        from utils.db import LmdbDatabase
+
+        database = LmdbDatabase(str(tmp_path / "lmdb"))
+    else:
+        database = SqliteDatabase(str(tmp_path / "tx.sqlite"))
+
+    async def write(value):
+        # the calls must not wait for the transaction they are part of
+        await asyncio.wait_for(database.aset("core.test", "a", value), 3)
+        await asyncio.wait_for(database.aset_entry("core.test", 1, "b", 2), 3)
+        assert await database.aget("core.test", "a") == value
+        assert await database.aget_collection("core.test") == {
+            "a": value,
+            "1/b": 2,
+        }
+
+    with database.transaction():
+        await write(1)
+    with pytest.raises(RuntimeError):
+        with database.transaction():
+            await write(2)
+            raise RuntimeError
+
+    assert await database.aget("core.test", "a") == 1
+    assert await database.aget_entries("core.test", 1) == {"b": 2}
+    database.close()
+
+
+def test_cache_bulk_and_transaction(sqlite_db):
+    cached = CachedDatabase(sqlite_db)
+    cached.set_many("core.test", {"a": 1, "b": 2})
+    sqlite_db.set("core.test", "c", 3)
+    assert cached.get_many("core.test", ["a", "c", "d"]) == {
+        "a": 1,
+        "c": 3,
+        "d": None,
+    }
+
+    with pytest.raises(RuntimeError):
+        with cached.transaction():
+            cached.set("core.test", "a", 10)
+            raise RuntimeError
+
+    assert cached.get("core.test", "a") == 1
+    cached.remove_many("core.test", ["a", "b"])
+    assert sqlite_db.get_collection("core.test") == {"c": 3}
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_keyed_entries_and_migration(tmp_path, write_behind):
+    database = SqliteDatabase(
+        str(tmp_path / "entries.sqlite"), write_behind=write_behind
+    )
+    database.set("core.test", "-100", {"hi": {"id": 1}, "a/b": {"id": 2}})
+    database.set("core.test", "-1001", {"other": {"id": 3}})
+    database.set("core.test", "flag", True)
+
+    database.migrate_to_entries("core.test")
+
+    assert database.get("core.test", "-100") is None
+    assert database.get("core.test", "flag") is True
+    assert database.get_entry("core.test", -100, "a/b") == {"id": 2}
+    assert database.get_entries("core.test", -100) == {
+        "hi": {"id": 1},
+        "a/b": {"id": 2},
+    }
+
+    database.remove_entry("core.test", -100, "hi")
+    database.set_entry("core.test", -1001, "new", {"id": 4})
+    assert database.get_entries("core.test", -100) == {"a/b": {"id": 2}}
+    assert database.get_entries("core.test", -1001) == {
+        "other": {"id": 3},
+        "new": {"id": 4},
+    }
+    with pytest.raises(ValueError):
+        database.get_entry("core.test", "a/b", "c")
+    database.close()
+
+
+@pytest.mark.parametrize("encoding", ["msgpack", "orjson"])
+def test_compact_encoding_and_conversion(tmp_path, encoding):
+    pytest.importorskip(encoding)
+    path = str(tmp_path / "enc.sqlite")
+    value = {"users": [1, 2, 3], "nested": {"a": None}}
+
+    database = SqliteDatabase(path)
+    database.set("core.test", "old", value)
+    database.set("core.test", "flag", False)
+    database.close()
+
+    database = SqliteDatabase(path, encoding=encoding)
+    database.set("core.test", "new", value)
+    assert database.get("core.test", "old") == value
+    assert database.get("core.test", "new") == value
+    assert database.convert_encoding() == 1
+    assert database.convert_encoding() == 0
+
+    types = {
+        row["var"]: row["type"]
+        for row in database._conn.execute("SELECT * FROM 'core.test'")
+    }
+    assert types == {"old": encoding, "new": encoding, "flag": "bool"}
+    assert database.get_collection("core.test") == {
+        "old": value,
+        "new": value,
+        "flag": False,
+    }
+    database.close()
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_change_notifications(tmp_path, write_behind):
+    database = SqliteDatabase(
+        str(tmp_path / "events.sqlite"), write_behind=write_behind
+    )
+    cached = CachedDatabase(database)
+    events = []
+
+    def callback(module, variable, value):
+        events.append((variable, value))
+
+    cached.subscribe("core.test", callback)
+    cached.set("core.test", "a", 1)
+    database.set("core.other", "x", 1)
+    cached.remove("core.test", "a")
+    assert events == [("a", 1), ("a", REMOVED)]
+
+    events.clear()
+    with pytest.raises(RuntimeError):
+        with database.transaction():
+            database.set("core.test", "b", 2)
+            raise RuntimeError
+    with database.transaction():
+        database.set_many("core.test", {"c": 3, "d": 4})
+        database.remove_many("core.test", ["c"])
+        assert events == []
+    assert events == [("c", 3), ("d", 4), ("c", REMOVED)]
+
+    events.clear()
+    cached.unsubscribe("core.test", callback)
+    database.set("core.test", "e", 5)
+    assert events == []
+    database.close()
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_expiring_keys(tmp_path, write_behind):
+    database = SqliteDatabase(
+        str(tmp_path / "ttl.sqlite"), write_behind=write_behind
+    )
+    cached = CachedDatabase(database)
+    events = []
+    database.subscribe("core.test", lambda _, var, value: events.append(var))
+
+    cached.set("core.test", "live", 1, ttl=60)
+    cached.set("core.test", "dead", 2, ttl=0)
+    database.set_many("core.test", {"a": 1, "b": 2}, ttl=0)
+    database.set("core.test", "kept", 3)
+
+    assert cached.get("core.test", "live") == 1
+    assert cached.get("core.test", "dead") is None
+    assert database.get_many("core.test", ["a", "kept"], 0) == {
+        "a": 0,
+        "kept": 3,
+    }
+    assert database.get_collection("core.test") == {"live": 1, "kept": 3}
+
+    events.clear()
+    assert cached.purge_expired() == 3
+    assert sorted(events) == ["a", "b", "dead"]
+    assert cached.purge_expired() == 0
+
+    # a plain set makes the key permanent again
+    database.set("core.test", "live", 4)
+    database.flush()
+    rows = database._conn.execute(
+        "SELECT expires FROM 'core.test' WHERE var='live'"
+    ).fetchall()
+    assert rows[0]["expires"] is None
+    database.close()
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_cache_keeps_deadlines_of_read_keys(
+    tmp_path, monkeypatch, write_behind
+):
+    database = SqliteDatabase(
+        str(tmp_path / "ttl.sqlite"), write_behind=write_behind
+    )
+    database.set("core.test", "a", 1, ttl=60)
+    database.set_many("core.test", {"b": 2, "c": 3}, ttl=60)
+    database.set("core.test", "kept", 4)
+    cached = CachedDatabase(database)
+
+    assert cached.get("core.test", "a") == 1
+    assert cached.get_many("core.test", ["b", "c", "kept"]) == {
+        "b": 2,
+        "c": 3,
+        "kept": 4,
+    }
+
+    later = time.time() + 120
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert cached.get("core.test", "a") is None
+    assert cached.get_many("core.test", ["b", "kept"], 0) == {
+        "b": 0,
+        "kept": 4,
+    }
+
+    # purging drops expired keys only, the rest stays cached
+    assert cached.purge_expired() == 3
+    assert ("core.test", "c") not in cached._cache
+    assert cached._cache["core.test", "kept"] == 4
+    database.close()
+
+
+def test_tables_without_expiry_are_upgraded(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "old.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE 'core.test' "
+        "(var TEXT UNIQUE NOT NULL, val TEXT NOT NULL, type TEXT NOT NULL)"
+    )
+    conn.execute("INSERT INTO 'core.test' VALUES ('a', '1', 'int')")
+    conn.commit()
+    conn.close()
+
+    database = SqliteDatabase(path)
+    assert database.get("core.test", "a") == 1
+    database.set("core.test", "b", 2, ttl=0)
+    assert database.get_collection("core.test") == {"a": 1}
+    assert database.purge_expired() == 1
+    database.close()
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+async def test_scan(tmp_path, monkeypatch, write_behind):
+    import utils.db
+
+    monkeypatch.setattr(utils.db, "SCAN_BATCH_SIZE", 3)
+    database = SqliteDatabase(
+        str(tmp_path / "scan.sqlite"), write_behind=write_behind
+    )
+    database.set_many("core.test", {f"note{i}": i for i in range(10)})
+    database.set_many("core.test", {"antiraid1": True, "nota": 0})
+    database.flush()
+    database.set("core.test", "note35", 35)
+    database.remove("core.test", "note4")
+    database.set("core.test", "note5", 5, ttl=0)
+
+    notes = [f"note{i}" for i in (0, 1, 2, 3, 35, 6, 7, 8, 9)]
+    assert [var for var, _ in database.scan("core.test", "note")] == notes
+    assert list(database.scan("core.test", "note", start="note6")) == [
+        ("note6", 6),
+        ("note7", 7),
+        ("note8", 8),
+        ("note9", 9),
+    ]
+    assert list(database.scan("core.test", "note", limit=5)) == [
+        (var, int(var[4:])) for var in notes[:5]
+    ]
+    assert [var async for var, _ in database.ascan("core.test")] == [
+        "antiraid1",
+        "nota",
+        *notes,
+    ]
+    assert list(database.scan("core.missing")) == []
+    database.close()
+
+
+def test_lmdb_backend(tmp_path):
+    pytest.importorskip("lmdb")
+    from utils.db import LmdbDatabase
+
+    database = LmdbDatabase(str(tmp_path / "lmdb"))
+    events = []
+    database.subscribe("core.test", lambda _, var, value: events.append(var))
+
+    database.set("core.test", "flag", False)
+    database.set("core.test", "num", 42)
+    database.set("core.test", "text", "привет")
+    database.set("core.test", "data", {"a": [1, 2]})
+    database.set("core.test", "gone", 1, ttl=0)
+    database.set("core.test", "later", 1, ttl=60)
+    assert database.get("core.test", "flag") is False
+    assert database.get("core.test", "text") == "привет"
+    assert database.get("core.test", "gone", "x") == "x"
+    assert database.get("core.unknown", "var", 1) == 1
+    assert database.get_many("core.test", ["num", "gone"], 0) == {
+        "num": 42,
+        "gone": 0,
+    }
+    assert list(database.scan("core.test", start="g", limit=2)) == [
+        ("later", 1),
+        ("num", 42),
+    ]
+
+    with pytest.raises(RuntimeError):
+        with database.transaction():
+            database.set("core.test", "num", 0)
+            database.set("core.new", "a", 1)
+            assert database.get("core.test", "num") == 0
+            raise RuntimeError
+    assert database.get("core.test", "num") == 42
+    assert database.get_collection("core.new") == {}
+    database.set("core.new", "a", 1)
+    assert database.modules() == ["core.new", "core.test"]
+
+    database.set("core.test", "later", 2)
+    events.clear()
+    assert database.purge_expired() == 1
+    assert events == ["gone"]
+    assert database.get_collection("core.test") == {
+        "flag": False,
+        "num": 42,
+        "text": "привет",
+        "data": {"a": [1, 2]},
+        "later": 2,
+    }
+    database.close()
+
+
+def test_lmdb_reads_dont_wait_for_writer(tmp_path):
+    pytest.importorskip("lmdb")
+    from utils.db import LmdbDatabase
+
+    database = LmdbDatabase(str(tmp_path / "lmdb"))
+    in_transaction, read_done = threading.Event(), threading.Event()
+    results = []
+
+    def writer():
+        with database.transaction():
+            database.set("core.test", "a", 1)
+            in_transaction.set()
+            # the reader must finish while the write lock is held
+            results.append(read_done.wait(5))
+
+    def reader():
+        in_transaction.wait(5)
+        results.append(database.get("core.never", "k", "default"))
+        results.append(database.get_collection("core.never"))
+        read_done.set()
+
+    threads = [threading.Thread(target=writer), threading.Thread(target=reader)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert not any(thread.is_alive() for thread in threads)
+    assert sorted(results, key=repr) == sorted(["default", {}, True], key=repr)
+
+    # a missing module shows up once it is written
+    database.set("core.never", "k", 2)
+    assert database.get("core.never", "k") == 2
+    database.close()
+
+
+def test_profiled_database(tmp_path, monkeypatch, caplog):
+    from utils.db import ProfiledDatabase
+
+    backend = SqliteDatabase(str(tmp_path / "db.sqlite"))
+    database = ProfiledDatabase(CachedDatabase(backend), slow_ms=1000)
+    database.set("core.test", "a", 1)
+    for _ in range(3):
+        assert database.get("core.test", "a") == 1
+    assert list(database.scan("core.test")) == [("a", 1)]
+
+    stats = database.stats()
+    ops = {(item["module"], item["op"]): item for item in stats["ops"]}
+    assert ops["core.test", "get"]["count"] == 3
+    assert sum(ops["core.test", "get"]["histogram"].values()) == 3
+    assert ops["core.test", "scan"]["count"] == 1
+    assert stats["cache"]["core.test"]["hits"] == 3
+    assert stats["slow"] == []
+
+    def slow_handler():
+        return database.get("core.slow", "x")
+
+    database._slow = 0
+    with caplog.at_level("WARNING"):
+        slow_handler()
+    (slow,) = database.stats()["slow"]
+    assert (slow["module"], slow["variable"]) == ("core.slow", "x")
+    assert slow["caller"].endswith("slow_handler")
+    assert "slow_handler" in caplog.text
+
+    database.write_stats(str(tmp_path / "profile.json"))
+    database.reset()
+    assert database.stats()["ops"] == []
+    database.close()
+
+
+class _Recorder:
+    """Records calls made to a mongomock collection"""
+
+    def __init__(self, collection, calls: list):
+        self._collection = collection
+        self._calls = calls
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return attr(*args, **kwargs)
+
+        return call
+
+
+class _AsyncCollection:
+    """The part of a motor collection MongoDatabase uses, over mongomock"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    async def find_one(self, *args, **kwargs):
+        return self._collection.find_one(*args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return self._collection.update_one(*args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return self._collection.delete_one(*args, **kwargs)
+
+    async def _find(self, *args, **kwargs):
+        for doc in self._collection.find(*args, **kwargs):
+            yield doc
+
+    def find(self, *args, **kwargs):
+        return self._find(*args, **kwargs)
+
+
+class _Session:
+    def __init__(self, transactions: bool):
+        self.transactions = transactions
+        self.used = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def with_transaction(self, callback):
+        import pymongo
+
+        if not self.transactions:
+            raise pymongo.errors.OperationFailure(
+                "Transaction numbers are only allowed on a replica set "
+                "member or mongos",
+                code=20,
+            )
+        self.used += 1
+        return callback(self)
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    from utils.db import MongoDatabase
+
+    client = mongomock.MongoClient()
+    database = MongoDatabase("mongodb://localhost", "test", client=client)
+    calls = []
+    collection = database._collection
+    monkeypatch.setattr(
+        database,
+        "_collection",
+        lambda module: _Recorder(collection(module), calls),
+    )
+    database.calls = calls
+    yield database
+    database.close()
+
+
+def test_mongo_indexes_and_projections(mongo_db):
+    mongo_db.set("core.test", "a", {"x": 1})
+    mongo_db.set("core.test", "b", 2)
+    mongo_db.calls.clear()
+
+    assert mongo_db.get("core.test", "a") == {"x": 1}
+    assert mongo_db.get_many("core.test", ["a", "b", "c"], 0) == {
+        "a": {"x": 1},
+        "b": 2,
+        "c": 0,
+    }
+    assert mongo_db.get_collection("core.test") == {"a": {"x": 1}, "b": 2}
+    assert list(mongo_db.scan("core.test")) == [("a", {"x": 1}), ("b", 2)]
+
+    # reads never fetch _id and go through the var index
+    reads = [call for call in mongo_db.calls if call[0] in ("find", "find_one")]
+    assert len(reads) == 4
+    for _, args, _ in reads:
+        assert args[1]["_id"] == 0 and "val" in args[1]
+
+    indexes = mongo_db._database["core.test"].index_information()
+    assert indexes["var_1"]["unique"] is True
+    assert indexes["exp_1"]["expireAfterSeconds"] == 0
+    # indexes are created once per collection
+    assert "create_index" not in {call[0] for call in mongo_db.calls}
+
+
+def test_mongo_duplicate_keys_get_plain_index(mongo_db, caplog):
+    mongo_db._database["core.dup"].insert_many(
+        [{"var": "a", "val": 1}, {"var": "a", "val": 2}]
+    )
+    assert mongo_db.get("core.dup", "a") in (1, 2)
+    assert "isn't unique" in caplog.text
+    assert (
+        "unique"
+        not in mongo_db._database["core.dup"].index_information()["var_1"]
+    )
+
+
+def test_mongo_bulk_writes(mongo_db):
+    events = []
+    mongo_db.subscribe("core.test", lambda _, var, value: events.append(var))
+    mongo_db.set_many("core.test", {f"k{i}": i for i in range(5)})
+    mongo_db.remove_many("core.test", ["k0", "k1"])
+
+    writes = [call for call in mongo_db.calls if call[0] == "bulk_write"]
+    # one unordered bulk_write per call, without a session
+    assert len(writes) == 2
+    assert all(not kwargs["ordered"] for _, _, kwargs in writes)
+    assert writes[0][2]["session"] is None
+    assert mongo_db.get_collection("core.test") == {"k2": 2, "k3": 3, "k4": 4}
+    assert sorted(events) == ["k0", "k0", "k1", "k1", "k2", "k3", "k4"]
+
+
+@pytest.mark.parametrize("transactions", [True, False])
+def test_mongo_transaction(mongo_db, monkeypatch, request, transactions):
+    import mongomock
+
+    # mongomock only has to accept the session bulk_write gets
+    mongomock.ignore_feature("session")
+    request.addfinalizer(lambda: mongomock.warn_on_feature("session"))
+    session = _Session(transactions)
+    monkeypatch.setattr(mongo_db._client, "start_session", lambda: session)
+    mongo_db.set("core.other", "gone", 1)
+
+    with mongo_db.transaction():
+        mongo_db.set("core.test", "a", 1)
+        mongo_db.set_many("core.test", {"b": 2, "c": 3})
+        mongo_db.remove("core.other", "gone")
+        mongo_db.set("core.other", "new", 4)
+        # writes are buffered, but visible to reads of the same thread
+        assert mongo_db.get("core.test", "b") == 2
+        assert mongo_db.get("core.other", "gone") is None
+        assert mongo_db._database["core.test"].count_documents({}) == 0
+
+    assert mongo_db.get_collection("core.test") == {"a": 1, "b": 2, "c": 3}
+    assert mongo_db.get_collection("core.other") == {"new": 4}
+    # standalone servers fall back to writing without a transaction
+    assert session.used == (1 if transactions else 0)
+
+    with pytest.raises(ValueError):
+        with mongo_db.transaction():
+            mongo_db.set("core.test", "a", "rolled back")
+            raise ValueError
+    assert mongo_db.get("core.test", "a") == 1
+
+
+async def test_mongo_async_reads_in_transaction(mongo_db):
+    mongo_db._async_db = {
+        "core.test": _AsyncCollection(mongo_db._database["core.test"])
+    }
+    mongo_db.set_many("core.test", {"a": 1, "gone": 2})
+    mongo_db.set_entry("core.test", 1, "kept", 3)
+    mongo_db.set_entry("core.test", 1, "removed", 4)
+
+    with mongo_db.transaction():
+        mongo_db.set("core.test", "b", 5)
+        mongo_db.remove("core.test", "gone")
+        mongo_db.set_entry("core.test", 1, "new", 6)
+        mongo_db.remove_entry("core.test", 1, "removed")
+        # reads of the same thread see the writes staged so far
+        collection = await mongo_db.aget_collection("core.test")
+        assert collection == mongo_db.get_collection("core.test")
+        assert collection["b"] == 5 and "gone" not in collection
+        assert await mongo_db.aget_entries("core.test", 1) == {
+            "kept": 3,
+            "new": 6,
+        }
+
+
+def test_mongo_scan(mongo_db, monkeypatch):
+    import utils.db
+
+    monkeypatch.setattr(utils.db, "SCAN_BATCH_SIZE", 3)
+    mongo_db.set_many("core.test", {f"note{i}": i for i in range(10)})
+    mongo_db.set_many("core.test", {"antiraid1": True, "nota": 0, "n.1": 1})
+    mongo_db.calls.clear()
+
+    assert list(mongo_db.scan("core.test", "note", start="note6")) == [
+        ("note6", 6),
+        ("note7", 7),
+        ("note8", 8),
+        ("note9", 9),
+    ]
+    query = mongo_db.calls[0][1][0]
+    # the prefix is escaped and anchored, so the index serves it
+    assert query == {"var": {"$regex": "^note", "$gte": "note6"}}
+    assert [var for var, _ in mongo_db.scan("core.test", "n.")] == ["n.1"]
+    assert list(mongo_db.scan("core.test", start="nota", limit=2)) == [
+        ("nota", 0),
+        ("note0", 0),
+    ]
+
+    with mongo_db.transaction():
+        mongo_db.set("core.test", "note35", 35)
+        mongo_db.remove("core.test", "note4")
+        assert [var for var, _ in mongo_db.scan("core.test", "note3")] == [
+            "note3",
+            "note35",
+        ]
+        assert "note4" not in dict(mongo_db.scan("core.test", "note"))
+
+
+def test_mongo_expiring_keys(mongo_db, monkeypatch):
+    from datetime import datetime
+
+    mongo_db.set("core.test", "live", 1, ttl=60)
+    mongo_db.set("core.test", "kept", 2, ttl=60)
+    mongo_db.set("core.test", "kept", 2)
+    mongo_db.set_many("core.test", {"a": 3, "b": 4}, ttl=60)
+
+    doc = mongo_db._database["core.test"].find_one({"var": "live"})
+    # a date, so that the server's TTL index removes the document
+    assert isinstance(doc["exp"], datetime)
+    assert "exp" not in mongo_db._database["core.test"].find_one(
+        {"var": "kept"}
+    )
+    found = mongo_db.get_many_expiring("core.test", ["live", "kept"])
+    assert found["kept"] == (2, None)
+    assert found["live"][1] == pytest.approx(time.time() + 60, abs=5)
+
+    later = time.time() + 120
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert mongo_db.get("core.test", "live", "x") == "x"
+    assert mongo_db.get_many("core.test", ["a", "kept"], 0) == {
+        "a": 0,
+        "kept": 2,
+    }
+    assert mongo_db.get_collection("core.test") == {"kept": 2}
+    assert list(mongo_db.scan("core.test")) == [("kept", 2)]
+
+
+def test_mongo_purge_expired_uses_exp_index(mongo_db):
+    from datetime import datetime
+
+    mongo_db.subscribe("core.sub", lambda *_: None)
+    mongo_db.set("core.test", "kept", 2)
+    # expired keys written by another program, in a collection without
+    # an exp index
+    mongo_db._database["other.app"].insert_one(
+        {"var": "old", "val": 3, "exp": datetime.fromtimestamp(0)}
+    )
+
+    mongo_db.purge_expired()
+    # subscribed collections get their index, foreign ones aren't swept
+    assert "exp_1" in mongo_db._database["core.sub"].index_information()
+    assert "exp_1" not in mongo_db._database["other.app"].index_information()
+    assert mongo_db._database["other.app"].count_documents({}) == 1
+    assert mongo_db.get_collection("core.test") == {"kept": 2}
+
+
+async def test_mongo_async_api(mongo_db):
+    mongo_db._async_db = {
+        name: _AsyncCollection(mongo_db._database[name])
+        for name in ("core.test", "core.new")
+    }
+    events = []
+    mongo_db.subscribe("core.new", lambda _, var, value: events.append(var))
+
+    await mongo_db.aset("core.new", "a", {"x": 1})
+    await mongo_db.aset("core.new", "gone", 1, ttl=-1)
+    assert await mongo_db.aget("core.new", "a") == {"x": 1}
+    assert await mongo_db.aget("core.new", "gone", 0) == 0
+    assert await mongo_db.aget_collection("core.new") == {"a": {"x": 1}}
+    # the collection got its indexes through the sync client
+    assert "var_1" in mongo_db._database["core.new"].index_information()
+
+    await mongo_db.aremove("core.new", "a")
+    assert await mongo_db.aget("core.new", "a") is None
+    assert events == ["a", "gone", "a"]
+
+    # inside a transaction writes are buffered like sync ones
+    with mongo_db.transaction():
+        await mongo_db.aset("core.test", "b", 2)
+        assert await mongo_db.aget("core.test", "b") == 2
+        assert mongo_db.get_collection("core.test") == {"b": 2}
+        assert await mongo_db.aget_collection("core.test") == {"b": 2}
+    assert await mongo_db.aget("core.test", "b") == 2
@@ -0,0 +1,219 @@
+import gzip
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("DATABASE_TYPE", "sqlite")
+os.environ.setdefault("DATABASE_NAME", ":memory:")
+
+try:
+    import dbtool
+    from utils.db import SqliteDatabase
+
+    HAVE_DB = True
+except Exception:
+    HAVE_DB = False
+
+pytestmark = pytest.mark.skipif(not HAVE_DB, reason="utils.db not importable")
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / "source.sqlite")
+    database = SqliteDatabase(path)
+    database.set_many("core.notes", {f"note{i}": {"id": i} for i in range(50)})
+    database.set_many("core.ats", {"antiraid1": True, "c1": [1, 2]})
+    database.close()
+    return path
+
+
+def run(*argv):
+    dbtool.main([str(arg) for arg in argv])
+
+
+def test_export_import_roundtrip(tmp_path, source):
+    snapshot = tmp_path / "snapshot.ndjson.gz"
+    target = tmp_path / "target.sqlite"
+
+    run("export", snapshot, "--type", "sqlite", "--name", source)
+    run("verify", snapshot)
+    run(
+        "import",
+        snapshot,
+        "--type",
+        "sqlite",
+        "--name",
+        target,
+        "--batch-size",
+        7,
+    )
+
+    database = SqliteDatabase(str(target))
+    assert database.get_collection("core.ats") == {
+        "antiraid1": True,
+        "c1": [1, 2],
+    }
+    assert database.get_collection("core.notes") == {
+        f"note{i}": {"id": i} for i in range(50)
+    }
+    database.close()
+    assert not os.path.exists(f"{snapshot}.progress")
+    assert not os.path.exists(f"{snapshot}.import-progress")
+
+
+def test_empty_snapshot_roundtrip(tmp_path, monkeypatch):
+    snapshot = tmp_path / "snapshot.ndjson.gz"
+    target = tmp_path / "target.sqlite"
+    # a store without any module, like an empty Mongo or LMDB one
+    monkeypatch.setattr(SqliteDatabase, "modules", lambda self: [])
+
+    run("export", snapshot, "--type", "sqlite", "--name", tmp_path / "empty")
+    assert list(dbtool.read_snapshot(str(snapshot))) == []
+    run("import", snapshot, "--type", "sqlite", "--name", target)
+
+    assert not os.path.exists(f"{snapshot}.progress")
+    assert not os.path.exists(f"{snapshot}.import-progress")
+
+
+def test_export_resumes_after_last_module(tmp_path, source, monkeypatch):
+    snapshot = tmp_path / "snapshot.ndjson.gz"
+    scan = SqliteDatabase.scan
+
+    def interrupted_scan(self, module, *args):
+        for i, item in enumerate(scan(self, module, *args)):
+            if module == "core.notes" and i == 10:
+                raise KeyboardInterrupt
+            yield item
+
+    monkeypatch.setattr(SqliteDatabase, "scan", interrupted_scan)
+    with pytest.raises(KeyboardInterrupt):
+        run("export", snapshot, "--type", "sqlite", "--name", source)
+    assert os.path.exists(f"{snapshot}.progress")
+
+    monkeypatch.setattr(SqliteDatabase, "scan", scan)
+    run("export", snapshot, "--type", "sqlite", "--name", source, "--resume")
+
+    events = list(dbtool.read_snapshot(str(snapshot)))
+    ended = [module for kind, module, *_ in events if kind == "end"]
+    assert ended == sorted(SqliteDatabase.KNOWN_TABLES)
+    notes = [e for e in events if e[0] == "record" and e[1] == "core.notes"]
+    assert len(notes) == 50
+
+
+def test_import_resumes_inside_module(tmp_path, source):
+    snapshot = tmp_path / "snapshot.ndjson.gz"
+    target = tmp_path / "target.sqlite"
+    run("export", snapshot, "--type", "sqlite", "--name", source)
+
+    database = SqliteDatabase(str(target))
+    database.set("core.notes", "note40", "kept")
+    database.close()
+    with open(f"{snapshot}.import-progress", "w") as f:
+        f.write(
+            '{"modules": ["core.ats"], "module": "core.notes", '
+            '"last": "note44"}'
+        )
+    run("import", snapshot, "--type", "sqlite", "--name", target, "--resume")
+
+    database = SqliteDatabase(str(target))
+    assert database.get_collection("core.ats") == {}
+    notes = database.get_collection("core.notes")
+    # keys up to note44 were imported by the interrupted run
+    assert notes["note40"] == "kept"
+    assert "note0" not in notes and "note44" not in notes
+    assert notes["note45"] == {"id": 45} and notes["note9"] == {"id": 9}
+    database.close()
+
+
+def test_expiring_keys_keep_their_deadline(tmp_path, monkeypatch):
+    source = str(tmp_path / "source.sqlite")
+    snapshot = tmp_path / "snapshot.ndjson.gz"
+    target = tmp_path / "target.sqlite"
+    database = SqliteDatabase(source)
+    database.set("core.test", "kept", 1)
+    database.set("core.test", "live", 2, ttl=3600)
+    database.set("core.test", "short", 3, ttl=60)
+    deadlines = database.get_many_expiring("core.test", ["live", "short"])
+    database.close()
+
+    run("export", snapshot, "--type", "sqlite", "--name", source)
+    records = {
+        variable: expires
+        for kind, _, variable, _, expires in dbtool.read_snapshot(str(snapshot))
+        if kind == "record"
+    }
+    assert records == {
+        "kept": None,
+        "live": deadlines["live"][1],
+        "short": deadlines["short"][1],
+    }
+
+    # "short" expires before the snapshot is imported
+    later = time.time() + 120
+    monkeypatch.setattr(time, "time", lambda: later)
+    run("import", snapshot, "--type", "sqlite", "--name", target)
+
+    database = SqliteDatabase(str(target))
+    found = database.get_many_expiring("core.test", ["kept", "live", "short"])
+    assert found["kept"] == (1, None)
+    assert found["live"][0] == 2
+    assert found["live"][1] == pytest.approx(deadlines["live"][1])
+    assert "short" not in found
+    database.close()
+
+
+def test_damaged_snapshot_is_rejected(tmp_path, source):
+    snapshot = tmp_path / "snapshot.ndjson.gz"
+    target = tmp_path / "target.sqlite"
+    run("export", snapshot, "--type", "sqlite", "--name", source)
+
+    lines = gzip.decompress(snapshot.read_bytes()).replace(
+        b'"note7"', b'"note8"'
+    )
+    snapshot.write_bytes(gzip.compress(lines))
+    with pytest.raises(SystemExit, match="Checksum mismatch"):
+        run("import", snapshot, "--type", "sqlite", "--name", target)
+
+    snapshot.write_bytes(gzip.compress(lines[: len(lines) // 2]))
+    with pytest.raises(SystemExit):
+        run("verify", snapshot)
+
+    database = SqliteDatabase(str(target))
+    assert database.get_collection("core.notes") == {}
+    database.close()
+
+
+def test_configured_lmdb(tmp_path, source):
+    pytest.importorskip("lmdb")
+    snapshot = tmp_path / "snapshot.ndjson.gz"
+    run("export", snapshot, "--type", "sqlite", "--name", source)
+
+    # utils.db must not keep the configured store open behind dbtool's back
+    env = dict(
+        os.environ, DATABASE_TYPE="lmdb", DATABASE_NAME=str(tmp_path / "lmdb")
+    )
+    root = Path(__file__).resolve().parents[1]
+    for argv in (["import", snapshot], ["export", tmp_path / "again.gz"]):
+        subprocess.run(
+            [sys.executable, "dbtool.py", *map(str, argv)],
+            cwd=root,
+            env=env,
+            check=True,
+        )
+    run("verify", tmp_path / "again.gz")
+
+    converted = subprocess.run(
+        [sys.executable, "dbtool.py", "convert", "--encoding", "msgpack"],
+        cwd=root,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert converted.returncode != 0
+    assert "only supported for sqlite" in converted.stderr
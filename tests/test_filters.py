@@ -0,0 +1,104 @@
+import importlib
+import itertools
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# utils.config requires these at import time
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("DATABASE_TYPE", "sqlite")
+os.environ.setdefault("DATABASE_NAME", ":memory:")
+
+try:
+    from modules import filters as filters_module
+    from utils.db import db
+
+    HAVE_FILTERS = True
+except Exception:
+    HAVE_FILTERS = False
+
+pytestmark = pytest.mark.skipif(
+    not HAVE_FILTERS, reason="modules.filters not importable"
+)
+
+
+def message(chat_id, text):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text)
+
+
+def value(name, mode="exact"):
+    return {"MESSAGE_ID": name, "CHAT_ID": 1, "MODE": mode}
+
+
+# every test gets its own chat, the database is shared
+chat_ids = itertools.count(-1001, -1)
+
+
+@pytest.fixture
+def chat():
+    chat_id = next(chat_ids)
+    yield chat_id
+    for trigger in db.get_entries("core.filters", chat_id):
+        db.remove_entry("core.filters", chat_id, trigger)
+
+
+async def find(chat_id, text):
+    found = await filters_module.find_filter(message(chat_id, text))
+    return found and found["MESSAGE_ID"]
+
+
+async def test_matching_modes(chat):
+    db.set_entry("core.filters", chat, "hello", value("exact"))
+    db.set_entry("core.filters", chat, "cat", value("word", "word"))
+    db.set_entry("core.filters", chat, "dog", value("contains", "contains"))
+
+    assert await find(chat, "Hello") == "exact"
+    assert await find(chat, "hello there") is None
+
+    assert await find(chat, "a cat, sleeping") == "word"
+    assert await find(chat, "CAT") == "word"
+    assert await find(chat, "concatenate") is None
+    assert await find(chat, "cat_food") is None
+
+    assert await find(chat, "hotdogs") == "contains"
+    assert await find(chat, "no pets") is None
+    # commands only match exact triggers
+    assert await find(chat, ".filter -c hotdog") is None
+
+
+async def test_index_follows_added_and_removed_filters(chat):
+    db.set_entry("core.filters", chat, "first", value("first", "contains"))
+    assert await find(chat, "the first one") == "first"
+    index = filters_module.triggers[str(chat)]
+    assert await find(chat, "first") == "first"
+    assert filters_module.triggers[str(chat)] is index
+
+    await db.aset_entry("core.filters", chat, "second", value("second"))
+    assert str(chat) not in filters_module.triggers
+    assert await find(chat, "second") == "second"
+
+    await db.aremove_entry("core.filters", chat, "first")
+    assert str(chat) not in filters_module.triggers
+    assert await find(chat, "the first one") is None
+
+
+async def test_entries_are_migrated(chat):
+    db.set(
+        "core.filters",
+        str(chat),
+        {"hi": value("hi"), "bye": value("bye", "contains")},
+    )
+    db.remove("core.filters", "entries_migrated")
+    # the module subscribes again when it's imported
+    db.unsubscribe_all(filters_module.__name__)
+    importlib.reload(filters_module)
+
+    assert db.get("core.filters", "entries_migrated") is True
+    assert db.get("core.filters", str(chat)) is None
+    assert db.get_entries("core.filters", chat) == {
+        "hi": value("hi"),
+        "bye": value("bye", "contains"),
+    }
+    assert await find(chat, "goodbye") == "bye"
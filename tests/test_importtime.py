@@ -0,0 +1,33 @@
+import importlib.util
+from pathlib import Path
+
+spec = importlib.util.spec_from_file_location(
+    "importtime",
+    Path(__file__).resolve().parents[1] / "scripts" / "importtime.py",
+)
+importtime = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(importtime)
+
+SAMPLE = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:      3204 |      43137 | git
+failed to import admintool: ImportError()
+import time:       517 |      66768 | pymongo
+"""
+
+
+def test_parse_skips_header_and_other_lines():
+    assert importtime.parse(SAMPLE) == [
+        importtime.ImportTime("_io", 120, 120),
+        importtime.ImportTime("git", 3204, 43137),
+        importtime.ImportTime("pymongo", 517, 66768),
+    ]
+
+
+def test_report_orders_by_cumulative_time():
+    lines = importtime.report(importtime.parse(SAMPLE), top=2).splitlines()
+    assert lines[0] == "3 modules imported in 3.8 ms"
+    assert lines[3].endswith("  pymongo")
+    assert lines[4].endswith("  git")
+    assert len(lines) == 5
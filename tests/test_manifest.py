@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+import threading
+import types
+
+import pytest
+
+# utils.config requires these at import time
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("DATABASE_TYPE", "sqlite")
+os.environ.setdefault("DATABASE_NAME", ":memory:")
+
+try:
+    from pyrogram import Client, filters
+
+    from utils import config, manifest, scripts
+    from utils.manifest import (
+        build_entry,
+        command_names,
+        get_manifest,
+        module_meta,
+        register_stubs,
+        required_filters,
+        update_manifest,
+    )
+    from utils.misc import modules_help
+    from utils.router import CommandRouter
+    from utils.scripts import lazy_stubs, unload_module
+
+    HAVE_MANIFEST = True
+except Exception:
+    HAVE_MANIFEST = False
+
+pytestmark = pytest.mark.skipif(
+    not HAVE_MANIFEST, reason="utils.manifest not importable"
+)
+
+
+@pytest.fixture(autouse=True)
+def manifest_file(tmp_path, monkeypatch):
+    path = tmp_path / "module_manifest.json"
+    monkeypatch.setattr(config, "module_manifest_file", str(path))
+    monkeypatch.setattr(manifest, "_entries", None)
+    return path
+
+
+def test_command_names():
+    command = filters.command(["a", "b"], ".")
+    assert command_names(command & filters.me) == {"a", "b"}
+    assert command_names(filters.me & command) == {"a", "b"}
+    assert command_names(command | filters.command("c", ".")) == {"a", "b", "c"}
+    assert command_names(command | filters.me) is None
+    assert command_names(~command) is None
+    assert command_names(filters.text) is None
+
+
+def test_required_filters():
+    command = filters.command("a", ".")
+    assert required_filters(command) == []
+    assert required_filters(command & filters.me & ~filters.forwarded) == [
+        "me",
+        "~forwarded",
+    ]
+    assert required_filters(command | filters.me) == []
+    assert required_filters(command & filters.create(lambda *_: True)) == []
+
+
+def test_build_entry(tmp_path):
+    module = types.ModuleType("modules.fake")
+
+    @Client.on_message(filters.command(["fake", "f"], ".") & filters.me)
+    async def fake(_, __):
+        pass
+
+    module.fake = fake
+    modules_help["fake"] = {"fake [text]": "Fake command"}
+    path = tmp_path / "fake.py"
+    path.write_text("")
+
+    entry = build_entry(path, module)
+    assert entry["lazy"] is True
+    assert entry["commands"] == {"0": ["f", "fake"]}
+    assert entry["filters"] == {"0": {"f": ["me"], "fake": ["me"]}}
+    assert entry["help"] == {"fake": {"fake [text]": "Fake command"}}
+
+    @Client.on_message(filters.text)
+    async def listener(_, __):
+        pass
+
+    module.listener = listener
+    assert build_entry(path, module)["lazy"] is False
+    del modules_help["fake"]
+
+
+def test_module_meta(tmp_path, monkeypatch):
+    path = tmp_path / "fake.py"
+    path.write_text("# meta requires: foo bar\n")
+    assert module_meta(path)["requires"] == "foo bar"
+
+    parsed = []
+    monkeypatch.setattr(
+        manifest,
+        "parse_meta_comments",
+        lambda code: parsed.append(code) or {"requires": "baz"},
+    )
+    # unchanged or only touched files are not parsed again
+    assert module_meta(path)["requires"] == "foo bar"
+    os.utime(path, ns=(1, 1))
+    assert module_meta(path)["requires"] == "foo bar"
+    assert parsed == []
+
+    path.write_text("# meta requires: baz\n")
+    assert module_meta(path)["requires"] == "baz"
+    assert len(parsed) == 1
+
+
+def test_manifest_is_saved_to_file(tmp_path, manifest_file, monkeypatch):
+    kept, removed = tmp_path / "kept.py", tmp_path / "removed.py"
+    kept.write_text("# meta requires: foo\n")
+    removed.write_text("")
+    module_meta(kept), module_meta(removed)
+    update_manifest([kept])
+    assert list(json.loads(manifest_file.read_text())) == [str(kept)]
+
+    # a new start reads the file instead of parsing the module again
+    monkeypatch.setattr(manifest, "_entries", None)
+    monkeypatch.setattr(manifest, "parse_meta_comments", None)
+    assert module_meta(kept)["requires"] == "foo"
+    assert list(get_manifest([kept, removed])) == [str(kept)]
+
+
+def test_stubs_require_handler_filters(monkeypatch):
+    monkeypatch.setattr(manifest, "router", CommandRouter("."))
+    client = types.SimpleNamespace(add_handler=lambda handler, group: None)
+    entry = {
+        "meta": {},
+        "help": {},
+        "commands": {"0": ["mine", "public"]},
+        "filters": {"0": {"mine": ["me"], "public": []}},
+    }
+    register_stubs(client, {"modules/custom_modules/stubbed.py": entry})
+
+    stubs = {
+        frozenset(command_names(handler.filters)): required_filters(
+            handler.filters
+        )
+        for handler, _ in lazy_stubs.pop("stubbed")
+    }
+    assert stubs == {frozenset({"mine"}): ["me"], frozenset({"public"}): []}
+
+
+def stub_entry(*commands):
+    return {
+        "meta": {},
+        "help": {"stubbed": {command: "Stubbed" for command in commands}},
+        "commands": {"0": list(commands)},
+        "filters": {"0": {command: [] for command in commands}},
+    }
+
+
+def test_unload_module_removes_stubs(monkeypatch):
+    router = CommandRouter(".")
+    monkeypatch.setattr(manifest, "router", router)
+    monkeypatch.setattr(scripts, "router", router)
+    client = types.SimpleNamespace(add_handler=lambda handler, group: None)
+    register_stubs(
+        client, {"modules/custom_modules/stubbed.py": stub_entry("foo")}
+    )
+    assert "foo" in router._routes[0]
+
+    assert asyncio.run(unload_module("stubbed", client)) is True
+    assert "stubbed" not in lazy_stubs and "stubbed" not in modules_help
+    assert "foo" not in router._routes[0]
+    assert asyncio.run(unload_module("stubbed", client)) is False
+
+
+def test_stub_runs_sync_handlers_in_executor(monkeypatch):
+    monkeypatch.setattr(manifest, "router", CommandRouter("."))
+    module = types.ModuleType("modules.custom_modules.stubbed")
+    threads = []
+
+    @Client.on_message(filters.command("foo", "."))
+    def foo(_, message):
+        threads.append(threading.get_ident())
+        return message.text
+
+    module.foo = foo
+
+    async def load_module(name, client, core=False):
+        return module
+
+    monkeypatch.setattr(manifest, "load_module", load_module)
+    client = types.SimpleNamespace(
+        add_handler=lambda handler, group: None,
+        me=types.SimpleNamespace(username="me"),
+    )
+    register_stubs(
+        client, {"modules/custom_modules/stubbed.py": stub_entry("foo")}
+    )
+    stub = lazy_stubs.pop("stubbed")[0][0]
+    message = types.SimpleNamespace(
+        text=".foo", caption=None, command=None, chat=None
+    )
+
+    async def run():
+        client.loop, client.executor = asyncio.get_running_loop(), None
+        return await stub.callback(client, message)
+
+    assert asyncio.run(run()) == ".foo"
+    assert threads and threads[0] != threading.get_ident()
+    modules_help.pop("stubbed")
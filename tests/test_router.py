@@ -0,0 +1,127 @@
+import asyncio
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+# utils.config requires these at import time
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("DATABASE_TYPE", "sqlite")
+os.environ.setdefault("DATABASE_NAME", ":memory:")
+
+try:
+    from pyrogram import ContinuePropagation, filters
+    from pyrogram.handlers import MessageHandler
+
+    from utils.router import CommandRouter
+
+    HAVE_ROUTER = True
+except Exception:
+    HAVE_ROUTER = False
+
+pytestmark = pytest.mark.skipif(
+    not HAVE_ROUTER, reason="utils.router not importable"
+)
+
+
+class FakeClient:
+    def __init__(self):
+        self.me = SimpleNamespace(username="me")
+        self.handlers = []
+
+    def add_handler(self, handler, group=0):
+        self.handlers.append((handler, group))
+
+    def remove_handler(self, handler, group=0):
+        self.handlers.remove((handler, group))
+
+
+def message(text):
+    return SimpleNamespace(text=text, caption=None, command=None)
+
+
+async def dispatch(client, msg):
+    """Run the first matching handler like pyrogram does for one group"""
+    for handler, _ in client.handlers:
+        if await handler.check(client, msg):
+            try:
+                return await handler.callback(client, msg)
+            except ContinuePropagation:
+                continue
+
+
+def handler(commands, prefix=".", extra=None):
+    flt = filters.command(commands, prefix)
+    if extra is not None:
+        flt = flt & extra
+
+    async def callback(_, msg):
+        return msg.command
+
+    return MessageHandler(callback, flt)
+
+
+def test_routes_commands_through_one_handler():
+    router, client = CommandRouter("."), FakeClient()
+    router.add_handler(client, handler(["ping", "p"]))
+    router.add_handler(client, handler("help"))
+    other = handler("x", "/")
+    router.add_handler(client, other)
+    assert len(client.handlers) == 2
+    assert client.handlers[1] == (other, 0)
+
+    assert asyncio.run(dispatch(client, message(".P 1 2"))) == ["p", "1", "2"]
+    assert asyncio.run(dispatch(client, message(".help"))) == ["help"]
+    assert asyncio.run(dispatch(client, message(".unknown"))) is None
+    assert asyncio.run(dispatch(client, message("ping"))) is None
+
+
+def test_falls_through_to_next_handler():
+    router, client = CommandRouter("."), FakeClient()
+
+    async def never_func(*_):
+        return False
+
+    never = filters.create(never_func)
+    router.add_handler(client, handler("a", extra=never))
+    router.add_handler(client, handler("a"))
+    assert asyncio.run(dispatch(client, message(".a b"))) == ["a", "b"]
+
+
+def test_runs_sync_callbacks_in_executor():
+    router, client = CommandRouter("."), FakeClient()
+    threads = []
+
+    def callback(_, msg):
+        threads.append(threading.get_ident())
+        return msg.command
+
+    router.add_handler(
+        client, MessageHandler(callback, filters.command("ex", "."))
+    )
+
+    async def run():
+        client.loop, client.executor = asyncio.get_running_loop(), None
+        return await dispatch(client, message(".ex 1"))
+
+    assert asyncio.run(run()) == ["ex", "1"]
+    assert threads and threads[0] != threading.get_ident()
+
+
+def test_remove_handler():
+    router, client = CommandRouter("."), FakeClient()
+    ping = handler("ping")
+    router.add_handler(client, ping)
+    router.remove_handler(client, ping)
+    assert asyncio.run(dispatch(client, message(".ping"))) is None
+
+
+def test_set_prefix():
+    router, client = CommandRouter("."), FakeClient()
+    router.add_handler(client, handler("ping"))
+    router.set_prefix("!")
+    assert asyncio.run(dispatch(client, message(".ping"))) is None
+    assert asyncio.run(dispatch(client, message("!ping"))) == ["ping"]
+    router.set_prefix(".")
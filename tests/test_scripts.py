@@ -0,0 +1,251 @@
+import asyncio
+import os
+import sys
+import types
+
+import pytest
+
+# utils.config requires these at import time
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("DATABASE_TYPE", "sqlite")
+os.environ.setdefault("DATABASE_NAME", ":memory:")
+
+try:
+    from utils import config, scripts
+
+    HAVE_SCRIPTS = True
+except Exception:
+    HAVE_SCRIPTS = False
+
+pytestmark = pytest.mark.skipif(
+    not HAVE_SCRIPTS, reason="utils.scripts not importable"
+)
+
+
+def fake_pip(monkeypatch, fail=()):
+    calls = []
+
+    async def pip(args, progress=None):
+        calls.append(args)
+        if progress:
+            await progress(f"Collecting {args[-1]}")
+        if args[0] in fail:
+            fail.remove(args[0])
+            raise RuntimeError(f"pip {args[0]} exited with code 1")
+
+    monkeypatch.setattr(scripts, "_pip", pip)
+    return calls
+
+
+def test_install_requirements_offline(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "pip_wheel_dir", str(tmp_path))
+    calls = fake_pip(monkeypatch)
+    lines = []
+
+    async def progress(line):
+        lines.append(line)
+
+    asyncio.run(scripts.install_requirements(["a", "b", "a"], progress))
+    assert calls == [
+        ["install", "--no-index", "--find-links", str(tmp_path), "a", "b"]
+    ]
+    assert lines == ["Collecting b"]
+
+
+def test_install_requirements_builds_missing_wheels(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "pip_wheel_dir", str(tmp_path))
+    calls = fake_pip(monkeypatch, fail=["install"])
+
+    asyncio.run(scripts.install_requirements(["a"]))
+    assert [args[0] for args in calls] == ["install", "wheel", "install"]
+    assert calls[1][1:3] == ["--wheel-dir", str(tmp_path)]
+
+
+def test_import_library_missing():
+    with scripts._loading(), pytest.raises(scripts.MissingRequirements) as e:
+        scripts.import_library("surely_not_installed", "surely-not-installed")
+    assert e.value.packages == ["surely-not-installed"]
+
+
+def test_import_library_installs_outside_loader(monkeypatch):
+    calls = []
+
+    def run(args):
+        calls.append(args)
+        return types.SimpleNamespace(returncode=1)
+
+    monkeypatch.setattr(scripts.subprocess, "run", run)
+    with pytest.raises(AssertionError):
+        scripts.import_library("surely_not_installed", "surely-not-installed")
+    assert calls[0][-2:] == ["install", "surely-not-installed"]
+
+
+@pytest.fixture
+def custom_module(tmp_path, monkeypatch):
+    """A custom module import_library()ing two packages nobody installed"""
+    package = tmp_path / "zz_custom"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "needs_two.py").write_text(
+        "from utils.scripts import import_library\n"
+        "a = import_library('zz_lib_a')\n"
+        "b = import_library('zz_lib_b')\n"
+    )
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(
+        scripts, "_module_path", lambda name, core: f"zz_custom.{name}"
+    )
+    monkeypatch.setattr(config, "pip_wheel_dir", str(tmp_path))
+
+    calls = []
+
+    async def pip(args, progress=None):
+        # installing a package makes it importable
+        calls.append(args[4:])
+        for name in args[4:]:
+            (tmp_path / f"{name}.py").write_text("")
+
+    monkeypatch.setattr(scripts, "_pip", pip)
+    yield calls
+    for name in ("zz_custom", "zz_custom.needs_two", "zz_lib_a", "zz_lib_b"):
+        sys.modules.pop(name, None)
+
+
+def test_load_module_installs_each_missing_package(custom_module):
+    module = asyncio.run(scripts.load_module("needs_two", client=None))
+    assert module.a.__name__ == "zz_lib_a" and module.b.__name__ == "zz_lib_b"
+    assert custom_module == [["zz_lib_a"], ["zz_lib_b"]]
+
+
+def test_load_modules_installs_each_missing_package(custom_module):
+    async def load():
+        modules = [("needs_two", False)]
+        imported = await scripts.import_modules(modules)
+        return await scripts.load_modules(None, modules, imported)
+
+    assert asyncio.run(load()) == (1, 0)
+    assert custom_module == [["zz_lib_a"], ["zz_lib_b"]]
+
+
+def test_core_modules_install_import_library_packages(custom_module):
+    async def load():
+        modules = [("needs_two", True)]
+        imported = await scripts.import_modules(modules)
+        return await scripts.load_modules(None, modules, imported)
+
+    assert asyncio.run(load()) == (1, 0)
+    assert custom_module == [["zz_lib_a"], ["zz_lib_b"]]
+
+
+def test_aimport_library_installs_without_blocking(custom_module):
+    library = asyncio.run(scripts.aimport_library("zz_lib_a"))
+    assert library.__name__ == "zz_lib_a"
+    assert custom_module == [["zz_lib_a"]]
+
+
+class FakeClient:
+    def __init__(self):
+        self.handlers = []
+
+    def add_handler(self, handler, group=0):
+        self.handlers.append((handler, group))
+
+    def remove_handler(self, handler, group=0):
+        self.handlers.remove((handler, group))
+
+
+def handler_module(group, delay=0.0, body=""):
+    return (
+        "import time\n"
+        "from pyrogram import Client, filters\n"
+        f"time.sleep({delay})\n"
+        f"@Client.on_message(filters.text, group={group})\n"
+        "async def handler(_, __):\n"
+        "    pass\n" + body
+    )
+
+
+@pytest.fixture
+def module_dir(tmp_path, monkeypatch):
+    """Package zz_mods that modules are loaded from, as custom modules"""
+    package = tmp_path / "zz_mods"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(
+        scripts, "_module_path", lambda name, core: f"zz_mods.{name}"
+    )
+    yield package
+    for name in list(sys.modules):
+        if name == "zz_mods" or name.startswith("zz_mods."):
+            del sys.modules[name]
+            scripts.load_stats.pop(name.rpartition(".")[2], None)
+
+
+def test_load_modules_registers_in_order(module_dir):
+    # later modules finish importing first
+    for name, group, delay in (("m1", 1, 0.2), ("m2", 2, 0.1), ("m3", 3, 0)):
+        (module_dir / f"{name}.py").write_text(handler_module(group, delay))
+    (module_dir / "broken.py").write_text("raise RuntimeError('broken')\n")
+    modules = [(name, True) for name in ("m1", "broken", "m2", "m3")]
+    client = FakeClient()
+
+    async def load():
+        imported = await scripts.import_modules(modules, max_workers=4)
+        assert [type(result) for result in imported][1] is RuntimeError
+        return await scripts.load_modules(client, modules, imported)
+
+    assert asyncio.run(load()) == (3, 1)
+    assert [group for _, group in client.handlers] == [1, 2, 3]
+    assert scripts.load_stats["broken"]["error"] == "RuntimeError: broken"
+    assert scripts.load_stats["m1"]["handlers"] == 1
+    assert scripts.load_stats["m1"]["import_ms"] >= 200
+
+
+SUBSCRIBER = (
+    "from utils.db import db\n"
+    "from utils.misc import modules_help\n"
+    "calls = []\n"
+    "db.subscribe('core.zz_hot', lambda *args: calls.append(args))\n"
+    "modules_help['hot'] = {'hot': 'Hot module'}\n"
+)
+
+
+def test_reload_module_replaces_handlers(module_dir):
+    from utils.db import db
+
+    source = module_dir / "hot.py"
+    source.write_text(handler_module(1, body=SUBSCRIBER))
+    client = FakeClient()
+    old = asyncio.run(scripts.load_module("hot", client))
+    assert client.handlers == [(old.handler.handlers[0][0], 1)]
+
+    source.write_text(handler_module(2, body=SUBSCRIBER))
+    new = asyncio.run(scripts.reload_module("hot", client))
+    assert new is not old
+    assert client.handlers == [(new.handler.handlers[0][0], 2)]
+
+    # callbacks of the old module are dropped by db.unsubscribe_all
+    db.set("core.zz_hot", "key", 1)
+    assert old.calls == [] and len(new.calls) == 1
+    asyncio.run(scripts.unload_module("hot", client))
+    db.set("core.zz_hot", "key", 2)
+    assert len(new.calls) == 1 and client.handlers == []
+
+
+def test_reload_module_keeps_module_on_syntax_error(module_dir):
+    source = module_dir / "hot.py"
+    source.write_text(handler_module(1, body=SUBSCRIBER))
+    client = FakeClient()
+    old = asyncio.run(scripts.load_module("hot", client))
+
+    source.write_text(handler_module(2, body="def broken(:\n"))
+    with pytest.raises(SyntaxError):
+        asyncio.run(scripts.reload_module("hot", client))
+    assert sys.modules["zz_mods.hot"] is old
+    assert client.handlers == [(old.handler.handlers[0][0], 1)]
+    assert "hot" in scripts.modules_help
+    asyncio.run(scripts.unload_module("hot", client))
@@ -1,3 +1,5 @@
+import os
+
 import environs
 
 env = environs.Env()
@@ -9,6 +11,31 @@ api_hash = env.str("API_HASH")
 db_type = env.str("DATABASE_TYPE")
 db_url = env.str("DATABASE_URL", "")
 db_name = env.str("DATABASE_NAME")
+db_write_behind = env.bool("DATABASE_WRITE_BEHIND", False)
+db_flush_interval = env.float("DATABASE_FLUSH_INTERVAL", 1.0)
+db_flush_size = env.int("DATABASE_FLUSH_SIZE", 100)
+# the cache doesn't see writes of other processes, keep it off when dbtool
+# or another userbot share the database
+db_cache_size = env.int("DATABASE_CACHE_SIZE", 0)
+db_encoding = env.str("DATABASE_ENCODING", "json")
+db_max_pool_size = env.int("DATABASE_MAX_POOL_SIZE", 100)
+db_min_pool_size = env.int("DATABASE_MIN_POOL_SIZE", 0)
+db_timeout_ms = env.int("DATABASE_TIMEOUT_MS", 5000)
+db_sweep_interval = env.float("DATABASE_SWEEP_INTERVAL", 60.0)
+db_map_size = env.int("DATABASE_MAP_SIZE", 1 << 30)
+db_profile = env.bool("DATABASE_PROFILE", False)
+db_slow_ms = env.float("DATABASE_SLOW_MS", 50.0)
+db_profile_file = env.str("DATABASE_PROFILE_FILE", "db_profile.json")
+
+module_stats_file = env.str("MODULE_STATS_FILE", "module_stats.json")
+module_manifest_file = env.str("MODULE_MANIFEST_FILE", "module_manifest.json")
+lazy_modules = env.bool("LAZY_MODULES", False)
+hot_reload = env.bool("HOT_RELOAD", False)
+hot_reload_interval = env.float("HOT_RELOAD_INTERVAL", 1.0)
+pip_wheel_dir = env.str(
+    "PIP_WHEEL_DIR", os.path.expanduser("~/.cache/dragon-userbot/wheels")
+)
+pip_timeout = env.float("PIP_TIMEOUT", 300.0)
 
 test_server = env.bool("TEST_SERVER", False)
 modules_repo_branch = env.str("MODULES_REPO_BRANCH", "master")
@@ -14,26 +14,114 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from __future__ import annotations
+
+import asyncio
+import atexit
+import bisect
+import copy
+import heapq
+import importlib
+import itertools
 import json
+import logging
+import os
+import re
 import sqlite3
+import struct
+import sys
 import threading
-
-import dns.resolver
-import pymongo
+import time
+import weakref
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
 from utils import config
 
-dns.resolver.default_resolver = dns.resolver.Resolver(configure=False)
-dns.resolver.default_resolver.nameservers = ["8.8.8.8"]
+# pymongo and dnspython take a while to import, so MongoDatabase imports
+# them on first use and SQLite/LMDB users never do
+pymongo = None
+
+_MISSING = object()
+_NOT_CACHED = object()
+
+# datetime.UTC only exists since Python 3.11
+_UTC = timezone.utc  # noqa: UP017
+
+# value passed to subscribers when a key is removed
+REMOVED = object()
+
+# keyed sub-collections are stored as "<namespace>/<key>" variables
+ENTRY_SEPARATOR = "/"
+# rows fetched per query by scan()
+SCAN_BATCH_SIZE = 500
+
+
+def _entry_prefix(namespace) -> str:
+    namespace = str(namespace)
+    if ENTRY_SEPARATOR in namespace:
+        raise ValueError(f"namespace can't contain {ENTRY_SEPARATOR!r}")
+    return namespace + ENTRY_SEPARATOR
+
+
+def _prefix_end(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _merge_scan(
+    rows: Iterable[tuple], pending: Iterable[tuple], limit: int | None
+) -> Iterator[tuple[str, object]]:
+    """Merge (variable, value) pairs sorted by variable, pending wins.
+
+    Values that are _MISSING (removed or expired) are skipped, at most
+    limit pairs are yielded.
+    """
+    if limit is not None and limit <= 0:
+        return
+    merged = heapq.merge(
+        ((variable, 0, value) for variable, value in pending),
+        ((variable, 1, value) for variable, value in rows),
+        key=lambda item: item[:2],
+    )
+    count = 0
+    last = _MISSING
+    for variable, _, value in merged:
+        if variable == last:
+            continue
+        last = variable
+        if value is _MISSING:
+            continue
+        yield variable, value
+        count += 1
+        if count == limit:
+            return
+
+
+def _deadline(ttl: float | None) -> float | None:
+    """Unix time at which a key written now with ttl expires"""
+    return None if ttl is None else time.time() + ttl
+
+
+def _expired(expires: float | None, now: float = None) -> bool:
+    return expires is not None and expires <= (now or time.time())
 
 
 class Database:
+    # executor for the async API, None means the loop's default one
+    _executor: Executor | None = None
+    # module -> change callbacks, created by the first subscribe()
+    _subscribers: dict[str, list] | None = None
+
     def get(self, module: str, variable: str, default=None):
         """Get value from database"""
         raise NotImplementedError
 
-    def set(self, module: str, variable: str, value):
-        """Set key in database"""
+    def set(self, module: str, variable: str, value, ttl: float | None = None):
+        """Set key in database, it expires after ttl seconds if given"""
         raise NotImplementedError
 
     def remove(self, module: str, variable: str):
@@ -44,131 +132,2205 @@ class Database:
         """Get database for selected module"""
         raise NotImplementedError
 
+    def modules(self) -> list:
+        """Get names of all modules stored in database"""
+        raise NotImplementedError
+
+    def get_many(
+        self, module: str, variables: Iterable[str], default=None
+    ) -> dict:
+        """Get several keys from database"""
+        return {
+            variable: self.get(module, variable, default)
+            for variable in variables
+        }
+
+    def get_many_expiring(
+        self, module: str, variables: Iterable[str]
+    ) -> dict[str, tuple[object, float | None]]:
+        """Get (value, expires) of several keys, missing ones are left out.
+
+        expires is the unix time at which the key expires, None if it
+        doesn't.
+        """
+        return {
+            variable: (value, None)
+            for variable, value in self.get_many(
+                module, variables, _MISSING
+            ).items()
+            if value is not _MISSING
+        }
+
+    def set_many(self, module: str, values: dict, ttl: float | None = None):
+        """Set several keys in database at once"""
+        with self.transaction():
+            for variable, value in values.items():
+                self.set(module, variable, value, ttl)
+
+    def remove_many(self, module: str, variables: Iterable[str]):
+        """Remove several keys from database at once"""
+        with self.transaction():
+            for variable in variables:
+                self.remove(module, variable)
+
+    @contextmanager
+    def transaction(self):
+        """Apply all writes made inside the block atomically.
+
+        The a* methods called inside the block run on the calling thread,
+        so in a coroutine writes of other coroutines on the event loop
+        join the transaction while it awaits.
+        """
+        yield self
+
+    def _owns_transaction(self) -> bool:
+        """Whether the calling thread has a transaction() open"""
+        return False
+
+    def get_entry(self, module: str, namespace, key: str, default=None):
+        """Get one entry of a keyed sub-collection"""
+        return self.get(module, _entry_prefix(namespace) + key, default)
+
+    def set_entry(
+        self,
+        module: str,
+        namespace,
+        key: str,
+        value,
+        ttl: float | None = None,
+    ):
+        """Set one entry of a keyed sub-collection"""
+        return self.set(module, _entry_prefix(namespace) + key, value, ttl)
+
+    def remove_entry(self, module: str, namespace, key: str):
+        """Remove one entry of a keyed sub-collection"""
+        return self.remove(module, _entry_prefix(namespace) + key)
+
+    def get_entries(self, module: str, namespace) -> dict:
+        """Get all entries of a keyed sub-collection"""
+        prefix = _entry_prefix(namespace)
+        return {
+            variable[len(prefix) :]: value
+            for variable, value in self.scan(module, prefix)
+        }
+
+    def scan(
+        self,
+        module: str,
+        prefix: str = "",
+        start: str | None = None,
+        limit: int | None = None,
+    ) -> Iterator[tuple[str, object]]:
+        """Iterate over (variable, value) pairs of module in variable order.
+
+        Only variables starting with prefix and not less than start are
+        returned, at most limit of them. Backends read them lazily in
+        batches over the index on var.
+        """
+        rows = sorted(
+            (variable, value)
+            for variable, value in self.get_collection(module).items()
+            if variable.startswith(prefix)
+            and (start is None or variable >= start)
+        )
+        return _merge_scan(rows, (), limit)
+
+    def migrate_to_entries(self, module: str):
+        """Split dict values of module into keyed sub-collections.
+
+        Every ``{key: value}`` stored under ``namespace`` becomes a
+        separate entry, so it can be read and written on its own.
+        """
+        with self.transaction():
+            for namespace, value in self.get_collection(module).items():
+                if ENTRY_SEPARATOR in namespace or not isinstance(value, dict):
+                    continue
+                prefix = _entry_prefix(namespace)
+                self.set_many(
+                    module, {prefix + key: item for key, item in value.items()}
+                )
+                self.remove(module, namespace)
+
+    def subscribe(self, module: str, callback: Callable):
+        """Call ``callback(module, variable, value)`` after every change.
+
+        ``value`` is ``REMOVED`` for removed keys. Changes made inside
+        transaction() are reported once it commits. Callbacks run in the
+        thread that made the change and must not modify the value.
+        """
+        if self._subscribers is None:
+            self._subscribers = defaultdict(list)
+        self._subscribers[module].append(callback)
+        return callback
+
+    def unsubscribe(self, module: str, callback: Callable):
+        """Stop calling callback on changes of module"""
+        callbacks = (self._subscribers or {}).get(module, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def unsubscribe_all(self, owner: str):
+        """Drop callbacks defined in python module owner, e.g. on unload"""
+        for callbacks in (self._subscribers or {}).values():
+            callbacks[:] = [
+                callback
+                for callback in callbacks
+                if getattr(callback, "__module__", None) != owner
+            ]
+
+    def _notify(self, module: str, variable: str, value):
+        if not self._subscribers:
+            return
+        for callback in tuple(self._subscribers.get(module, ())):
+            try:
+                callback(module, variable, value)
+            except Exception:
+                logging.exception(f"Change callback for {module!r} failed")
+
+    def purge_expired(self) -> int:
+        """Delete expired keys, returns how many were removed"""
+        return 0
+
+    async def sweep_expired(self, interval: float = 60.0):
+        """Purge expired keys every interval seconds, run it as a task"""
+        while True:
+            try:
+                removed = await self._run_in_executor(self.purge_expired)
+            except Exception:
+                logging.exception("Failed to purge expired database keys")
+            else:
+                if removed:
+                    logging.debug(f"Purged {removed} expired database keys")
+            await asyncio.sleep(interval)
+
+    def flush(self):
+        """Write pending changes to the storage"""
+
     def close(self):
         """Close the database"""
         raise NotImplementedError
 
+    async def _run_in_executor(self, func, *args):
+        if self._owns_transaction():
+            # an executor thread would wait for this thread's transaction
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def aget(self, module: str, variable: str, default=None):
+        """Get value from database without blocking the event loop"""
+        return await self._run_in_executor(self.get, module, variable, default)
+
+    async def aset(
+        self, module: str, variable: str, value, ttl: float | None = None
+    ):
+        """Set key in database without blocking the event loop"""
+        return await self._run_in_executor(
+            self.set, module, variable, value, ttl
+        )
+
+    async def aremove(self, module: str, variable: str):
+        """Remove key from database without blocking the event loop"""
+        return await self._run_in_executor(self.remove, module, variable)
+
+    async def aget_many_expiring(
+        self, module: str, variables: Iterable[str]
+    ) -> dict[str, tuple[object, float | None]]:
+        """get_many_expiring() without blocking the event loop"""
+        return await self._run_in_executor(
+            self.get_many_expiring, module, list(variables)
+        )
+
+    async def aget_collection(self, module: str) -> dict:
+        """Get database for selected module without blocking the event loop"""
+        return await self._run_in_executor(self.get_collection, module)
+
+    async def aget_entry(self, module: str, namespace, key: str, default=None):
+        """Get one entry of a keyed sub-collection without blocking"""
+        return await self.aget(module, _entry_prefix(namespace) + key, default)
+
+    async def aset_entry(
+        self,
+        module: str,
+        namespace,
+        key: str,
+        value,
+        ttl: float | None = None,
+    ):
+        """Set one entry of a keyed sub-collection without blocking"""
+        return await self.aset(
+            module, _entry_prefix(namespace) + key, value, ttl
+        )
+
+    async def aremove_entry(self, module: str, namespace, key: str):
+        """Remove one entry of a keyed sub-collection without blocking"""
+        return await self.aremove(module, _entry_prefix(namespace) + key)
+
+    async def aget_entries(self, module: str, namespace) -> dict:
+        """Get all entries of a keyed sub-collection without blocking"""
+        return await self._run_in_executor(self.get_entries, module, namespace)
+
+    async def ascan(
+        self,
+        module: str,
+        prefix: str = "",
+        start: str | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[tuple[str, object]]:
+        """scan() without blocking the event loop, one batch at a time"""
+        iterator = self.scan(module, prefix, start, limit)
+        while True:
+            batch = await self._run_in_executor(
+                list, itertools.islice(iterator, SCAN_BATCH_SIZE)
+            )
+            if not batch:
+                return
+            for item in batch:
+                yield item
+
+
+def _import_pymongo():
+    global pymongo
+    if pymongo is None:
+        import dns.resolver
+        import pymongo as module
+
+        dns.resolver.default_resolver = dns.resolver.Resolver(configure=False)
+        dns.resolver.default_resolver.nameservers = ["8.8.8.8"]
+        pymongo = module
+    return pymongo
+
+
+_VAL_PROJECTION = {"_id": 0, "val": 1, "exp": 1}
+_VAR_VAL_PROJECTION = {"_id": 0, "var": 1, "val": 1, "exp": 1}
+
+
+def _mongo_update(value, expires: float | None) -> dict:
+    if expires is None:
+        return {"$set": {"val": value}, "$unset": {"exp": ""}}
+    # a date field, so that the TTL index can remove the document
+    exp = datetime.fromtimestamp(expires, _UTC)
+    return {"$set": {"val": value, "exp": exp}}
+
+
+def _doc_expires(doc: dict) -> float | None:
+    exp = doc.get("exp")
+    if exp is None:
+        return None
+    # pymongo returns naive datetimes in UTC
+    if exp.tzinfo is None:
+        exp = exp.replace(tzinfo=_UTC)
+    return exp.timestamp()
+
+
+def _doc_value(doc: dict):
+    """Value of a stored document, _MISSING if it has expired"""
+    if _expired(_doc_expires(doc)):
+        return _MISSING
+    return doc["val"]
+
+
+def _pending_value(entry):
+    """Value of a buffered write, _MISSING if removed or expired"""
+    if entry is _MISSING or _expired(entry[1]):
+        return _MISSING
+    return entry[0]
+
 
 class MongoDatabase(Database):
-    def __init__(self, url, name):
-        self._client = pymongo.MongoClient(url)
+    def __init__(
+        self,
+        url,
+        name,
+        max_pool_size: int = 100,
+        min_pool_size: int = 0,
+        timeout_ms: int = 5000,
+        client: pymongo.MongoClient | None = None,
+    ):
+        _import_pymongo()
+        self._url = url
+        self._name = name
+        self._client_options = {
+            "maxPoolSize": max_pool_size,
+            "minPoolSize": min_pool_size,
+            "serverSelectionTimeoutMS": timeout_ms,
+            "connectTimeoutMS": timeout_ms,
+        }
+        # client can be passed in to use a stand-in, e.g. for benchmarks
+        self._client = client or pymongo.MongoClient(
+            url, **self._client_options
+        )
         self._database = self._client[name]
+        # motor client is created on first async call, inside the running loop
+        self._async_client = None
+        self._async_db = None
+        # writes buffered by transaction():
+        # module -> {var: (value, expires) or _MISSING}
+        self._local = threading.local()
+        # collections that already have an index on var
+        self._indexed = set()
+
+    @property
+    def _async_database(self):
+        if self._async_db is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            self._async_client = AsyncIOMotorClient(
+                self._url, **self._client_options
+            )
+            self._async_db = self._async_client[self._name]
+        return self._async_db
+
+    def _collection(self, module: str):
+        collection = self._database[module]
+        if module not in self._indexed:
+            try:
+                collection.create_index("var", unique=True)
+            except pymongo.errors.DuplicateKeyError:
+                logging.warning(
+                    f"Duplicate keys in {module!r}, its var index isn't unique"
+                )
+                collection.create_index("var")
+            # the server removes expired keys on its own, about once a minute
+            collection.create_index("exp", expireAfterSeconds=0)
+            self._indexed.add(module)
+        return collection
 
-    def set(self, module: str, variable: str, value):
-        self._database[module].replace_one(
-            {"var": variable}, {"var": variable, "val": value}, upsert=True
+    async def _acollection(self, module: str):
+        if module not in self._indexed:
+            # index creation is rare, don't duplicate it for motor
+            await self._run_in_executor(self._collection, module)
+        return self._async_database[module]
+
+    def _pending(self, module: str) -> dict | None:
+        ops = getattr(self._local, "ops", None)
+        return None if ops is None else ops.setdefault(module, {})
+
+    def set(self, module: str, variable: str, value, ttl: float | None = None):
+        pending = self._pending(module)
+        if pending is not None:
+            pending[variable] = (value, _deadline(ttl))
+            return
+
+        self._collection(module).update_one(
+            {"var": variable}, _mongo_update(value, _deadline(ttl)), upsert=True
         )
+        self._notify(module, variable, value)
 
     def get(self, module: str, variable: str, expected_value=None):
-        doc = self._database[module].find_one({"var": variable})
-        return expected_value if doc is None else doc["val"]
+        pending = self._pending(module)
+        if pending and variable in pending:
+            value = _pending_value(pending[variable])
+            return expected_value if value is _MISSING else value
+
+        doc = self._collection(module).find_one(
+            {"var": variable}, _VAL_PROJECTION
+        )
+        value = _MISSING if doc is None else _doc_value(doc)
+        return expected_value if value is _MISSING else value
+
+    def _overlay(self, module: str, collection: dict, prefix: str = ""):
+        """Apply writes buffered by transaction() to a read result"""
+        for variable, entry in (self._pending(module) or {}).items():
+            if not variable.startswith(prefix):
+                continue
+            value = _pending_value(entry)
+            if value is _MISSING:
+                collection.pop(variable[len(prefix) :], None)
+            else:
+                collection[variable[len(prefix) :]] = value
+        return collection
 
     def get_collection(self, module: str):
+        collection = {}
+        for item in self._collection(module).find({}, _VAR_VAL_PROJECTION):
+            value = _doc_value(item)
+            if value is not _MISSING:
+                collection[item["var"]] = value
+        return self._overlay(module, collection)
+
+    def remove(self, module: str, variable: str):
+        pending = self._pending(module)
+        if pending is not None:
+            pending[variable] = _MISSING
+            return
+
+        self._collection(module).delete_one({"var": variable})
+        self._notify(module, variable, REMOVED)
+
+    def scan(
+        self,
+        module: str,
+        prefix: str = "",
+        start: str | None = None,
+        limit: int | None = None,
+    ) -> Iterator[tuple[str, object]]:
+        bounds = {}
+        if prefix:
+            # anchored regex is served from the var index
+            bounds["$regex"] = f"^{re.escape(prefix)}"
+        if start is not None:
+            bounds["$gte"] = start
+        cursor = (
+            self._collection(module)
+            .find({"var": bounds} if bounds else {}, _VAR_VAL_PROJECTION)
+            .sort("var", pymongo.ASCENDING)
+            .batch_size(min(limit or SCAN_BATCH_SIZE, SCAN_BATCH_SIZE))
+        )
+        pending = sorted(
+            (variable, _pending_value(entry))
+            for variable, entry in (self._pending(module) or {}).items()
+            if variable.startswith(prefix)
+            and (start is None or variable >= start)
+        )
+        rows = ((doc["var"], _doc_value(doc)) for doc in cursor)
+        return _merge_scan(rows, pending, limit)
+
+    def get_many(self, module: str, variables: Iterable[str], default=None):
+        variables = list(variables)
+        pending = self._pending(module) or {}
+        found = {
+            doc["var"]: _doc_value(doc)
+            for doc in self._collection(module).find(
+                {"var": {"$in": [v for v in variables if v not in pending]}},
+                _VAR_VAL_PROJECTION,
+            )
+        }
+        for variable, entry in pending.items():
+            found[variable] = _pending_value(entry)
         return {
-            item["var"]: item["val"] for item in self._database[module].find()
+            variable: (
+                default
+                if found.get(variable, _MISSING) is _MISSING
+                else found[variable]
+            )
+            for variable in variables
         }
 
-    def remove(self, module: str, variable: str):
-        self._database[module].delete_one({"var": variable})
+    def get_many_expiring(
+        self, module: str, variables: Iterable[str]
+    ) -> dict[str, tuple[object, float | None]]:
+        variables = list(variables)
+        pending = self._pending(module) or {}
+        found = {
+            doc["var"]: (_doc_value(doc), _doc_expires(doc))
+            for doc in self._collection(module).find(
+                {"var": {"$in": [v for v in variables if v not in pending]}},
+                _VAR_VAL_PROJECTION,
+            )
+        }
+        for variable, entry in pending.items():
+            value = _pending_value(entry)
+            found[variable] = (value, None if value is _MISSING else entry[1])
+        return {
+            variable: found[variable]
+            for variable in variables
+            if found.get(variable, (_MISSING,))[0] is not _MISSING
+        }
+
+    def set_many(self, module: str, values: dict, ttl: float | None = None):
+        expires = _deadline(ttl)
+        with self.transaction():
+            self._pending(module).update(
+                (variable, (value, expires))
+                for variable, value in values.items()
+            )
+
+    def remove_many(self, module: str, variables: Iterable[str]):
+        with self.transaction():
+            self._pending(module).update(dict.fromkeys(variables, _MISSING))
+
+    @contextmanager
+    def transaction(self):
+        if getattr(self._local, "ops", None) is not None:
+            # nested, outer transaction will write everything
+            yield self
+            return
+
+        self._local.ops = ops = {}
+        try:
+            yield self
+        finally:
+            self._local.ops = None
+
+        self._write_ops(ops)
+
+    def _owns_transaction(self) -> bool:
+        return getattr(self._local, "ops", None) is not None
+
+    def _write_ops(self, ops: dict[str, dict]):
+        ops = {module: changes for module, changes in ops.items() if changes}
+
+        def write(session=None):
+            for module, changes in ops.items():
+                requests = [
+                    (
+                        pymongo.DeleteOne({"var": variable})
+                        if entry is _MISSING
+                        else pymongo.UpdateOne(
+                            {"var": variable},
+                            _mongo_update(*entry),
+                            upsert=True,
+                        )
+                    )
+                    for variable, entry in changes.items()
+                ]
+                self._collection(module).bulk_write(
+                    requests, ordered=False, session=session
+                )
+
+        if len(ops) <= 1:
+            # a single bulk_write doesn't need a session
+            write()
+        else:
+            with self._client.start_session() as session:
+                try:
+                    session.with_transaction(write)
+                except pymongo.errors.OperationFailure as e:
+                    # standalone servers don't support multi-document
+                    # transactions
+                    if e.code != 20:
+                        raise
+                    write()
+
+        for module, changes in ops.items():
+            for variable, entry in changes.items():
+                self._notify(
+                    module,
+                    variable,
+                    REMOVED if entry is _MISSING else entry[0],
+                )
+
+    def modules(self) -> list:
+        return sorted(self._database.list_collection_names())
+
+    def purge_expired(self) -> int:
+        # the TTL index does this too, but only once a minute and without
+        # notifying subscribers
+        query = {"exp": {"$lte": datetime.now(_UTC)}}
+        removed = 0
+        # only collections this process uses or watches, others in a
+        # shared database may have no exp index to serve the query
+        modules = set(self._indexed) | set(self._subscribers or ())
+        for module in sorted(modules):
+            collection = self._collection(module)
+            variables = [
+                doc["var"]
+                for doc in collection.find(query, {"_id": 0, "var": 1})
+            ]
+            if not variables:
+                continue
+            collection.delete_many({"var": {"$in": variables}, **query})
+            for variable in variables:
+                self._notify(module, variable, REMOVED)
+            removed += len(variables)
+        return removed
 
     def close(self):
         self._client.close()
+        if self._async_client is not None:
+            self._async_client.close()
+
+    async def aset(
+        self, module: str, variable: str, value, ttl: float | None = None
+    ):
+        if self._pending(module) is not None:
+            return self.set(module, variable, value, ttl)
+
+        collection = await self._acollection(module)
+        await collection.update_one(
+            {"var": variable}, _mongo_update(value, _deadline(ttl)), upsert=True
+        )
+        self._notify(module, variable, value)
+
+    async def aget(self, module: str, variable: str, expected_value=None):
+        if self._pending(module):
+            return self.get(module, variable, expected_value)
+
+        collection = await self._acollection(module)
+        doc = await collection.find_one({"var": variable}, _VAL_PROJECTION)
+        value = _MISSING if doc is None else _doc_value(doc)
+        return expected_value if value is _MISSING else value
+
+    async def aget_collection(self, module: str):
+        collection = {}
+        async for item in (await self._acollection(module)).find(
+            {}, _VAR_VAL_PROJECTION
+        ):
+            value = _doc_value(item)
+            if value is not _MISSING:
+                collection[item["var"]] = value
+        return self._overlay(module, collection)
+
+    async def aget_entries(self, module: str, namespace) -> dict:
+        if self._pending(module):
+            # buffered writes are only visible to the thread that made them
+            return self.get_entries(module, namespace)
+        return await super().aget_entries(module, namespace)
+
+    async def aremove(self, module: str, variable: str):
+        if self._pending(module) is not None:
+            return self.remove(module, variable)
+
+        collection = await self._acollection(module)
+        await collection.delete_one({"var": variable})
+        self._notify(module, variable, REMOVED)
+
+
+_UPSERT_SQL = """
+INSERT INTO '{}' (var, val, type, expires) VALUES ( :var, :val, :type, :expires )
+ON CONFLICT (var) DO
+UPDATE SET val=:val, type=:type, expires=:expires WHERE var=:var
+"""
+_DELETE_SQL = "DELETE FROM '{}' WHERE var=:var"
+
+
+def _codec(name: str):
+    # msgpack and orjson are optional, import them only when used
+    return importlib.import_module(name)
+
+
+def _check_encoding(encoding: str) -> str:
+    if encoding not in ("json", "msgpack", "orjson"):
+        raise ValueError(f"Unknown database encoding: {encoding}")
+    if encoding != "json":
+        try:
+            _codec(encoding)
+        except ImportError:
+            logging.warning(
+                f"{encoding} is not installed, using json instead, "
+                f"install it with: pip install {encoding}"
+            )
+            return "json"
+    return encoding
+
+
+def _encode(value, encoding: str):
+    """Encode non-scalar value for storage, compact encodings are BLOBs"""
+    if encoding == "msgpack":
+        return _codec("msgpack").packb(value, use_bin_type=True)
+    elif encoding == "orjson":
+        orjson = _codec("orjson")
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value)
+
+
+def _dump(value, encoding: str) -> tuple[object, str]:
+    """Serialize value, returns it with its type name"""
+    if isinstance(value, bool):
+        return ("1" if value else "0"), "bool"
+    elif isinstance(value, str):
+        return value, "str"
+    elif isinstance(value, int):
+        return str(value), "int"
+    else:
+        return _encode(value, encoding), encoding
+
+
+def _decode(val, typ: str):
+    """Deserialize value dumped with type typ"""
+    if typ == "bool":
+        return val == "1"
+    elif typ == "int":
+        return int(val)
+    elif typ == "str":
+        return val
+    elif typ == "msgpack":
+        return _codec("msgpack").unpackb(val, strict_map_key=False)
+    elif typ == "orjson":
+        return _codec("orjson").loads(val)
+    else:
+        return json.loads(val)
+
+
+class _Reader:
+    """Reader connection of a thread, closed once the thread exits"""
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+
+def _close_reader(conn: sqlite3.Connection, readers: set, lock: threading.Lock):
+    with lock:
+        readers.discard(conn)
+    conn.close()
 
 
 class SqliteDatabase(Database):
-    def __init__(self, file):
-        self._conn = sqlite3.connect(file, check_same_thread=False)
-        self._conn.row_factory = sqlite3.Row
+    # tables used by core modules, created up front so that first access
+    # doesn't have to fail with "no such table" and retry
+    KNOWN_TABLES = (
+        "core.afk",
+        "core.antipm",
+        "core.ats",
+        "core.filters",
+        "core.main",
+        "core.notes",
+        "core.sessionkiller",
+        "core.updater",
+    )
+
+    def __init__(
+        self,
+        file,
+        write_behind: bool = False,
+        flush_interval: float = 1.0,
+        flush_size: int = 100,
+        busy_timeout: float = 5.0,
+        executor_workers: int = 4,
+        encoding: str = "json",
+    ):
+        self._file = file
+        self._encoding = _check_encoding(encoding)
+        self._busy_timeout = busy_timeout
+        self._in_memory = file in ("", ":memory:")
+
+        # single writer connection, shared between threads behind the lock
+        self._conn = self._connect()
         self._cursor = self._conn.cursor()
-        self._lock = threading.Lock()
+        self._lock = threading.RLock()
+        # transaction() holds the lock, so only its thread touches these
+        self._tx_depth = 0
+        self._tx_thread: int | None = None
+        # change events of the running transaction, sent once it commits
+        self._tx_events: list = []
 
-    @staticmethod
-    def _parse_row(row: sqlite3.Row):
-        if row["type"] == "bool":
-            return row["val"] == "1"
-        elif row["type"] == "int":
-            return int(row["val"])
-        elif row["type"] == "str":
-            return row["val"]
-        else:
-            return json.loads(row["val"])
+        # readers get their own connection per thread, WAL lets them run
+        # concurrently with the writer (and with other processes). The
+        # thread-local holder goes away with its thread, closing it
+        self._local = threading.local()
+        self._readers: set[sqlite3.Connection] = set()
+        self._readers_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=executor_workers, thread_name_prefix="sqlite"
+        )
 
-    def _execute(self, module: str, *args, **kwargs) -> sqlite3.Cursor:
-        self._lock.acquire()
-        try:
-            return self._cursor.execute(*args, **kwargs)
-        except sqlite3.OperationalError as e:
-            if str(e).startswith("no such table"):
-                sql = f"""
-                CREATE TABLE IF NOT EXISTS '{module}' (
-                var TEXT UNIQUE NOT NULL,
-                val TEXT NOT NULL,
-                type TEXT NOT NULL
-                )
-                """
-                self._cursor.execute(sql)
-                self._conn.commit()
-                return self._cursor.execute(*args, **kwargs)
-            raise e from None
-        finally:
-            self._lock.release()
+        # write-behind journal: (module, variable) -> (val, type, expires)
+        # or None for removed keys. Flushed in one transaction by size or
+        # by time
+        self._write_behind = write_behind
+        self._flush_interval = flush_interval
+        self._flush_size = flush_size
+        self._journal: dict[tuple[str, str], tuple | None] = {}
+        self._flush_timer: threading.Timer | None = None
 
-    def get(self, module: str, variable: str, default=None):
-        sql = f"SELECT * FROM '{module}' WHERE var=:var"
-        cur = self._execute(module, sql, {"tabl": module, "var": variable})
+        if not self._in_memory:
+            self._conn.execute("PRAGMA journal_mode=WAL")
 
-        row = cur.fetchone()
-        if row is None:
-            return default
-        else:
-            return self._parse_row(row)
+        self._tables = set()
+        with self._lock:
+            for row in self._conn.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+            ).fetchall():
+                # tables written before keys could expire lack the column
+                self._upgrade_table(row["name"])
+                self._tables.add(row["name"])
+            for module in self.KNOWN_TABLES:
+                self._ensure_table(module)
+            self._conn.commit()
+
+        if write_behind:
+            atexit.register(self.flush)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._file, timeout=self._busy_timeout, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={int(self._busy_timeout * 1000)}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        reader = getattr(self._local, "reader", None)
+        if reader is None:
+            reader = self._local.reader = _Reader(self._connect())
+            with self._readers_lock:
+                self._readers.add(reader.conn)
+            weakref.finalize(
+                reader,
+                _close_reader,
+                reader.conn,
+                self._readers,
+                self._readers_lock,
+            )
+        return reader.conn
+
+    def _query(self, *args, **kwargs) -> list:
+        # every connection to :memory: is a separate database, and only
+        # the writer sees changes of a transaction that isn't committed yet
+        if self._in_memory or self._tx_thread == threading.get_ident():
+            with self._lock:
+                return self._conn.execute(*args, **kwargs).fetchall()
+
+        return self._reader().execute(*args, **kwargs).fetchall()
+
+    def _read(self, module: str, *args, **kwargs) -> list:
+        """Run a read-only query on the reader connection"""
+        if not self._table_exists(module):
+            return []
+        return self._query(*args, **kwargs)
+
+    def _table_exists(self, module: str) -> bool:
+        if module in self._tables:
+            return True
+
+        # might have been created by another process
+        rows = self._query(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+            (module,),
+        )
+        if rows:
+            with self._lock:
+                self._ensure_table(module)
+                self._commit()
+        return bool(rows)
+
+    _parse_value = staticmethod(_decode)
+
+    @classmethod
+    def _parse_row(cls, row: sqlite3.Row):
+        """Value of a row, _MISSING if it has expired"""
+        if _expired(row["expires"]):
+            return _MISSING
+        return cls._parse_value(row["val"], row["type"])
+
+    @classmethod
+    def _parse_entry(cls, entry: tuple | None):
+        """Value of a journal entry, _MISSING if removed or expired"""
+        if entry is None or _expired(entry[2]):
+            return _MISSING
+        return cls._parse_value(entry[0], entry[1])
+
+    def _dump_value(self, value) -> tuple[object, str]:
+        return _dump(value, self._encoding)
+
+    def convert_encoding(self, encoding: str = None) -> int:
+        """Re-encode stored non-scalar values, returns number of changed rows"""
+        encoding = encoding or self._encoding
+        self.flush()
+
+        converted = 0
+        for module in sorted(self._tables):
+            rows = self._read(
+                module,
+                f"SELECT var, val, type, expires FROM '{module}' "
+                f"WHERE type NOT IN ('bool', 'int', 'str', :type)",
+                {"type": encoding},
+            )
+            params = [
+                {
+                    "var": row["var"],
+                    "val": _encode(
+                        self._parse_value(row["val"], row["type"]), encoding
+                    ),
+                    "type": encoding,
+                    "expires": row["expires"],
+                }
+                for row in rows
+            ]
+            if params:
+                with self.transaction():
+                    self._executemany(
+                        module, _UPSERT_SQL.format(module), params
+                    )
+                converted += len(params)
+
+        return converted
+
+    def _ensure_table(self, module: str):
+        """Create table for module if needed. Writer lock must be held"""
+        if module in self._tables:
+            return
 
-    def set(self, module: str, variable: str, value) -> bool:
         sql = f"""
-        INSERT INTO '{module}' VALUES ( :var, :val, :type )
-        ON CONFLICT (var) DO
-        UPDATE SET val=:val, type=:type WHERE var=:var
+        CREATE TABLE IF NOT EXISTS '{module}' (
+        var TEXT UNIQUE NOT NULL,
+        val TEXT NOT NULL,
+        type TEXT NOT NULL,
+        expires REAL
+        )
         """
+        self._cursor.execute(sql)
+        self._upgrade_table(module)
+        self._tables.add(module)
+
+    def _upgrade_table(self, module: str):
+        """Add expiry column and index if missing. Writer lock must be held"""
+        columns = {
+            row["name"]
+            for row in self._conn.execute(f"PRAGMA table_info('{module}')")
+        }
+        if "expires" not in columns:
+            self._cursor.execute(
+                f"ALTER TABLE '{module}' ADD COLUMN expires REAL"
+            )
+        # partial index: only the few keys that can expire are in it
+        self._cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS '{module}.expires' "
+            f"ON '{module}' (expires) WHERE expires IS NOT NULL"
+        )
 
-        if isinstance(value, bool):
-            val = "1" if value else "0"
-            typ = "bool"
-        elif isinstance(value, str):
-            val = value
-            typ = "str"
-        elif isinstance(value, int):
-            val = str(value)
-            typ = "int"
+    def _execute(self, module: str, *args, **kwargs) -> sqlite3.Cursor:
+        """Run a write query on the writer connection"""
+        with self._lock:
+            self._ensure_table(module)
+            return self._cursor.execute(*args, **kwargs)
+
+    def _executemany(self, module: str, sql: str, params: list):
+        with self._lock:
+            self._ensure_table(module)
+            self._cursor.executemany(sql, params)
+
+    def _commit(self):
+        if not self._tx_depth:
+            self._conn.commit()
+
+    def _changed(self, module: str, variable: str, value):
+        if not self._subscribers:
+            return
+        if self._tx_thread == threading.get_ident():
+            self._tx_events.append((module, variable, value))
         else:
-            val = json.dumps(value)
-            typ = "json"
+            self._notify(module, variable, value)
 
-        self._execute(module, sql, {"var": variable, "val": val, "type": typ})
-        self._conn.commit()
+    def get(self, module: str, variable: str, default=None):
+        entry = self._journal.get((module, variable), _NOT_CACHED)
+        if entry is not _NOT_CACHED:
+            value = self._parse_entry(entry)
+        else:
+            sql = f"SELECT * FROM '{module}' WHERE var=:var"
+            rows = self._read(module, sql, {"var": variable})
+            value = self._parse_row(rows[0]) if rows else _MISSING
+
+        return default if value is _MISSING else value
+
+    def set(
+        self, module: str, variable: str, value, ttl: float | None = None
+    ) -> bool:
+        val, typ = self._dump_value(value)
+        expires = _deadline(ttl)
+
+        if self._write_behind:
+            self._journal_write(module, variable, (val, typ, expires))
+        else:
+            with self._lock:
+                self._execute(
+                    module,
+                    _UPSERT_SQL.format(module),
+                    {
+                        "var": variable,
+                        "val": val,
+                        "type": typ,
+                        "expires": expires,
+                    },
+                )
+                self._commit()
 
+        self._changed(module, variable, value)
         return True
 
     def remove(self, module: str, variable: str):
-        sql = f"DELETE FROM '{module}' WHERE var=:var"
-        self._execute(module, sql, {"var": variable})
-        self._conn.commit()
+        if self._write_behind:
+            self._journal_write(module, variable, None)
+        else:
+            with self._lock:
+                self._execute(
+                    module, _DELETE_SQL.format(module), {"var": variable}
+                )
+                self._commit()
+
+        self._changed(module, variable, REMOVED)
+
+    def scan(
+        self,
+        module: str,
+        prefix: str = "",
+        start: str | None = None,
+        limit: int | None = None,
+    ) -> Iterator[tuple[str, object]]:
+        with self._lock:
+            pending = sorted(
+                (variable, self._parse_entry(entry))
+                for (mod, variable), entry in self._journal.items()
+                if mod == module
+                and variable.startswith(prefix)
+                and (start is None or variable >= start)
+            )
+        return _merge_scan(
+            self._scan_rows(module, prefix, start, limit), pending, limit
+        )
+
+    def _scan_rows(
+        self,
+        module: str,
+        prefix: str,
+        start: str | None,
+        limit: int | None,
+    ) -> Iterator[tuple[str, object]]:
+        # keyset pagination: a range over the unique index on var per batch
+        params = {
+            "lower": max(prefix, start or ""),
+            "limit": min(limit or SCAN_BATCH_SIZE, SCAN_BATCH_SIZE),
+        }
+        lower = "var >= :lower"
+        upper = ""
+        if prefix:
+            params["upper"] = _prefix_end(prefix)
+            upper = " AND var < :upper"
+
+        while True:
+            rows = self._read(
+                module,
+                f"SELECT * FROM '{module}' WHERE {lower}{upper} "
+                f"ORDER BY var LIMIT :limit",
+                params,
+            )
+            for row in rows:
+                yield row["var"], self._parse_row(row)
+            if len(rows) < params["limit"]:
+                return
+            lower = "var > :lower"
+            params["lower"] = rows[-1]["var"]
+            params["limit"] = SCAN_BATCH_SIZE
+
+    def get_many(self, module: str, variables: Iterable[str], default=None):
+        variables = list(variables)
+        found = self.get_many_expiring(module, variables)
+        return {
+            variable: found[variable][0] if variable in found else default
+            for variable in variables
+        }
+
+    def get_many_expiring(
+        self, module: str, variables: Iterable[str]
+    ) -> dict[str, tuple[object, float | None]]:
+        found = {}
+        query = []
+        for variable in variables:
+            entry = self._journal.get((module, variable), _NOT_CACHED)
+            if entry is _NOT_CACHED:
+                query.append(variable)
+            else:
+                found[variable] = (self._parse_entry(entry), entry and entry[2])
+
+        # stay below SQLITE_MAX_VARIABLE_NUMBER of old sqlite versions
+        for i in range(0, len(query), 500):
+            chunk = query[i : i + 500]
+            sql = (
+                f"SELECT * FROM '{module}' "
+                f"WHERE var IN ({', '.join('?' * len(chunk))})"
+            )
+            for row in self._read(module, sql, chunk):
+                found[row["var"]] = (self._parse_row(row), row["expires"])
+
+        return {
+            variable: entry
+            for variable, entry in found.items()
+            if entry[0] is not _MISSING
+        }
+
+    def set_many(self, module: str, values: dict, ttl: float | None = None):
+        expires = _deadline(ttl)
+        params = []
+        for variable, value in values.items():
+            val, typ = self._dump_value(value)
+            params.append(
+                {"var": variable, "val": val, "type": typ, "expires": expires}
+            )
+
+        with self.transaction():
+            if self._write_behind:
+                for p in params:
+                    self._journal_write(
+                        module, p["var"], (p["val"], p["type"], expires)
+                    )
+            elif params:
+                self._executemany(module, _UPSERT_SQL.format(module), params)
+            for variable, value in values.items():
+                self._changed(module, variable, value)
+
+    def remove_many(self, module: str, variables: Iterable[str]):
+        variables = list(variables)
+        params = [{"var": variable} for variable in variables]
+
+        with self.transaction():
+            if self._write_behind:
+                for p in params:
+                    self._journal_write(module, p["var"], None)
+            elif params:
+                self._executemany(module, _DELETE_SQL.format(module), params)
+            for variable in variables:
+                self._changed(module, variable, REMOVED)
+
+    def _owns_transaction(self) -> bool:
+        return self._tx_thread == threading.get_ident()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._tx_depth:
+                # nested, the outermost transaction commits
+                self._tx_depth += 1
+                try:
+                    yield self
+                finally:
+                    self._tx_depth -= 1
+                return
+
+            journal = dict(self._journal)
+            events = self._tx_events = []
+            self._tx_depth = 1
+            self._tx_thread = threading.get_ident()
+            try:
+                yield self
+            except BaseException:
+                self._conn.rollback()
+                self._journal = journal
+                # tables created inside the transaction are gone too
+                self._tables = {
+                    row["name"]
+                    for row in self._conn.execute(
+                        "SELECT name FROM sqlite_master WHERE type='table'"
+                    )
+                }
+                raise
+            else:
+                self._conn.commit()
+                if len(self._journal) >= self._flush_size:
+                    self.flush()
+            finally:
+                self._tx_depth = 0
+                self._tx_thread = None
+                self._tx_events = []
+
+        for event in events:
+            self._notify(*event)
 
     def get_collection(self, module: str) -> dict:
-        sql = f"SELECT * FROM '{module}'"
-        cur = self._execute(module, sql)
+        # snapshot the journal before reading, so a concurrent flush can't
+        # make pending writes disappear from the result
+        with self._lock:
+            pending = [
+                (variable, entry)
+                for (mod, variable), entry in self._journal.items()
+                if mod == module
+            ]
+
+        rows = self._read(module, f"SELECT * FROM '{module}'")
 
         collection = {}
-        for row in cur:
-            collection[row["var"]] = self._parse_row(row)
+        for row in rows:
+            value = self._parse_row(row)
+            if value is not _MISSING:
+                collection[row["var"]] = value
+
+        for variable, entry in pending:
+            value = self._parse_entry(entry)
+            if value is _MISSING:
+                collection.pop(variable, None)
+            else:
+                collection[variable] = value
 
         return collection
 
+    def _journal_write(self, module: str, variable: str, entry: tuple | None):
+        with self._lock:
+            self._journal[(module, variable)] = entry
+
+            # inside transaction() the flush waits until it is done
+            if len(self._journal) >= self._flush_size and not self._tx_depth:
+                self.flush()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(
+                    self._flush_interval, self._flush_by_timer
+                )
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _flush_by_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logging.exception("Failed to flush database journal")
+
+    def flush(self):
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+            if not self._journal:
+                return
+
+            upserts: dict[str, list] = {}
+            deletes: dict[str, list] = {}
+            for (module, variable), entry in self._journal.items():
+                if entry is None:
+                    deletes.setdefault(module, []).append({"var": variable})
+                else:
+                    val, typ, expires = entry
+                    upserts.setdefault(module, []).append(
+                        {
+                            "var": variable,
+                            "val": val,
+                            "type": typ,
+                            "expires": expires,
+                        }
+                    )
+
+            try:
+                for module in {*upserts, *deletes}:
+                    self._ensure_table(module)
+                for module, params in upserts.items():
+                    self._cursor.executemany(_UPSERT_SQL.format(module), params)
+                for module, params in deletes.items():
+                    self._cursor.executemany(_DELETE_SQL.format(module), params)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+            self._journal.clear()
+
+    def modules(self) -> list:
+        rows = self._query(
+            "SELECT name FROM sqlite_master "
+            "WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        )
+        with self._lock:
+            # tables of unflushed writes might not exist yet
+            pending = {module for module, _ in self._journal}
+        return sorted({row["name"] for row in rows} | pending)
+
+    def purge_expired(self) -> int:
+        self.flush()
+        now = time.time()
+        removed = 0
+        with self.transaction():
+            for module in list(self._tables):
+                # served from the partial index on expires
+                rows = self._query(
+                    f"SELECT var FROM '{module}' WHERE expires <= ?", (now,)
+                )
+                if not rows:
+                    continue
+                self._execute(
+                    module, f"DELETE FROM '{module}' WHERE expires <= ?", (now,)
+                )
+                for row in rows:
+                    self._changed(module, row["var"], REMOVED)
+                removed += len(rows)
+        return removed
+
+    async def aget(self, module: str, variable: str, default=None):
+        # unflushed writes can be answered without a trip to the executor
+        entry = self._journal.get((module, variable), _NOT_CACHED)
+        if entry is not _NOT_CACHED:
+            value = self._parse_entry(entry)
+            return default if value is _MISSING else value
+        return await super().aget(module, variable, default)
+
     def close(self):
+        self._executor.shutdown(wait=True)
+        self.flush()
         self._conn.commit()
         self._conn.close()
+        with self._readers_lock:
+            readers = list(self._readers)
+            self._readers.clear()
+        for conn in readers:
+            conn.close()
+
+
+# one byte type tag in front of every LMDB value, upper case when an
+# 8 byte expiry deadline follows the tag
+_LMDB_TAGS = {
+    "bool": b"b",
+    "int": b"i",
+    "str": b"s",
+    "json": b"j",
+    "msgpack": b"m",
+    "orjson": b"o",
+}
+_LMDB_TYPES = {tag[0]: typ for typ, tag in _LMDB_TAGS.items()}
+# named database of b"<deadline><module>\0<variable>" keys, sorted by deadline
+_LMDB_EXPIRY_DB = b"\x01expires"
+
+
+class LmdbDatabase(Database):
+    """Embedded memory-mapped key-value store, one named database per module.
+
+    Reads don't take locks and are served straight from the map, so point
+    lookups cost microseconds. Writers are serialized by LMDB itself.
+    """
+
+    def __init__(
+        self,
+        path,
+        map_size: int = 1 << 30,
+        max_dbs: int = 1024,
+        executor_workers: int = 4,
+        encoding: str = "json",
+    ):
+        try:
+            self._lmdb = importlib.import_module("lmdb")
+        except ImportError:
+            raise RuntimeError(
+                "DATABASE_TYPE=lmdb requires the lmdb package, "
+                "install it with: pip install lmdb"
+            ) from None
+
+        self._encoding = _check_encoding(encoding)
+        # map_size is only reserved address space, the file grows as needed.
+        # Without metasync a crash can lose the last commit but never
+        # corrupts the store, like sqlite's synchronous=NORMAL
+        self._env = self._lmdb.open(
+            path,
+            map_size=map_size,
+            max_dbs=max_dbs,
+            readahead=False,
+            metasync=False,
+        )
+        self._dbs = {}
+        self._dbs_lock = threading.Lock()
+        # modules without a database -> id of the last transaction that
+        # saw them missing
+        self._missing: dict[str, int] = {}
+        # held by write transactions of this process, threads waiting for
+        # it release the GIL unlike ones waiting inside LMDB
+        self._write_lock = threading.Lock()
+        self._expiry = self._env.open_db(_LMDB_EXPIRY_DB)
+        # write transaction of transaction(), its change events and the
+        # databases it opened, per thread
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=executor_workers, thread_name_prefix="lmdb"
+        )
+
+    def _txn(self):
+        return getattr(self._local, "txn", None)
+
+    def _owns_transaction(self) -> bool:
+        return self._txn() is not None
+
+    def _db(self, module: str, create: bool):
+        """Handle of module's database, None if it doesn't exist"""
+        handle = self._dbs.get(module)
+        if handle is not None:
+            return handle
+
+        txn = self._txn()
+        if txn is not None:
+            return self._open_db(module, txn, create)
+        if not create and not self._exists(module):
+            return None
+        # open_db() without a transaction starts a write one, LMDB waits
+        # for other writers without releasing the GIL
+        with self._write_lock:
+            return self._open_db(module, None, create)
+
+    def _open_db(self, module: str, txn, create: bool):
+        with self._dbs_lock:
+            handle = self._dbs.get(module)
+            if handle is None:
+                try:
+                    handle = self._env.open_db(
+                        module.encode(), txn=txn, create=create
+                    )
+                except self._lmdb.NotFoundError:
+                    return None
+                self._dbs[module] = handle
+                self._missing.pop(module, None)
+                if txn is not None:
+                    # the handle is gone if the transaction aborts
+                    self._local.new_dbs.append(module)
+        return handle
+
+    def _exists(self, module: str) -> bool:
+        """Look module's database up without waiting for writers"""
+        if self._missing.get(module) == self._env.info()["last_txnid"]:
+            return False
+        with self._env.begin() as txn:
+            if txn.get(module.encode()) is not None:
+                return True
+            # valid until the next commit, which may create it
+            self._missing[module] = txn.id()
+        return False
+
+    @contextmanager
+    def _read(self):
+        txn = self._txn()
+        if txn is not None:
+            # see writes of our own transaction
+            yield txn
+            return
+        with self._env.begin(buffers=True) as txn:
+            yield txn
+
+    @contextmanager
+    def _write(self):
+        txn = self._txn()
+        if txn is not None:
+            yield txn
+            return
+        with self._write_lock, self._env.begin(write=True, buffers=True) as txn:
+            yield txn
+
+    def _changed(self, module: str, variable: str, value):
+        if not self._subscribers:
+            return
+        events = getattr(self._local, "events", None)
+        if events is not None:
+            events.append((module, variable, value))
+        else:
+            self._notify(module, variable, value)
+
+    def _pack(self, value, expires: float | None) -> bytes:
+        val, typ = _dump(value, self._encoding)
+        if isinstance(val, str):
+            val = val.encode()
+        if expires is None:
+            return _LMDB_TAGS[typ] + val
+        return _LMDB_TAGS[typ].upper() + struct.pack("<d", expires) + val
+
+    @staticmethod
+    def _unpack(raw):
+        """Value of a stored record, _MISSING if it has expired"""
+        tag, offset = raw[0], 1
+        if tag < ord("a"):
+            if _expired(struct.unpack_from("<d", raw, 1)[0]):
+                return _MISSING
+            tag, offset = tag + 32, 9
+        typ = _LMDB_TYPES[tag]
+        val = bytes(raw[offset:])
+        if typ not in ("msgpack", "orjson"):
+            val = val.decode()
+        return _decode(val, typ)
+
+    @staticmethod
+    def _expires(raw) -> float | None:
+        """Deadline of a stored record, None if it doesn't expire"""
+        if raw[0] >= ord("a"):
+            return None
+        return struct.unpack_from("<d", raw, 1)[0]
+
+    @classmethod
+    def _expiry_key(cls, raw, module: str, key: bytes) -> bytes | None:
+        """Key of the record in the expiry index, None if it doesn't expire"""
+        expires = None if raw is None else cls._expires(raw)
+        if expires is None:
+            return None
+        # big-endian positive doubles sort like the numbers
+        deadline = struct.pack(">d", expires)
+        return deadline + module.encode() + b"\0" + key
+
+    def _put(self, txn, handle, module: str, variable: str, raw):
+        """Write or delete (raw is None) a record, keeping the index right"""
+        key = variable.encode()
+        old_expiry = self._expiry_key(txn.get(key, db=handle), module, key)
+        if old_expiry is not None:
+            txn.delete(old_expiry, db=self._expiry)
+        if raw is None:
+            txn.delete(key, db=handle)
+            return
+        txn.put(key, raw, db=handle)
+        new_expiry = self._expiry_key(raw, module, key)
+        if new_expiry is not None:
+            txn.put(new_expiry, b"", db=self._expiry)
+
+    def get(self, module: str, variable: str, default=None):
+        handle = self._db(module, create=False)
+        if handle is None:
+            return default
+        with self._read() as txn:
+            raw = txn.get(variable.encode(), db=handle)
+            value = _MISSING if raw is None else self._unpack(raw)
+        return default if value is _MISSING else value
+
+    def get_many(self, module: str, variables: Iterable[str], default=None):
+        variables = list(variables)
+        handle = self._db(module, create=False)
+        if handle is None:
+            return dict.fromkeys(variables, default)
+        found = {}
+        with self._read() as txn:
+            for variable in variables:
+                raw = txn.get(variable.encode(), db=handle)
+                value = _MISSING if raw is None else self._unpack(raw)
+                found[variable] = default if value is _MISSING else value
+        return found
+
+    def get_many_expiring(
+        self, module: str, variables: Iterable[str]
+    ) -> dict[str, tuple[object, float | None]]:
+        handle = self._db(module, create=False)
+        if handle is None:
+            return {}
+        found = {}
+        with self._read() as txn:
+            for variable in variables:
+                raw = txn.get(variable.encode(), db=handle)
+                value = _MISSING if raw is None else self._unpack(raw)
+                if value is not _MISSING:
+                    found[variable] = (value, self._expires(raw))
+        return found
+
+    def set(self, module: str, variable: str, value, ttl: float | None = None):
+        raw = self._pack(value, _deadline(ttl))
+        handle = self._db(module, create=True)
+        with self._write() as txn:
+            self._put(txn, handle, module, variable, raw)
+        self._changed(module, variable, value)
+
+    def remove(self, module: str, variable: str):
+        handle = self._db(module, create=False)
+        if handle is None:
+            return
+        with self._write() as txn:
+            self._put(txn, handle, module, variable, None)
+        self._changed(module, variable, REMOVED)
+
+    def get_collection(self, module: str) -> dict:
+        return dict(self.scan(module))
+
+    def scan(
+        self,
+        module: str,
+        prefix: str = "",
+        start: str | None = None,
+        limit: int | None = None,
+    ) -> Iterator[tuple[str, object]]:
+        return _merge_scan(
+            self._scan_rows(module, prefix, start, limit), (), limit
+        )
+
+    def _scan_rows(
+        self,
+        module: str,
+        prefix: str,
+        start: str | None,
+        limit: int | None,
+    ) -> Iterator[tuple[str, object]]:
+        handle = self._db(module, create=False)
+        if handle is None:
+            return
+
+        # short read transactions per batch, a long one would keep old
+        # pages from being reused while the caller consumes the iterator
+        prefix_key = prefix.encode()
+        lower = max(prefix, start or "").encode()
+        size = min(limit or SCAN_BATCH_SIZE, SCAN_BATCH_SIZE)
+        after = None
+        while True:
+            batch = []
+            with self._read() as txn:
+                cursor = txn.cursor(db=handle)
+                if cursor.set_range(lower):
+                    for key, raw in cursor:
+                        key = bytes(key)
+                        if key == after:
+                            continue
+                        if not key.startswith(prefix_key):
+                            break
+                        batch.append((key.decode(), self._unpack(raw)))
+                        if len(batch) == size:
+                            break
+            yield from batch
+            if len(batch) < size:
+                return
+            lower = after = batch[-1][0].encode()
+            size = SCAN_BATCH_SIZE
+
+    def modules(self) -> list:
+        with self._read() as txn:
+            names = [
+                bytes(key)
+                for key in txn.cursor().iternext(keys=True, values=False)
+            ]
+        return sorted(
+            name.decode() for name in names if name != _LMDB_EXPIRY_DB
+        )
+
+    @contextmanager
+    def transaction(self):
+        if self._txn() is not None:
+            # nested, the outermost transaction commits
+            yield self
+            return
+
+        self._write_lock.acquire()
+        try:
+            txn = self._env.begin(write=True, buffers=True)
+        except BaseException:
+            self._write_lock.release()
+            raise
+        self._local.txn = txn
+        self._local.events = events = []
+        self._local.new_dbs = new_dbs = []
+        try:
+            yield self
+        except BaseException:
+            txn.abort()
+            with self._dbs_lock:
+                for module in new_dbs:
+                    self._dbs.pop(module, None)
+            raise
+        else:
+            txn.commit()
+        finally:
+            self._local.txn = self._local.events = self._local.new_dbs = None
+            self._write_lock.release()
+
+        for event in events:
+            self._notify(*event)
+
+    def purge_expired(self) -> int:
+        now = struct.pack(">d", time.time())
+        removed = 0
+        with self.transaction():
+            txn = self._txn()
+            expired = []
+            for key in txn.cursor(db=self._expiry).iternext(values=False):
+                key = bytes(key)
+                if key[:8] > now:
+                    break
+                expired.append(key)
+
+            for key in expired:
+                module, _, variable = key[8:].decode().partition("\0")
+                handle = self._db(module, create=False)
+                txn.delete(key, db=self._expiry)
+                if handle is not None and txn.delete(
+                    variable.encode(), db=handle
+                ):
+                    self._changed(module, variable, REMOVED)
+                    removed += 1
+        return removed
+
+    async def aget(self, module: str, variable: str, default=None):
+        # a read from the map is cheaper than a trip to the executor
+        return self.get(module, variable, default)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._env.close()
+
+
+class CachedDatabase(Database):
+    """Bounded LRU read-through cache in front of another backend.
+
+    Writes go through to the backend and update the cache, so reads of
+    hot keys (filters, antipm flags, ...) are served from memory. Writes
+    of other processes (dbtool, a second userbot on the same database)
+    are not seen, so only use it when this process is the only writer.
+    """
+
+    def __init__(self, backend: Database, max_size: int = 4096):
+        self._backend = backend
+        self._max_size = max_size
+        self._cache: OrderedDict = OrderedDict()
+        # deadlines of cached keys that were written with a ttl
+        self._expires: dict[tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self._hits: dict[str, int] = defaultdict(int)
+        self._misses: dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def _copy(value):
+        # callers mutate returned lists/dicts before writing them back
+        if isinstance(value, (dict, list)):
+            return copy.deepcopy(value)
+        return value
+
+    def _store(
+        self,
+        key: tuple[str, str],
+        value,
+        overwrite=True,
+        expires: float | None = None,
+    ):
+        with self._lock:
+            if not overwrite and key in self._cache:
+                return
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            if expires is None:
+                self._expires.pop(key, None)
+            else:
+                self._expires[key] = expires
+            while len(self._cache) > self._max_size:
+                self._expires.pop(self._cache.popitem(last=False)[0], None)
+
+    def _lookup(self, module: str, variable: str):
+        key = (module, variable)
+        with self._lock:
+            value = self._cache.get(key, _NOT_CACHED)
+            if value is not _NOT_CACHED and _expired(self._expires.get(key)):
+                del self._cache[key]
+                del self._expires[key]
+                value = _NOT_CACHED
+            if value is not _NOT_CACHED:
+                self._cache.move_to_end(key)
+                self._hits[module] += 1
+            else:
+                self._misses[module] += 1
+        return value
+
+    def _store_read(self, module: str, variable: str, found: dict):
+        value, expires = found.get(variable, (_MISSING, None))
+        # don't overwrite a value set while we were reading
+        self._store((module, variable), self._copy(value), False, expires)
+        return value
+
+    def get(self, module: str, variable: str, default=None):
+        value = self._lookup(module, variable)
+        if value is _NOT_CACHED:
+            found = self._backend.get_many_expiring(module, [variable])
+            value = self._store_read(module, variable, found)
+
+        return default if value is _MISSING else self._copy(value)
+
+    def set(self, module: str, variable: str, value, ttl: float | None = None):
+        result = self._backend.set(module, variable, value, ttl)
+        self._store((module, variable), self._copy(value), True, _deadline(ttl))
+        return result
+
+    def remove(self, module: str, variable: str):
+        self._backend.remove(module, variable)
+        self._store((module, variable), _MISSING)
+
+    def get_many(self, module: str, variables: Iterable[str], default=None):
+        variables = list(variables)
+        found = {}
+        not_cached = []
+        for variable in variables:
+            value = self._lookup(module, variable)
+            if value is _NOT_CACHED:
+                not_cached.append(variable)
+            else:
+                found[variable] = value
+
+        if not_cached:
+            values = self._backend.get_many_expiring(module, not_cached)
+            for variable in not_cached:
+                found[variable] = self._store_read(module, variable, values)
+
+        return {
+            variable: (
+                default
+                if found[variable] is _MISSING
+                else self._copy(found[variable])
+            )
+            for variable in variables
+        }
+
+    def set_many(self, module: str, values: dict, ttl: float | None = None):
+        self._backend.set_many(module, values, ttl)
+        expires = _deadline(ttl)
+        for variable, value in values.items():
+            self._store((module, variable), self._copy(value), True, expires)
+
+    def remove_many(self, module: str, variables: Iterable[str]):
+        variables = list(variables)
+        self._backend.remove_many(module, variables)
+        for variable in variables:
+            self._store((module, variable), _MISSING)
+
+    @contextmanager
+    def transaction(self):
+        with self._backend.transaction():
+            try:
+                yield self
+            except BaseException:
+                # the backend rolled back, forget what the block cached
+                self._clear()
+                raise
+
+    def _clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expires.clear()
+
+    def get_many_expiring(
+        self, module: str, variables: Iterable[str]
+    ) -> dict[str, tuple[object, float | None]]:
+        return self._backend.get_many_expiring(module, variables)
+
+    def purge_expired(self) -> int:
+        removed = self._backend.purge_expired()
+        now = time.time()
+        with self._lock:
+            expired = [
+                key
+                for key, expires in self._expires.items()
+                if _expired(expires, now)
+            ]
+            for key in expired:
+                del self._cache[key]
+                del self._expires[key]
+        return removed
+
+    async def aget(self, module: str, variable: str, default=None):
+        value = self._lookup(module, variable)
+        if value is _NOT_CACHED:
+            found = await self._backend.aget_many_expiring(module, [variable])
+            value = self._store_read(module, variable, found)
+
+        return default if value is _MISSING else self._copy(value)
+
+    async def aset(
+        self, module: str, variable: str, value, ttl: float | None = None
+    ):
+        result = await self._backend.aset(module, variable, value, ttl)
+        self._store((module, variable), self._copy(value), True, _deadline(ttl))
+        return result
+
+    async def aremove(self, module: str, variable: str):
+        await self._backend.aremove(module, variable)
+        self._store((module, variable), _MISSING)
+
+    async def aget_collection(self, module: str) -> dict:
+        return await self._backend.aget_collection(module)
+
+    async def aget_entries(self, module: str, namespace) -> dict:
+        return await self._backend.aget_entries(module, namespace)
+
+    def get_collection(self, module: str) -> dict:
+        return self._backend.get_collection(module)
+
+    def get_entries(self, module: str, namespace) -> dict:
+        return self._backend.get_entries(module, namespace)
+
+    def modules(self) -> list:
+        return self._backend.modules()
+
+    def scan(
+        self,
+        module: str,
+        prefix: str = "",
+        start: str | None = None,
+        limit: int | None = None,
+    ) -> Iterator[tuple[str, object]]:
+        return self._backend.scan(module, prefix, start, limit)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Get cache hit/miss counters per module"""
+        return {
+            module: {
+                "hits": self._hits.get(module, 0),
+                "misses": self._misses.get(module, 0),
+            }
+            for module in sorted({*self._hits, *self._misses})
+        }
+
+    def subscribe(self, module: str, callback: Callable):
+        # the backend reports its changes, including ones made through us
+        return self._backend.subscribe(module, callback)
+
+    def unsubscribe(self, module: str, callback: Callable):
+        self._backend.unsubscribe(module, callback)
+
+    def unsubscribe_all(self, owner: str):
+        self._backend.unsubscribe_all(owner)
+
+    def flush(self):
+        self._backend.flush()
+
+    def close(self):
+        self._backend.close()
+
+
+# upper bounds of the latency histogram buckets, in microseconds
+PROFILE_BUCKETS_US = (10, 100, 1000, 10000, 100000)
+PROFILE_BUCKET_NAMES = ("<10us", "<100us", "<1ms", "<10ms", "<100ms", ">=100ms")
+
+
+class _OpStats:
+    __slots__ = ("count", "total", "max", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * len(PROFILE_BUCKET_NAMES)
+
+
+def _caller() -> str:
+    """Name of the innermost function outside this file, e.g. a handler"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        name = frame.f_globals.get("__name__", "")
+        if frame.f_code.co_filename != __file__ and not name.startswith(
+            ("asyncio", "concurrent", "contextlib", "threading")
+        ):
+            return f"{name}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+class ProfiledDatabase(Database):
+    """Instrumentation wrapper around another backend.
+
+    Counts calls and time per (module, operation), keeps a latency
+    histogram for each and logs operations slower than slow_ms together
+    with the function that issued them.
+    """
+
+    def __init__(
+        self, backend: Database, slow_ms: float = 50.0, slow_log_size=50
+    ):
+        self._backend = backend
+        self._slow = slow_ms / 1000
+        self._lock = threading.Lock()
+        self._ops: dict[tuple[str, str], _OpStats] = {}
+        self._slow_ops = deque(maxlen=slow_log_size)
+        self._since = time.time()
+
+    def _record(self, op: str, module: str, variable, elapsed: float):
+        micros = elapsed * 1e6
+        with self._lock:
+            stats = self._ops.get((module, op))
+            if stats is None:
+                stats = self._ops[module, op] = _OpStats()
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.histogram[bisect.bisect(PROFILE_BUCKETS_US, micros)] += 1
+        if elapsed >= self._slow:
+            caller = _caller()
+            self._slow_ops.append(
+                {
+                    "at": time.time(),
+                    "op": op,
+                    "module": module,
+                    "variable": variable,
+                    "ms": round(elapsed * 1000, 3),
+                    "caller": caller,
+                }
+            )
+            logging.warning(
+                f"Slow database {op} on {module}/{variable}: "
+                f"{elapsed * 1000:.1f} ms in {caller}"
+            )
+
+    @contextmanager
+    def _timed(self, op: str, module: str, variable=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(op, module, variable, time.perf_counter() - start)
+
+    def _timed_scan(self, iterator, module: str, prefix: str):
+        # scan() is lazy, so time is spent while the caller iterates
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            self._record("scan", module, prefix or None, elapsed)
+
+    def get(self, module: str, variable: str, default=None):
+        with self._timed("get", module, variable):
+            return self._backend.get(module, variable, default)
+
+    def set(self, module: str, variable: str, value, ttl: float | None = None):
+        with self._timed("set", module, variable):
+            return self._backend.set(module, variable, value, ttl)
+
+    def remove(self, module: str, variable: str):
+        with self._timed("remove", module, variable):
+            return self._backend.remove(module, variable)
+
+    def get_many(self, module: str, variables: Iterable[str], default=None):
+        with self._timed("get_many", module):
+            return self._backend.get_many(module, variables, default)
+
+    def get_many_expiring(
+        self, module: str, variables: Iterable[str]
+    ) -> dict[str, tuple[object, float | None]]:
+        with self._timed("get_many", module):
+            return self._backend.get_many_expiring(module, variables)
+
+    def set_many(self, module: str, values: dict, ttl: float | None = None):
+        with self._timed("set_many", module):
+            return self._backend.set_many(module, values, ttl)
+
+    def remove_many(self, module: str, variables: Iterable[str]):
+        with self._timed("remove_many", module):
+            return self._backend.remove_many(module, variables)
+
+    @contextmanager
+    def transaction(self):
+        with self._backend.transaction():
+            yield self
+
+    def get_collection(self, module: str) -> dict:
+        with self._timed("get_collection", module):
+            return self._backend.get_collection(module)
+
+    def get_entries(self, module: str, namespace) -> dict:
+        with self._timed("get_entries", module, namespace):
+            return self._backend.get_entries(module, namespace)
+
+    def scan(
+        self,
+        module: str,
+        prefix: str = "",
+        start: str | None = None,
+        limit: int | None = None,
+    ) -> Iterator[tuple[str, object]]:
+        iterator = self._backend.scan(module, prefix, start, limit)
+        return self._timed_scan(iter(iterator), module, prefix)
+
+    def modules(self) -> list:
+        return self._backend.modules()
+
+    def purge_expired(self) -> int:
+        with self._timed("purge_expired", "*"):
+            return self._backend.purge_expired()
+
+    async def aget(self, module: str, variable: str, default=None):
+        with self._timed("aget", module, variable):
+            return await self._backend.aget(module, variable, default)
+
+    async def aset(
+        self, module: str, variable: str, value, ttl: float | None = None
+    ):
+        with self._timed("aset", module, variable):
+            return await self._backend.aset(module, variable, value, ttl)
+
+    async def aremove(self, module: str, variable: str):
+        with self._timed("aremove", module, variable):
+            return await self._backend.aremove(module, variable)
+
+    async def aget_collection(self, module: str) -> dict:
+        with self._timed("aget_collection", module):
+            return await self._backend.aget_collection(module)
+
+    async def aget_entries(self, module: str, namespace) -> dict:
+        with self._timed("aget_entries", module, namespace):
+            return await self._backend.aget_entries(module, namespace)
+
+    def stats(self) -> dict:
+        """Get counters per (module, operation), slowest in total first"""
+        with self._lock:
+            ops = [
+                {
+                    "module": module,
+                    "op": op,
+                    "count": stats.count,
+                    "total_ms": round(stats.total * 1000, 3),
+                    "avg_us": round(stats.total / stats.count * 1e6, 1),
+                    "max_us": round(stats.max * 1e6, 1),
+                    "histogram": dict(
+                        zip(PROFILE_BUCKET_NAMES, stats.histogram)
+                    ),
+                }
+                for (module, op), stats in self._ops.items()
+            ]
+            slow = list(self._slow_ops)
+        ops.sort(key=lambda item: item["total_ms"], reverse=True)
+        result = {"since": self._since, "ops": ops, "slow": slow}
+        if isinstance(self._backend, CachedDatabase):
+            result["cache"] = self._backend.stats()
+        return result
+
+    def reset(self):
+        """Forget all collected counters"""
+        with self._lock:
+            self._ops.clear()
+            self._slow_ops.clear()
+            self._since = time.time()
+
+    def write_stats(self, path: str):
+        """Write stats() as JSON, atomically replacing path"""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.stats(), f)
+        os.replace(tmp, path)
+
+    async def publish_stats(self, path: str, interval: float = 10.0):
+        """Write stats to path every interval seconds, run it as a task"""
+        while True:
+            try:
+                await self._run_in_executor(self.write_stats, path)
+            except Exception:
+                logging.exception("Failed to write database profile")
+            await asyncio.sleep(interval)
+
+    def subscribe(self, module: str, callback: Callable):
+        return self._backend.subscribe(module, callback)
+
+    def unsubscribe(self, module: str, callback: Callable):
+        self._backend.unsubscribe(module, callback)
+
+    def unsubscribe_all(self, owner: str):
+        self._backend.unsubscribe_all(owner)
+
+    def flush(self):
+        self._backend.flush()
+
+    def close(self):
+        self._backend.close()
+
+
+def open_configured() -> Database:
+    """Open the database selected by DATABASE_TYPE and DATABASE_NAME"""
+    if config.db_type in ["mongo", "mongodb"]:
+        db = MongoDatabase(
+            config.db_url,
+            config.db_name,
+            max_pool_size=config.db_max_pool_size,
+            min_pool_size=config.db_min_pool_size,
+            timeout_ms=config.db_timeout_ms,
+        )
+    elif config.db_type == "lmdb":
+        db = LmdbDatabase(
+            config.db_name,
+            map_size=config.db_map_size,
+            encoding=config.db_encoding,
+        )
+    else:
+        db = SqliteDatabase(
+            config.db_name,
+            write_behind=config.db_write_behind,
+            flush_interval=config.db_flush_interval,
+            flush_size=config.db_flush_size,
+            encoding=config.db_encoding,
+        )
+
+    if config.db_cache_size > 0:
+        db = CachedDatabase(db, config.db_cache_size)
+
+    if config.db_profile:
+        db = ProfiledDatabase(db, config.db_slow_ms)
+    return db
+
+
+_db_lock = threading.Lock()
 
 
-if config.db_type in ["mongo", "mongodb"]:
-    db = MongoDatabase(config.db_url, config.db_name)
-else:
-    db = SqliteDatabase(config.db_name)
+def __getattr__(name: str):
+    # the configured database is opened on first use of utils.db.db, so
+    # tools like dbtool can import this module and open it themselves
+    if name != "db":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    global db
+    with _db_lock:
+        if "db" not in globals():
+            db = open_configured()
+    return db
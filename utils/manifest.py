@@ -0,0 +1,291 @@
+#  Dragon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Dragon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+from collections.abc import Iterable
+from pathlib import Path
+
+from pyrogram import Client, filters
+from pyrogram.handlers import MessageHandler
+from pyrogram.types import Message
+
+from . import config
+from .misc import modules_help, requirements_list
+from .router import call_handler, router
+from .scripts import (
+    lazy_stubs,
+    load_module,
+    load_stats,
+    module_handlers,
+    parse_meta_comments,
+)
+
+# module metadata is cached by file path, e.g. "modules/ping.py":
+# {"mtime", "size", "sha256", "meta", "requires"} and, once the module
+# was imported, {"lazy", "commands": {group: [command]},
+# "filters": {group: {command: [filter]}}, "help"}. It's kept in a local
+# file rather than the database: reading it takes no round trip to a
+# remote backend and it doesn't end up in database snapshots
+_entries: dict[str, dict] | None = None
+
+_load_locks: dict[str, asyncio.Lock] = {}
+
+# filter objects of pyrogram.filters by their name, e.g. filters.me -> "me"
+_BUILTIN_FILTERS = {
+    flt: name
+    for name, flt in vars(filters).items()
+    if isinstance(flt, filters.Filter)
+}
+
+
+def command_names(flt) -> set[str] | None:
+    """Get commands a filter requires, None if it can pass without one"""
+    if isinstance(flt, filters.AndFilter):
+        base, other = command_names(flt.base), command_names(flt.other)
+        if base is None or other is None:
+            return base if other is None else other
+        return base & other
+    if isinstance(flt, filters.OrFilter):
+        base, other = command_names(flt.base), command_names(flt.other)
+        if base is None or other is None:
+            return None
+        return base | other
+    commands = getattr(flt, "commands", None)
+    return set(commands) if isinstance(commands, set) else None
+
+
+def required_filters(flt) -> list[str]:
+    """
+    Get names of builtin filters a filter always requires besides its
+    commands, "~name" for inverted ones, e.g. ["me"]
+    """
+    if isinstance(flt, filters.AndFilter):
+        return required_filters(flt.base) + required_filters(flt.other)
+    if isinstance(flt, filters.InvertFilter):
+        name = _BUILTIN_FILTERS.get(flt.base)
+        return [] if name is None else [f"~{name}"]
+    name = _BUILTIN_FILTERS.get(flt)
+    return [] if name is None else [name]
+
+
+def _builtin_filter(name: str):
+    if name.startswith("~"):
+        return ~getattr(filters, name[1:])
+    return getattr(filters, name)
+
+
+def _import_path(path: Path) -> str:
+    return ".".join(path.with_suffix("").parts)
+
+
+def _is_core(path: Path) -> bool:
+    return "custom_modules" not in path.parts
+
+
+def _fingerprint(path: Path, code: bytes = None) -> dict:
+    stat = path.stat()
+    fingerprint = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+    if code is not None:
+        fingerprint["sha256"] = hashlib.sha256(code).hexdigest()
+    return fingerprint
+
+
+def _manifest() -> dict[str, dict]:
+    global _entries
+    if _entries is None:
+        try:
+            with open(config.module_manifest_file) as f:
+                _entries = json.load(f)
+        except (OSError, ValueError):
+            _entries = {}
+    return _entries
+
+
+def save_manifest(path: str = None):
+    """Write the manifest as JSON, it's read again on the next start"""
+    path = path or config.module_manifest_file
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(_manifest(), f)
+        os.replace(tmp, path)
+    except OSError:
+        logging.warning(f"Can't write module manifest to {path}")
+
+
+def _valid_entry(path: Path, entry: dict | None) -> dict | None:
+    """Get entry if it still describes the file at path"""
+    if entry is None:
+        return None
+    fingerprint = _fingerprint(path)
+    if all(entry.get(key) == value for key, value in fingerprint.items()):
+        return entry
+    if entry.get("size") != fingerprint["size"]:
+        return None
+
+    # touched without changes, e.g. by a git checkout
+    fingerprint = _fingerprint(path, path.read_bytes())
+    if entry.get("sha256") != fingerprint["sha256"]:
+        return None
+    entry = _manifest()[str(path)] = {**entry, **fingerprint}
+    return entry
+
+
+def module_meta(path: Path) -> dict[str, str]:
+    """Get meta comments of a module file, parsing it only if it changed"""
+    entry = _valid_entry(path, _manifest().get(str(path)))
+    if entry is not None:
+        return entry["meta"]
+
+    code = path.read_bytes()
+    meta = parse_meta_comments(code.decode("utf-8"))
+    _manifest()[str(path)] = {
+        **_fingerprint(path, code),
+        "meta": meta,
+        "requires": meta.get("requires", "").split(),
+    }
+    return meta
+
+
+def build_entry(path: Path, module) -> dict:
+    """
+    Describe a loaded module. It can be loaded lazily if every handler
+    is a message handler that only runs on its commands
+    """
+    handlers = module_handlers(module)
+    lazy = bool(handlers)
+    commands: dict[str, list] = {}
+    required: dict[str, dict[str, list]] = {}
+    for handler, group in handlers:
+        names = None
+        if isinstance(handler, MessageHandler):
+            names = command_names(handler.filters)
+        if names is None:
+            lazy = False
+            continue
+        commands.setdefault(str(group), []).extend(sorted(names))
+
+        needs = sorted(set(required_filters(handler.filters)))
+        group_required = required.setdefault(str(group), {})
+        for name in names:
+            # the stub of a command has to pass if any of its handlers would
+            known = group_required.get(name, needs)
+            group_required[name] = [flt for flt in known if flt in needs]
+
+    used = {name for names in commands.values() for name in names}
+    meta = getattr(module, "__meta__", {})
+    return {
+        **_fingerprint(path, path.read_bytes()),
+        "meta": meta,
+        "requires": meta.get("requires", "").split(),
+        "lazy": lazy,
+        "commands": commands,
+        "filters": required,
+        # help sections are matched to modules by their commands
+        "help": {
+            section: section_commands
+            for section, section_commands in modules_help.items()
+            if any(command.split()[0] in used for command in section_commands)
+        },
+    }
+
+
+def get_manifest(paths: Iterable[Path] = None) -> dict[str, dict]:
+    """
+    Get cached metadata of module files without importing them, entries
+    of files changed since they were recorded are left out
+    """
+    if paths is None:
+        paths = Path("modules").rglob("*.py")
+    entries = _manifest()
+    valid = {}
+    for path in paths:
+        entry = _valid_entry(path, entries.get(str(path)))
+        if entry is not None:
+            valid[str(path)] = entry
+    return valid
+
+
+def update_manifest(paths: Iterable[Path]):
+    """Record what modules imported by this start handle and save it"""
+    paths = list(paths)
+    known = get_manifest(paths)
+    entries = _manifest()
+    for path in paths:
+        module = sys.modules.get(_import_path(path))
+        stats = load_stats.get(path.stem)
+        if module is None or stats is None or stats["error"]:
+            continue
+        if "filters" not in known.get(str(path), {}):
+            entries[str(path)] = build_entry(path, module)
+
+    current = {str(path) for path in paths}
+    for path in list(entries):
+        if path not in current:
+            del entries[path]
+    save_manifest()
+
+
+def _load_on_use(path: Path, group: int):
+    name, core = path.stem, _is_core(path)
+
+    async def stub(client: Client, message: Message):
+        async with _load_locks.setdefault(name, asyncio.Lock()):
+            module = sys.modules.get(_import_path(path))
+            if module is None:
+                logging.info(f"Loading module {name} on first use")
+                module = await load_module(name, client, core=core)
+
+        # the real handlers are registered from now on, this message
+        # reached the stub and is passed on by hand
+        for handler, handler_group in module_handlers(module):
+            if handler_group == group and await handler.check(client, message):
+                return await call_handler(handler, client, message)
+
+    return stub
+
+
+def register_stubs(client: Client, entries: dict[str, dict]):
+    """Add help and command stubs of modules that are imported on first use"""
+    for path, entry in entries.items():
+        path = Path(path)
+        modules_help.update(entry["help"])
+        requirements_list.extend(entry["meta"].get("requires", "").split())
+
+        stubs = lazy_stubs[path.stem] = []
+        for group, commands in entry["commands"].items():
+            # commands are grouped by the filters their handlers require,
+            # so e.g. commands of filters.me never import the module for
+            # other users
+            by_required: dict[tuple, list] = {}
+            for command in commands:
+                needs = entry["filters"].get(group, {}).get(command, [])
+                by_required.setdefault(tuple(needs), []).append(command)
+
+            for needs, names in by_required.items():
+                flt = filters.command(names, router.prefix)
+                for name in needs:
+                    flt &= _builtin_filter(name)
+                handler = MessageHandler(_load_on_use(path, int(group)), flt)
+                router.add_handler(client, handler, int(group))
+                stubs.append((handler, int(group)))
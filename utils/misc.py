@@ -14,10 +14,9 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import threading
 from sys import version_info
 
-import git
-
 from .db import db
 
 __all__ = [
@@ -25,8 +24,10 @@ __all__ = [
     "requirements_list",
     "python_version",
     "prefix",
-    "gitrepo",
-    "userbot_version",
+    # provided by the module __getattr__ below
+    "gitrepo",  # noqa: F822
+    "userbot_version",  # noqa: F822
+    "head_sha",
 ]
 
 
@@ -37,18 +38,83 @@ python_version = f"{version_info[0]}.{version_info[1]}.{version_info[2]}"
 
 prefix = db.get("core.main", "prefix", ".")
 
-try:
-    gitrepo = git.Repo(".")
-except git.exc.InvalidGitRepositoryError:
-    repo = git.Repo.init()
-    origin = repo.create_remote(
-        "origin", "https://github.com/Dragon-Userbot/Dragon-Userbot"
+# gitrepo and userbot_version are computed on first access, GitPython and
+# walking the history since the last tag are slow on low-end hosts
+_lazy_lock = threading.RLock()
+
+
+def _open_repo():
+    import git
+
+    try:
+        return git.Repo(".")
+    except git.exc.InvalidGitRepositoryError:
+        repo = git.Repo.init()
+        origin = repo.create_remote(
+            "origin", "https://github.com/Dragon-Userbot/Dragon-Userbot"
+        )
+        origin.fetch()
+        repo.create_head("master", origin.refs.master)
+        repo.heads.master.set_tracking_branch(origin.refs.master)
+        repo.heads.master.checkout(True)
+        return git.Repo(".")
+
+
+def _read_head_sha():
+    with open(".git/HEAD") as f:
+        head = f.read().strip()
+    if not head.startswith("ref: "):
+        # detached HEAD
+        return head
+    ref = head[len("ref: ") :]
+    try:
+        with open(f".git/{ref}") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        with open(".git/packed-refs") as f:
+            for line in f:
+                sha, _, name = line.strip().partition(" ")
+                if name == ref:
+                    return sha
+    return None
+
+
+def head_sha() -> str:
+    """Get sha of the checked out commit, without loading GitPython if possible"""
+    try:
+        sha = _read_head_sha()
+    except OSError:
+        sha = None
+    return sha or _lazy("gitrepo").head.commit.hexsha
+
+
+def _userbot_version() -> str:
+    sha = head_sha()
+    cached = db.get("core.misc", "version")
+    if cached and cached["sha"] == sha:
+        return cached["version"]
+
+    gitrepo = _lazy("gitrepo")
+    commits_since_tag = sum(
+        1 for _ in gitrepo.iter_commits(f"{gitrepo.tags[-1].name}..HEAD")
     )
-    origin.fetch()
-    repo.create_head("master", origin.refs.master)
-    repo.heads.master.set_tracking_branch(origin.refs.master)
-    repo.heads.master.checkout(True)
-    gitrepo = git.Repo(".")
-
-commits_since_tag = list(gitrepo.iter_commits(f"{gitrepo.tags[-1].name}..HEAD"))
-userbot_version = f"4.0.{len(commits_since_tag)}"
+    version = f"4.0.{commits_since_tag}"
+    db.set("core.misc", "version", {"sha": sha, "version": version})
+    return version
+
+
+_LAZY = {"gitrepo": _open_repo, "userbot_version": _userbot_version}
+
+
+def _lazy(name: str):
+    # module __getattr__ isn't used for lookups made inside the module
+    with _lazy_lock:
+        if name not in globals():
+            globals()[name] = _LAZY[name]()
+    return globals()[name]
+
+
+def __getattr__(name: str):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return _lazy(name)
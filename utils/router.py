@@ -0,0 +1,165 @@
+#  Dragon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Dragon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import inspect
+
+from pyrogram import Client, ContinuePropagation, filters
+from pyrogram.handlers import MessageHandler
+from pyrogram.handlers.handler import Handler
+from pyrogram.types import Message
+
+from . import misc
+from .db import db
+
+
+def command_filters(flt) -> list | None:
+    """Get command filters a filter requires, None if it can pass without"""
+    if isinstance(flt, filters.AndFilter):
+        base, other = command_filters(flt.base), command_filters(flt.other)
+        if base is None or other is None:
+            return base if other is None else other
+        return base + other
+    if isinstance(flt, filters.OrFilter):
+        base, other = command_filters(flt.base), command_filters(flt.other)
+        if base is None or other is None:
+            return None
+        return base + other
+    if isinstance(getattr(flt, "commands", None), set) and hasattr(
+        flt, "prefixes"
+    ):
+        return [flt]
+    return None
+
+
+async def call_handler(handler: Handler, client: Client, message: Message):
+    """Run the callback of a handler the way pyrogram's dispatcher does"""
+    if inspect.iscoroutinefunction(handler.callback):
+        return await handler.callback(client, message)
+    # sync callbacks, e.g. .ex and .eval, mustn't block the event loop
+    return await client.loop.run_in_executor(
+        client.executor, handler.callback, client, message
+    )
+
+
+def _route_names(command_filter) -> list[str]:
+    # commands are matched by their first word, like message text is
+    return [
+        command.split()[0].lower()
+        for command in command_filter.commands
+        if command.strip()
+    ]
+
+
+class CommandRouter:
+    """
+    Dispatch command handlers through a single handler per group. The
+    prefix and command word are parsed once per message and looked up in
+    a dict, only handlers of that command check their own filters
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        # group -> command -> handlers in registration order
+        self._routes: dict[int, dict[str, list[MessageHandler]]] = {}
+        self._dispatchers: dict[int, MessageHandler] = {}
+        self._commands: dict[Handler, list] = {}
+
+    def _routable(self, handler: Handler) -> list | None:
+        if not isinstance(handler, MessageHandler):
+            return None
+        command_filters_ = command_filters(handler.filters)
+        if not command_filters_ or any(
+            flt.prefixes != {self.prefix} for flt in command_filters_
+        ):
+            return None
+        return command_filters_
+
+    def add_handler(self, client: Client, handler: Handler, group: int = 0):
+        """Add a handler, commands using the userbot prefix are routed"""
+        command_filters_ = self._routable(handler)
+        if command_filters_ is None:
+            client.add_handler(handler, group)
+            return
+
+        routes = self._routes.setdefault(group, {})
+        for flt in command_filters_:
+            for name in _route_names(flt):
+                handlers = routes.setdefault(name, [])
+                if handler not in handlers:
+                    handlers.append(handler)
+        self._commands[handler] = command_filters_
+
+        if group not in self._dispatchers:
+            self._dispatchers[group] = self._dispatcher(group)
+            client.add_handler(self._dispatchers[group], group)
+
+    def remove_handler(self, client: Client, handler: Handler, group: int = 0):
+        if self._commands.pop(handler, None) is None:
+            client.remove_handler(handler, group)
+            return
+
+        routes = self._routes.get(group, {})
+        for name, handlers in list(routes.items()):
+            if handler in handlers:
+                handlers.remove(handler)
+            if not handlers:
+                del routes[name]
+
+    def route(self, message: Message) -> str | None:
+        """Get the command word of a message, if it has the prefix"""
+        text = message.text or message.caption
+        if not text or not text.startswith(self.prefix):
+            return None
+        words = text[len(self.prefix) :].split(maxsplit=1)
+        if not words:
+            return None
+        # commands may be addressed as /command@username
+        return words[0].partition("@")[0].lower()
+
+    def _dispatcher(self, group: int) -> MessageHandler:
+        routes = self._routes[group]
+
+        async def has_route(_, __, message: Message) -> bool:
+            return self.route(message) in routes
+
+        async def dispatch(client: Client, message: Message):
+            for handler in list(routes.get(self.route(message), ())):
+                if await handler.check(client, message):
+                    return await call_handler(handler, client, message)
+            # nothing in this group handles the command, let the others try
+            raise ContinuePropagation
+
+        return MessageHandler(dispatch, filters.create(has_route))
+
+    def set_prefix(self, prefix: str):
+        """Change the prefix of every routed command, no restart needed"""
+        for command_filters_ in self._commands.values():
+            for flt in command_filters_:
+                flt.prefixes = {prefix}
+        self.prefix = misc.prefix = prefix
+
+
+router = CommandRouter(misc.prefix)
+
+
+def _prefix_changed(_, var, value):
+    if var == "prefix" and isinstance(value, str) and value:
+        router.set_prefix(value)
+
+
+db.subscribe("core.main", _prefix_changed)
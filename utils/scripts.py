@@ -14,21 +14,35 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from __future__ import annotations
+
 import asyncio
 import importlib
+import importlib.util
+import json
+import logging
 import os
 import re
 import subprocess
 import sys
+import threading
+import time
 import traceback
+from collections.abc import Awaitable, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+from html import escape
 from io import BytesIO
+from pathlib import Path
 from types import ModuleType
-from typing import Dict
 
-from PIL import Image
 from pyrogram import Client, errors, types
+from pyrogram.handlers.handler import Handler
 
-from .misc import modules_help, prefix, requirements_list
+from . import config
+from .db import db
+from .misc import modules_help, requirements_list
+from .router import router
 
 META_COMMENTS = re.compile(r"^ *# *meta +(\S+) *: *(.*?)\s*$", re.MULTILINE)
 interact_with_to_delete = []
@@ -40,6 +54,8 @@ def text(message: types.Message) -> str:
 
 
 def restart() -> None:
+    # execvp replaces the process without running atexit hooks
+    db.flush()
     if "LAVHOST" in os.environ:
         os.system("lavhost restart")
     else:
@@ -122,7 +138,9 @@ def format_module_help(module_name: str, full=True):
     for command, desc in commands.items():
         cmd = command.split(maxsplit=1)
         args = " <code>" + cmd[1] + "</code>" if len(cmd) > 1 else ""
-        help_text += f"<code>{prefix}{cmd[0]}</code>{args} — <i>{desc}</i>\n"
+        help_text += (
+            f"<code>{router.prefix}{cmd[0]}</code>{args} — <i>{desc}</i>\n"
+        )
 
     return help_text
 
@@ -138,20 +156,69 @@ def format_small_module_help(module_name: str, full=True):
     for command, desc in commands.items():
         cmd = command.split(maxsplit=1)
         args = " <code>" + cmd[1] + "</code>" if len(cmd) > 1 else ""
-        help_text += f"<code>{prefix}{cmd[0]}</code>{args}\n"
+        help_text += f"<code>{router.prefix}{cmd[0]}</code>{args}\n"
     help_text += (
-        f"\nGet full usage: <code>{prefix}help {module_name}</code></b>"
+        f"\nGet full usage: <code>{router.prefix}help {module_name}</code></b>"
     )
 
     return help_text
 
 
+def format_load_stats(module_name: str) -> str:
+    stats = load_stats.get(module_name)
+    if stats is None:
+        return ""
+    if stats["error"]:
+        return f"<b>Failed to load:</b> <code>{escape(stats['error'])}</code>\n"
+
+    total = stats["import_ms"] + stats["pip_ms"] + stats["register_ms"]
+    text = (
+        f"<b>Loaded in {total:.1f} ms</b> (import {stats['import_ms']:.1f}, "
+        f"register {stats['register_ms']:.1f}"
+    )
+    if stats["pip_ms"]:
+        text += f", requirements {stats['pip_ms']:.1f}"
+    groups = ", ".join(map(str, stats["groups"])) or "-"
+    return text + f"), {stats['handlers']} handlers in groups {groups}\n"
+
+
+class MissingRequirements(ImportError):
+    """Packages a module needs are not installed yet"""
+
+    def __init__(self, packages: list[str]):
+        super().__init__(f"missing requirements: {' '.join(packages)}")
+        self.packages = packages
+
+
+# set on threads importing modules for the loader, which installs missing
+# requirements itself
+_loader = threading.local()
+
+# a module may import_library() a missing package after another one was
+# installed, the loader retries at most this many times
+INSTALL_ROUNDS = 5
+
+
+@contextmanager
+def _loading():
+    _loader.active = True
+    try:
+        yield
+    finally:
+        _loader.active = False
+
+
 def import_library(library_name: str, package_name: str = None):
     """
-    Loads a library, or installs it in ImportError case
+    Loads a library, or installs it in ImportError case. Modules being
+    imported by the loader leave installing to it. Anywhere else pip runs
+    synchronously and blocks the caller, handlers should await
+    aimport_library() instead
     :param library_name: library name (import example...)
     :param package_name: package name in PyPi (pip install example)
     :return: loaded module
+    :raises MissingRequirements: the module is imported again after its
+        requirements are installed
     """
     if package_name is None:
         package_name = library_name
@@ -159,20 +226,48 @@ def import_library(library_name: str, package_name: str = None):
 
     try:
         return importlib.import_module(library_name)
-    except ImportError:
-        completed = subprocess.run(
-            [sys.executable, "-m", "pip", "install", package_name]
+    except ImportError as e:
+        if getattr(_loader, "active", False):
+            raise MissingRequirements([package_name]) from e
+
+    completed = subprocess.run(
+        [sys.executable, "-m", "pip", "install", package_name]
+    )
+    if completed.returncode != 0:
+        raise AssertionError(
+            f"Failed to install library {package_name} "
+            f"(pip exited with code {completed.returncode})"
         )
-        if completed.returncode != 0:
-            raise AssertionError(
-                f"Failed to install library {package_name} (pip exited with code {completed.returncode})"
-            )
+    importlib.invalidate_caches()
+    return importlib.import_module(library_name)
+
+
+async def aimport_library(library_name: str, package_name: str = None):
+    """import_library() without blocking the event loop"""
+    if package_name is None:
+        package_name = library_name
+    requirements_list.append(package_name)
+
+    try:
         return importlib.import_module(library_name)
+    except ImportError:
+        pass
+
+    try:
+        await install_requirements([package_name])
+    except RuntimeError as e:
+        raise AssertionError(
+            f"Failed to install library {package_name} ({e})"
+        ) from e
+    return importlib.import_module(library_name)
 
 
 def resize_image(
     input_img, output=None, img_type="PNG", size: int = 512, size2: int = None
 ):
+    # Pillow is only needed by a few commands, don't load it on startup
+    from PIL import Image
+
     if output is None:
         output = BytesIO()
         output.name = f"sticker.{img_type.lower()}"
@@ -194,6 +289,236 @@ def resize_image(
     return output
 
 
+def _module_path(module_name: str, core: bool) -> str:
+    return f"modules.{'custom_modules.' if not core else ''}{module_name}"
+
+
+def _read_meta(path: str) -> dict[str, str]:
+    # imported here, utils.manifest depends on this module
+    from .manifest import module_meta
+
+    meta = module_meta(Path(f"{path.replace('.', '/')}.py"))
+    requirements_list.extend(meta.get("requires", "").split())
+    return meta
+
+
+# load metrics by module name, times are in milliseconds
+load_stats: dict[str, dict] = {}
+
+
+def _new_load_stats(module_name: str, core: bool) -> dict:
+    stats = load_stats[module_name] = {
+        "core": core,
+        "import_ms": 0.0,
+        "pip_ms": 0.0,
+        "register_ms": 0.0,
+        "handlers": 0,
+        "groups": [],
+        "error": None,
+        "loaded_at": time.time(),
+    }
+    return stats
+
+
+@contextmanager
+def _timed(stats: dict, key: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats[key] += (time.perf_counter() - start) * 1000
+
+
+def _load_failed(stats: dict, e: Exception):
+    stats["error"] = f"{e.__class__.__name__}: {e}"
+
+
+def write_load_stats(path: str = None):
+    """Write load_stats as JSON, it's read by the control server"""
+    path = path or config.module_stats_file
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(load_stats, f)
+        os.replace(tmp, path)
+    except OSError:
+        logging.warning(f"Can't write module load stats to {path}")
+
+
+# stub handlers of modules that are imported on first use, by module name
+lazy_stubs: dict[str, list[tuple[Handler, int]]] = {}
+
+
+def module_handlers(module: ModuleType) -> list[tuple[Handler, int]]:
+    """Get handlers added by the decorators of a module, with their groups"""
+    return [
+        (handler, group)
+        for obj in vars(module).values()
+        if type(getattr(obj, "handlers", [])) == list
+        for handler, group in getattr(obj, "handlers", [])
+    ]
+
+
+def _register_handlers(
+    module: ModuleType, meta: dict[str, str], client: Client, stats: dict
+):
+    groups = []
+    with _timed(stats, "register_ms"):
+        module_name = module.__name__.rpartition(".")[2]
+        for handler, group in lazy_stubs.pop(module_name, []):
+            router.remove_handler(client, handler, group)
+        for handler, group in module_handlers(module):
+            router.add_handler(client, handler, group)
+            groups.append(group)
+
+    module.__meta__ = meta
+    stats["handlers"] = len(groups)
+    stats["groups"] = sorted(set(groups))
+
+
+# pip output lines worth showing while requirements are installed
+PIP_PROGRESS = (
+    "Collecting",
+    "Downloading",
+    "Building wheel",
+    "Saved",
+    "Installing collected packages",
+    "Successfully installed",
+)
+
+
+async def _pip(
+    args: list[str], progress: Callable[[str], Awaitable] | None = None
+):
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "pip",
+        *args,
+        "--disable-pip-version-check",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    output = []
+
+    async def read():
+        async for line in proc.stdout:
+            line = line.decode(errors="replace").strip()
+            output.append(line)
+            if line.startswith(PIP_PROGRESS):
+                logging.info(f"pip: {line}")
+                if progress:
+                    await progress(line)
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(read(), proc.wait()), config.pip_timeout
+        )
+    # not the builtin TimeoutError before Python 3.11
+    except asyncio.TimeoutError:  # noqa: UP041
+        proc.kill()
+        await proc.wait()
+        raise TimeoutError(f"timeout while running pip {args[0]}") from None
+
+    if proc.returncode != 0:
+        logging.debug("\n".join(output))
+        raise RuntimeError(
+            f"pip {args[0]} exited with code {proc.returncode}: "
+            + (output[-1] if output else "")
+        )
+
+
+async def install_requirements(
+    packages: Iterable[str],
+    progress: Callable[[str], Awaitable] | None = None,
+):
+    """
+    Install packages in a single pip run. Wheels are kept in
+    config.pip_wheel_dir, so installing them again after a fresh checkout
+    doesn't download or build anything
+    :param progress: called with pip output lines as they arrive
+    """
+    packages = list(dict.fromkeys(packages))
+    if not packages:
+        return
+
+    os.makedirs(config.pip_wheel_dir, exist_ok=True)
+    install = ["install", "--no-index", "--find-links", config.pip_wheel_dir]
+    try:
+        await _pip(install + packages, progress)
+    except RuntimeError:
+        # something isn't cached yet, only missing wheels are fetched
+        await _pip(
+            ["wheel", "--wheel-dir", config.pip_wheel_dir, "--find-links"]
+            + [config.pip_wheel_dir]
+            + packages,
+            progress,
+        )
+        await _pip(install + packages, progress)
+    importlib.invalidate_caches()
+
+
+def message_progress(message: types.Message, interval: float = 3.0):
+    """Progress callback editing message, at most once per interval"""
+    last = 0.0
+
+    async def progress(line: str):
+        nonlocal last
+        if time.monotonic() - last < interval:
+            return
+        last = time.monotonic()
+        with suppress(errors.RPCError):
+            await message.edit(
+                f"<b>Installing requirements...</b>\n<code>{escape(line)}</code>"
+            )
+
+    return progress
+
+
+def _installable(error: BaseException, core: bool) -> bool:
+    """Whether installing requirements may fix a failed import"""
+    # core modules shouldn't raise ImportError, unless they import_library()
+    if core:
+        return isinstance(error, MissingRequirements)
+    return isinstance(error, ImportError)
+
+
+def _missing_packages(
+    meta: dict[str, str], error: ImportError, installed: set[str]
+) -> list[str]:
+    """Requirements a failed import may still miss, without installed ones"""
+    packages = meta.get("requires", "").split()
+    packages += getattr(error, "packages", [])
+    return [package for package in packages if package not in installed]
+
+
+async def _install_requirements(
+    packages: list[str], message: types.Message | None, error: Exception
+):
+    if message:
+        await message.edit(
+            f"<b>Installing requirements: {' '.join(packages)}</b>"
+        )
+
+    try:
+        await install_requirements(
+            packages, message_progress(message) if message else None
+        )
+    except TimeoutError as e:
+        if message:
+            await message.edit(
+                "<b>Timeout while installed requirements. Try to install them manually</b>"
+            )
+        raise e from error
+    except RuntimeError as e:
+        if message:
+            await message.edit(
+                f"<b>Failed to install requirements ({escape(str(e))}). "
+                f"Check logs for futher info</b>"
+            )
+        raise e from error
+
+
 async def load_module(
     module_name: str,
     client: Client,
@@ -203,85 +528,226 @@ async def load_module(
     if module_name in modules_help and not core:
         await unload_module(module_name, client)
 
-    path = f"modules.{'custom_modules.' if not core else ''}{module_name}"
-
-    with open(f"{path.replace('.', '/')}.py", encoding="utf-8") as f:
-        code = f.read()
-    meta = parse_meta_comments(code)
-
-    packages = meta.get("requires", "").split()
-    requirements_list.extend(packages)
+    stats = _new_load_stats(module_name, core)
+    path = _module_path(module_name, core)
 
     try:
-        module = importlib.import_module(path)
-    except ImportError as e:
-        if core:
-            # Core modules shouldn't raise ImportError
-            raise
+        with _timed(stats, "import_ms"):
+            meta = _read_meta(path)
+
+        installed = set()
+        for round_ in range(INSTALL_ROUNDS + 1):
+            try:
+                with _timed(stats, "import_ms"), _loading():
+                    module = importlib.import_module(path)
+                break
+            except ImportError as e:
+                if not _installable(e, core):
+                    raise
+
+                packages = _missing_packages(meta, e, installed)
+                if not packages or round_ == INSTALL_ROUNDS:
+                    raise
+
+                with _timed(stats, "pip_ms"):
+                    await _install_requirements(packages, message, e)
+                installed.update(packages)
+
+        _register_handlers(module, meta, client, stats)
+    except Exception as e:
+        _load_failed(stats, e)
+        raise
+    finally:
+        write_load_stats()
 
-        if not packages:
-            raise
+    return module
 
-        if message:
-            await message.edit(
-                f"<b>Installing requirements: {' '.join(packages)}</b>"
-            )
 
-        proc = await asyncio.create_subprocess_exec(
-            sys.executable,
-            "-m",
-            "pip",
-            "install",
-            "-U",
-            *packages,
+def _import_module(module_name: str, core: bool):
+    stats = _new_load_stats(module_name, core)
+    path = _module_path(module_name, core)
+    try:
+        with _timed(stats, "import_ms"):
+            meta = _read_meta(path)
+            with _loading():
+                module = importlib.import_module(path)
+    except Exception as e:
+        _load_failed(stats, e)
+        raise
+    return module, meta, stats
+
+
+async def import_modules(
+    modules: list[tuple[str, bool]], max_workers: int | None = None
+) -> list:
+    """
+    Import (module_name, core) pairs in parallel on a thread pool,
+    without registering their handlers
+    :return: (module, meta, stats) or the raised exception for every pair,
+        in order
+    """
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers, "module-import") as executor:
+        return await asyncio.gather(
+            *(
+                loop.run_in_executor(executor, _import_module, name, core)
+                for name, core in modules
+            ),
+            return_exceptions=True,
         )
-        try:
-            await asyncio.wait_for(proc.wait(), timeout=120)
-        except asyncio.TimeoutError:
-            if message:
-                await message.edit(
-                    "<b>Timeout while installed requirements. Try to install them manually</b>"
-                )
-            raise TimeoutError("timeout while installing requirements") from e
-
-        if proc.returncode != 0:
-            if message:
-                await message.edit(
-                    f"<b>Failed to install requirements (pip exited with code {proc.returncode}). "
-                    f"Check logs for futher info</b>"
-                )
-            raise RuntimeError("failed to install requirements") from e
-
-        module = importlib.import_module(path)
-
-    for name, obj in vars(module).items():
-        if type(getattr(obj, "handlers", [])) == list:
-            for handler, group in getattr(obj, "handlers", []):
-                client.add_handler(handler, group)
 
-    module.__meta__ = meta
 
-    return module
+async def load_modules(
+    client: Client, modules: list[tuple[str, bool]], imported: list
+) -> tuple[int, int]:
+    """
+    Register handlers of modules imported by import_modules() in order,
+    so handler groups are filled the same way on every start. Custom
+    modules that failed with ImportError are imported again after their
+    requirements are installed
+    :return: numbers of loaded and failed modules
+    """
+    imported = list(imported)
+    installed = set()
+    pip_ms = 0.0
+    for _ in range(INSTALL_ROUNDS):
+        # requirements of every module are installed by a single pip run,
+        # imports that then miss other packages get another one
+        missing, packages = [], []
+        for index, ((name, core), result) in enumerate(zip(modules, imported)):
+            if not _installable(result, core):
+                continue
+            meta = _read_meta(_module_path(name, core))
+            new_packages = _missing_packages(meta, result, installed)
+            if new_packages:
+                missing.append(index)
+                packages.extend(new_packages)
+        if not missing:
+            break
+
+        started = time.perf_counter()
+        try:
+            await install_requirements(packages)
+        except Exception:
+            logging.warning("Can't install requirements", exc_info=True)
+        pip_ms += (time.perf_counter() - started) * 1000
+        installed.update(packages)
+
+        retried = await import_modules([modules[index] for index in missing])
+        for index, result in zip(missing, retried):
+            if not isinstance(result, BaseException):
+                result[2]["pip_ms"] = pip_ms
+            imported[index] = result
+
+    success = failed = 0
+    for (name, core), result in zip(modules, imported):
+        try:
+            if isinstance(result, BaseException):
+                raise result
+            module, meta, stats = result
+            try:
+                _register_handlers(module, meta, client, stats)
+            except Exception as e:
+                _load_failed(stats, e)
+                raise
+        except Exception:
+            logging.warning(f"Can't import module {name}", exc_info=True)
+            failed += 1
+        else:
+            success += 1
+    return success, failed
 
 
-async def unload_module(module_name: str, client: Client) -> bool:
-    path = "modules.custom_modules." + module_name
+async def unload_module(module_name: str, client: Client, core=False) -> bool:
+    path = _module_path(module_name, core)
+    # a module imported on first use only has stubs until then
+    stubs = lazy_stubs.pop(module_name, [])
+    for handler, group in stubs:
+        router.remove_handler(client, handler, group)
     if path not in sys.modules:
-        return False
+        if stubs:
+            modules_help.pop(module_name, None)
+        return bool(stubs)
 
     module = importlib.import_module(path)
 
     for name, obj in vars(module).items():
         for handler, group in getattr(obj, "handlers", []):
-            client.remove_handler(handler, group)
+            router.remove_handler(client, handler, group)
 
-    del modules_help[module_name]
+    db.unsubscribe_all(path)
+
+    # core modules may register help under another name, reloading
+    # them overwrites it
+    modules_help.pop(module_name, None)
     del sys.modules[path]
+    load_stats.pop(module_name, None)
+    write_load_stats()
 
     return True
 
 
-def parse_meta_comments(code: str) -> Dict[str, str]:
+async def reload_module(
+    module_name: str, client: Client, core=False
+) -> ModuleType:
+    """
+    Replace handlers of a module with the ones from its current source,
+    the client stays connected. A source that doesn't compile raises
+    SyntaxError and the loaded module is kept
+    """
+    source = f"{_module_path(module_name, core).replace('.', '/')}.py"
+    # a file saved halfway through an edit doesn't unload the module
+    with open(source, "rb") as f:
+        compile(f.read(), source, "exec")
+    # bytecode is validated by mtime in whole seconds, quick successive
+    # edits could otherwise load a stale .pyc
+    with suppress(FileNotFoundError):
+        os.remove(importlib.util.cache_from_source(source))
+
+    await unload_module(module_name, client, core)
+    return await load_module(module_name, client, core=core)
+
+
+def _module_files() -> dict[Path, float]:
+    files = {}
+    for path in Path("modules").rglob("*.py"):
+        with suppress(FileNotFoundError):
+            files[path] = path.stat().st_mtime
+    return files
+
+
+async def watch_modules(client: Client, interval: float = 1.0):
+    """Reload modules when their files change, run it as a task"""
+    known = _module_files()
+    while True:
+        await asyncio.sleep(interval)
+        files = await asyncio.get_running_loop().run_in_executor(
+            None, _module_files
+        )
+        for path, mtime in files.items():
+            name = path.stem
+            core = "custom_modules" not in path.parent.parts
+            stats = load_stats.get(name)
+            # skip modules loaded after the change, e.g. by .loadmod
+            if known.get(path) == mtime or (
+                stats and not stats["error"] and stats["loaded_at"] >= mtime
+            ):
+                continue
+            try:
+                await reload_module(name, client, core)
+            except Exception:
+                logging.warning(f"Can't reload module {name}", exc_info=True)
+            else:
+                logging.info(f"Reloaded module {name}")
+
+        for path in known.keys() - files.keys():
+            core = "custom_modules" not in path.parent.parts
+            if await unload_module(path.stem, client, core):
+                logging.info(f"Unloaded removed module {path.stem}")
+        known = files
+
+
+def parse_meta_comments(code: str) -> dict[str, str]:
     try:
         groups = META_COMMENTS.search(code).groups()
     except AttributeError: